@@ -1,9 +1,11 @@
+import time
+# measured from the first import, so the startup report includes the time spent importing dependencies
+_startup_started = time.perf_counter()
 from logging.handlers import RotatingFileHandler
+import json
 import os
 import threading
-import time
 import yaml
-from flask_socketio import SocketIO
 
 import sys
 from flask import Flask, has_request_context
@@ -11,19 +13,39 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from psycopg2 import OperationalError
 import redis
-import spotipy
-from spotipy.oauth2 import  SpotifyClientCredentials
 from celery import Celery
 from celery.schedules import crontab
 from sqlalchemy import create_engine
 from config import Config
 from jellyfin.client import JellyfinClient
+from jellyfin.admin_session import AdminSession
+import transport
 import logging
-from spotdl.utils.config import DEFAULT_CONFIG
 from flask_caching import Cache
 from .version import __version__
 
 
+startup_steps = []
+_startup_mark = _startup_started
+def _startup_step(name):
+    """
+    Records the time spent since the previous step, shown in the startup report of the admin UI.
+    """
+    global _startup_mark
+    now = time.perf_counter()
+    startup_steps.append({'step': name, 'seconds': round(now - _startup_mark, 4)})
+    _startup_mark = now
+
+_startup_step('imports')
+
+if 'worker' in sys.argv:
+    process_role = 'worker'
+elif 'beat' in sys.argv:
+    process_role = 'beat'
+elif os.path.basename(sys.argv[0]) == 'run.py':
+    process_role = 'web'
+else:
+    process_role = 'cli'
 
 def check_db_connection(db_uri, retries=5, delay=5):
     """
@@ -80,6 +102,14 @@ def make_celery(app):
         'update_jellyfin_id_for_downloaded_tracks-schedule': {
             'task': 'app.tasks.update_jellyfin_id_for_downloaded_tracks',
             'schedule': crontab(minute='*/10'),  
+        },
+        'update_jellyfin_library_index-schedule': {
+            'task': 'app.tasks.update_jellyfin_library_index',
+            'schedule': crontab(minute='5-59/10'),  
+        },
+        'update_audio_profiles-schedule': {
+            'task': 'app.tasks.update_audio_profiles',
+            'schedule': crontab(minute='15-59/30'),  
         }
     }
     if app.config['LIDARR_API_KEY']:
@@ -87,6 +117,11 @@ def make_celery(app):
             'task': 'app.tasks.request_lidarr',
             'schedule': crontab(minute='50')
         }
+    if app.config['ENABLE_FINGERPRINT_STORE']:
+        celery.conf.beat_schedule['update_fingerprint_store-schedule'] = {
+            'task': 'app.tasks.update_fingerprint_store',
+            'schedule': crontab(minute='40')
+        }
     
     celery.conf.timezone = 'UTC'
     return celery
@@ -132,34 +167,47 @@ file_handler.setFormatter(logging.Formatter(FORMAT))
 app.logger.addHandler(file_handler)
 
 Config.validate_env_vars()
+_startup_step('config and logging')
 cache = Cache(app)
 redis_client = redis.StrictRedis(host=app.config['CACHE_REDIS_HOST'], port=app.config['CACHE_REDIS_PORT'], db=0, decode_responses=True)
+from .providers.track_cache import TrackCache
+track_cache = TrackCache(redis_client, ttl=app.config['TRACK_CACHE_TTL'], lru_size=app.config['TRACK_CACHE_LRU_SIZE'])
 
 
-# Spotify, Jellyfin, and Spotdl setup
-app.logger.info(f"setting up spotipy")
-sp = spotipy.Spotify(auth_manager=SpotifyClientCredentials(
-    client_id=app.config['SPOTIFY_CLIENT_ID'],
-    client_secret=app.config['SPOTIFY_CLIENT_SECRET']
-))
+transport.configure(
+    pool_maxsize=max(app.config['HTTP_POOL_MAXSIZE'], app.config['SPOTIFY_PLAYLIST_FETCH_WORKERS']),
+    max_retries=app.config['HTTP_MAX_RETRIES'],
+    backoff_factor=app.config['HTTP_BACKOFF_FACTOR'],
+    timeout=app.config['HTTP_REQUEST_TIMEOUT']
+)
 
+_startup_step('redis and http transport')
+
+# Jellyfin setup
 app.logger.info(f"setting up jellyfin client, BaseUrl = {app.config['JELLYFIN_SERVER_URL']}, timeout = {app.config['JELLYFIN_REQUEST_TIMEOUT']}")
 
 jellyfin = JellyfinClient(app.config['JELLYFIN_SERVER_URL'], app.config['JELLYFIN_REQUEST_TIMEOUT'])
-jellyfin_admin_token, jellyfin_admin_id, jellyfin_admin_name, jellyfin_admin_is_admin = jellyfin.login_with_password(
+# the admin token is shared by all processes through redis and only requested when it is first needed
+jellyfin_admin = AdminSession(
+    jellyfin, redis_client,
     app.config['JELLYFIN_ADMIN_USER'],
-    app.config['JELLYFIN_ADMIN_PASSWORD'], device_id= device_id
+    app.config['JELLYFIN_ADMIN_PASSWORD'], device_id='JellyPlist_admin'
 )
+_startup_step('jellyfin client')
 
 # SQLAlchemy and Migrate setup
 app.logger.info(f"connecting to db: {app.config['JELLYPLIST_DB_HOST']}:{app.config['JELLYPLIST_DB_PORT']}")
 db_uri = f'postgresql://{app.config["JELLYPLIST_DB_USER"]}:{app.config["JELLYPLIST_DB_PASSWORD"]}@{app.config["JELLYPLIST_DB_HOST"]}:{app.config['JELLYPLIST_DB_PORT']}/jellyplist'
-check_db_connection(db_uri=db_uri,retries=5,delay=2)
+if not app.config['LAZY_STARTUP']:
+    check_db_connection(db_uri=db_uri,retries=5,delay=2)
 app.config['SQLALCHEMY_DATABASE_URI'] = db_uri
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# connections are opened on first use, pre ping replaces the connection check at startup
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_pre_ping': True}
 db = SQLAlchemy(app)
 app.logger.info(f"applying db migrations")
 migrate = Migrate(app, db)
+_startup_step('database')
 
 # Celery Configuration (Updated)
 app.config.update(
@@ -176,33 +224,44 @@ def read_dev_build_file(file_path="/jellyplist/DEV_BUILD"):
         return ''
 app.logger.info(f"initializing celery")
 celery = make_celery(app)
-socketio = SocketIO(app, message_queue=app.config['REDIS_URL'], async_mode='eventlet')
 celery.set_default()
+_startup_step('celery')
+# celery processes don't serve websockets, so they don't need to load eventlet
+if process_role in ('worker', 'beat') and app.config['LAZY_STARTUP']:
+    socketio = None
+else:
+    from flask_socketio import SocketIO
+    socketio = SocketIO(app, message_queue=app.config['REDIS_URL'], async_mode='eventlet')
+_startup_step('socketio')
 
 app.logger.info(f'Jellyplist {__version__}{read_dev_build_file()} started')
 app.logger.debug(f"Debug logging active")
 
 from app.routes import pl_bp, routes, jellyfin_routes
 app.register_blueprint(pl_bp)
+from app import cli
 
 from app import filters  # Import the filters dictionary
 
 # Register all filters
 for name, func in filters.filters.items():
     app.jinja_env.filters[name] = func
+_startup_step('routes and filters')
     
     
 from .providers import SpotifyClient
 if app.config['SPOTIFY_COOKIE_FILE']:
     if os.path.exists(app.config['SPOTIFY_COOKIE_FILE']):
-        spotify_client = SpotifyClient(app.config['SPOTIFY_COOKIE_FILE'])
+        spotify_client = SpotifyClient(app.config['SPOTIFY_COOKIE_FILE'], max_workers=app.config['SPOTIFY_PLAYLIST_FETCH_WORKERS'])
     else:
         app.logger.error(f"Cookie file {app.config['SPOTIFY_COOKIE_FILE']} does not exist. Exiting.")
         sys.exit(1)
 else:
-    spotify_client = SpotifyClient()
+    spotify_client = SpotifyClient(max_workers=app.config['SPOTIFY_PLAYLIST_FETCH_WORKERS'])
     
-spotify_client.authenticate()
+# with LAZY_STARTUP the client authenticates on its first request
+if not app.config['LAZY_STARTUP']:
+    spotify_client.authenticate()
 from .registry import MusicProviderRegistry
 MusicProviderRegistry.register_provider(spotify_client)
 
@@ -216,6 +275,7 @@ if app.config['LIDARR_API_KEY'] and app.config['LIDARR_URL']:
     app.logger.info(f'Creating Lidarr Client with URL: {app.config["LIDARR_URL"]}')
     from lidarr.client import LidarrClient
     lidarr_client = LidarrClient(app.config['LIDARR_URL'], app.config['LIDARR_API_KEY'])
+_startup_step('providers')
 
 
 
@@ -240,4 +300,26 @@ if os.path.exists(yaml_file):
     #     args=('settings.yaml',),
     #     daemon=True
     # )
-    # watcher_thread.start()
\ No newline at end of file
+    # watcher_thread.start()
+_startup_step('settings')
+
+def _publish_startup_report():
+    """
+    Stores the startup report of this process in redis, so the admin UI can show it for the web app, worker and beat.
+    """
+    report = {
+        'role': process_role,
+        'pid': os.getpid(),
+        'started_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'lazy_startup': app.config['LAZY_STARTUP'],
+        'total_seconds': round(time.perf_counter() - _startup_started, 4),
+        'loaded_modules': len(sys.modules),
+        'steps': startup_steps,
+    }
+    app.logger.info(f"Startup of {process_role} took {report['total_seconds']}s")
+    try:
+        redis_client.set(f'startup_report_{process_role}', json.dumps(report))
+    except redis.RedisError as e:
+        app.logger.warning(f"Could not store startup report: {str(e)}")
+
+_publish_startup_report()
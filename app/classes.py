@@ -1,13 +1,25 @@
 from dataclasses import dataclass
 from datetime import datetime
+import os
 import subprocess
 import json
+import mutagen
 from flask import current_app as app  # Adjust this based on your app's structure
 from typing import List, Optional
 
+# containers whose headers are read with mutagen, everything else is analyzed by ffprobe
+_HEADER_CODECS = {
+    'MP3': 'mp3',
+    'FLAC': 'flac',
+    'OggOpus': 'opus',
+    'OggVorbis': 'vorbis',
+    'MP4': None,  # the codec is taken from the stream info, e.g. aac or alac
+}
+
 
 class AudioProfile:
-    def __init__(self, path: str, bitrate: int = 0, sample_rate: int = 0, channels: int = 0) -> None:
+    def __init__(self, path: str, bitrate: int = 0, sample_rate: int = 0, channels: int = 0,
+                 codec: Optional[str] = None, duration: Optional[float] = None) -> None:
         """
         Initialize an AudioProfile instance.
 
@@ -16,16 +28,21 @@ class AudioProfile:
             bitrate (int): The audio bitrate in kbps. Default is 0.
             sample_rate (int): The sample rate in Hz. Default is 0.
             channels (int): The number of audio channels. Default is 0.
+            codec (str): The name of the audio codec, e.g. mp3 or flac. Default is None.
+            duration (float): The duration in seconds. Default is None.
         """
         self.path: str = path
         self.bitrate: int = bitrate  # in kbps
         self.sample_rate: int = sample_rate  # in Hz
         self.channels: int = channels
+        self.codec: Optional[str] = codec
+        self.duration: Optional[float] = duration  # in seconds
 
     @staticmethod
     def analyze_audio_quality_with_ffprobe(filepath: str) -> Optional['AudioProfile']:
         """
-        Static method to analyze audio quality using ffprobe and return an AudioProfile instance.
+        Static method to analyze audio quality and return an AudioProfile instance.
+        The headers of common formats are read directly, ffprobe is only used for other formats.
 
         Args:
             filepath (str): Path to the audio file to analyze.
@@ -34,33 +51,107 @@ class AudioProfile:
             Optional[AudioProfile]: An instance of AudioProfile if analysis is successful, None otherwise.
         """
         try:
-            # ffprobe command to extract bitrate, sample rate, and channel count
-            cmd = [
-                'ffprobe', '-v', 'error', '-select_streams', 'a:0',
-                '-show_entries', 'stream=bit_rate,sample_rate,channels',
-                '-show_format',
-                '-of', 'json', filepath
-            ]
-            result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-            if result.returncode != 0:
-                app.logger.error(f"ffprobe error for file {filepath}: {result.stderr}")
-                return None
-
-            # Parse ffprobe output
-            data = json.loads(result.stdout)
-            stream = data.get('streams', [{}])[0]
-            bitrate: int = int(stream.get('bit_rate', 0)) // 1000  # Convert to kbps
-            if bitrate == 0:  # Fallback if no bit_rate in stream
-                bitrate = int(data.get('format').get('bit_rate', 0)) // 1000
-            sample_rate: int = int(stream.get('sample_rate', 0))  # Hz
-            channels: int = int(stream.get('channels', 0))
-
-            # Create an AudioProfile instance
-            return AudioProfile(filepath, bitrate, sample_rate, channels)
+            return AudioProfile.probe(filepath)
         except Exception as e:
             app.logger.error(f"Error analyzing audio quality with ffprobe: {str(e)}")
             return None
 
+    @staticmethod
+    def probe(filepath: str) -> 'AudioProfile':
+        """
+        Analyzes a file, reading the headers if the format is known and running ffprobe otherwise.
+        Does not depend on the app, so it can run in worker processes.
+
+        Args:
+            filepath (str): Path to the audio file to analyze.
+
+        Returns:
+            AudioProfile: The analyzed profile.
+
+        Raises:
+            RuntimeError: If ffprobe fails.
+        """
+        return AudioProfile.read_header(filepath) or AudioProfile.probe_with_ffprobe(filepath)
+
+    @staticmethod
+    def read_header(filepath: str) -> Optional['AudioProfile']:
+        """
+        Reads the stream info from the headers of mp3, flac, m4a, opus and vorbis files with mutagen,
+        without starting a process.
+
+        Args:
+            filepath (str): Path to the audio file to analyze.
+
+        Returns:
+            Optional[AudioProfile]: The profile, or None if the format is not known or the headers could not be read.
+        """
+        try:
+            audio = mutagen.File(filepath)
+        except Exception:
+            return None
+        if audio is None or type(audio).__name__ not in _HEADER_CODECS:
+            return None
+        info = audio.info
+        sample_rate = int(getattr(info, 'sample_rate', 0) or 0)
+        channels = int(getattr(info, 'channels', 0) or 0)
+        duration = float(getattr(info, 'length', 0) or 0)
+        if not sample_rate or not channels:
+            return None
+        codec = _HEADER_CODECS[type(audio).__name__]
+        if codec is None:
+            codec = getattr(info, 'codec', '') or ''
+            codec = 'aac' if codec.startswith('mp4a') else codec or None
+        bitrate = int(getattr(info, 'bitrate', 0) or 0) // 1000  # Convert to kbps
+        if bitrate == 0 and duration:  # like ffprobe, fall back to the average bitrate of the file
+            bitrate = int(os.path.getsize(filepath) * 8 / duration) // 1000
+        return AudioProfile(filepath, bitrate, sample_rate, channels, codec, duration or None)
+
+    @staticmethod
+    def probe_with_ffprobe(filepath: str) -> 'AudioProfile':
+        """
+        Runs ffprobe on a file. Does not depend on the app, so it can run in worker processes.
+
+        Args:
+            filepath (str): Path to the audio file to analyze.
+
+        Returns:
+            AudioProfile: The analyzed profile.
+
+        Raises:
+            RuntimeError: If ffprobe fails.
+        """
+        # ffprobe command to extract codec, bitrate, sample rate, channel count and duration
+        cmd = [
+            'ffprobe', '-v', 'error', '-select_streams', 'a:0',
+            '-show_entries', 'stream=codec_name,bit_rate,sample_rate,channels,duration',
+            '-show_format',
+            '-of', 'json', filepath
+        ]
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"ffprobe error for file {filepath}: {result.stderr}")
+
+        # Parse ffprobe output
+        data = json.loads(result.stdout)
+        stream = data.get('streams', [{}])[0]
+        bitrate: int = int(stream.get('bit_rate', 0)) // 1000  # Convert to kbps
+        if bitrate == 0:  # Fallback if no bit_rate in stream
+            bitrate = int(data.get('format').get('bit_rate', 0)) // 1000
+        sample_rate: int = int(stream.get('sample_rate', 0))  # Hz
+        channels: int = int(stream.get('channels', 0))
+        codec: Optional[str] = stream.get('codec_name')
+        duration = stream.get('duration') or data.get('format', {}).get('duration')
+
+        # Create an AudioProfile instance
+        return AudioProfile(filepath, bitrate, sample_rate, channels, codec, float(duration) if duration else None)
+
+    def to_dict(self) -> dict:
+        """
+        Returns the analyzed values, used to cache the profile.
+        """
+        return {'bitrate': self.bitrate, 'sample_rate': self.sample_rate, 'channels': self.channels,
+                'codec': self.codec, 'duration': self.duration}
+
     def compute_quality_score(self) -> int:
         """
         Compute a quality score based on bitrate, sample rate, and channels.
@@ -77,8 +168,8 @@ class AudioProfile:
         Returns:
             str: A string representation of the AudioProfile instance.
         """
-        return (f"AudioProfile(path='{self.path}', bitrate={self.bitrate} kbps, "
-                f"sample_rate={self.sample_rate} Hz, channels={self.channels})")
+        return (f"AudioProfile(path='{self.path}', codec={self.codec}, bitrate={self.bitrate} kbps, "
+                f"sample_rate={self.sample_rate} Hz, channels={self.channels}, duration={self.duration} s)")
 
 
 @dataclass
@@ -0,0 +1,65 @@
+import sys
+from typing import List
+
+import click
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+
+from app import app, db
+from app.models import Playlist, Track, playlist_tracks
+
+
+def _index_names(plan: dict) -> List[str]:
+    names = [plan['Index Name']] if 'Index Name' in plan else []
+    for child in plan.get('Plans', []):
+        names.extend(_index_names(child))
+    return names
+
+
+def _hot_queries():
+    """
+    The queries of the scheduled tasks and views together with the index the planner is expected to use for them.
+    """
+    return [
+        ('download_missing_tracks', 'ix_track_not_downloaded',
+         db.select(Track.id).where(Track.downloaded == False, Track.provider_id == 'Spotify').order_by(Track.id)),
+        ('update_jellyfin_id_for_downloaded_tracks', 'ix_track_unlinked',
+         db.select(Track.id).where(Track.downloaded == True, Track.jellyfin_id == None,
+                                   (Track.quality_score < app.config['QUALITY_SCORE_THRESHOLD']) | (Track.quality_score == None))),
+        ('update_jellyfin_id_for_downloaded_tracks (full)', 'ix_track_quality_score',
+         db.select(Track.id).where((Track.quality_score < app.config['QUALITY_SCORE_THRESHOLD']) | (Track.quality_score == None))),
+        ('unlinked_track_count', 'ix_track_unlinked',
+         db.select(db.func.count(Track.id)).where(Track.downloaded == True, Track.jellyfin_id.is_(None))),
+        ('request_lidarr', 'ix_track_lidarr_unprocessed',
+         db.select(Track.id).where(Track.lidarr_processed == False)),
+        # provider_track_id is unique, its constraint index serves the lookup together with the provider
+        ('track by provider id', 'track_provider_track_id_key',
+         db.select(Track.id).where(Track.provider_track_id == 'x', Track.provider_id == 'Spotify')),
+        ('playlist by jellyfin id', 'ix_playlist_jellyfin_id',
+         db.select(Playlist.id).where(Playlist.jellyfin_id == 'x')),
+        ('check_for_playlist_updates ordered tracks', 'ix_playlist_tracks_playlist_id_track_order',
+         db.select(playlist_tracks.c.track_id).where(playlist_tracks.c.playlist_id == 1).order_by(playlist_tracks.c.track_order)),
+    ]
+
+
+@app.cli.command('check-indexes')
+def check_indexes():
+    """
+    Runs EXPLAIN for the hot queries and fails if the planner doesn't use the expected index.
+    Sequential scans are disabled for the check, so it also works on a small database.
+    """
+    failed = 0
+    with db.engine.connect() as connection:
+        with connection.begin():
+            connection.execute(text('SET LOCAL enable_seqscan = off'))
+            for name, index_name, stmt in _hot_queries():
+                sql = str(stmt.compile(dialect=postgresql.dialect(), compile_kwargs={'literal_binds': True}))
+                plan = connection.execute(text(f'EXPLAIN (FORMAT JSON) {sql}')).scalar()[0]['Plan']
+                used = _index_names(plan)
+                if index_name in used:
+                    click.echo(f'OK      {name}: {index_name}')
+                else:
+                    failed += 1
+                    click.echo(f'FAILED  {name}: expected {index_name}, planner used {used or plan["Node Type"]}')
+    if failed:
+        sys.exit(1)
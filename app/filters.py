@@ -1,8 +1,6 @@
-import os
 import re
 from markupsafe import Markup
 
-from app.classes import AudioProfile
 from app import app, functions, read_dev_build_file
 from .version import __version__
 
@@ -36,26 +34,6 @@ def highlight_search(text: str, search_query: str) -> Markup:
     return Markup(highlighted_text)
 
 
-@template_filter('audioprofile')
-def audioprofile(text: str, path: str) -> Markup:
-    if not path or not os.path.exists(path):
-        return Markup()  # Return the original text if the file does not exist
-
-    # Create the AudioProfile instance using the static method
-    audio_profile = AudioProfile.analyze_audio_quality_with_ffprobe(path)
-    if not audio_profile:
-        return Markup(f"<span style='color: red;'>ERROR</span>")
-
-    # Create a nicely formatted HTML representation
-    audio_profile_html = (
-        f"<strong>Bitrate:</strong> {audio_profile.bitrate} kbps<br>"
-        f"<strong>Sample Rate:</strong> {audio_profile.sample_rate} Hz<br>"
-        f"<strong>Channels:</strong> {audio_profile.channels}<br>"
-        f"<strong>Quality Score:</strong> {audio_profile.compute_quality_score()}"
-        
-    )
-    return Markup(audio_profile_html)
-
 @template_filter('version_check')
 def version_check(version: str) -> Markup:
     version = f"{__version__}{read_dev_build_file()}"
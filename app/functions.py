@@ -1,10 +1,17 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
 import json
+import os
 from typing import List, Optional
 from flask import flash, redirect, session, url_for,g
 import requests
-from app.classes import CombinedPlaylistData, CombinedTrackData
-from app.models import JellyfinUser, Playlist,Track  
-from app import  sp, cache, app, jellyfin  ,jellyfin_admin_token, jellyfin_admin_id,device_id, cache, redis_client
+import transport
+from sqlalchemy import bindparam, delete, func, insert, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from app.classes import AudioProfile, CombinedPlaylistData, CombinedTrackData
+from app import matching
+from app.models import JellyfinFingerprint, JellyfinItem, JellyfinUser, Playlist,Track, playlist_tracks, user_playlists
+from app import  cache, app, db, jellyfin  ,jellyfin_admin,device_id, cache, redis_client, track_cache
 from functools import  wraps
 from celery.result import AsyncResult
 from app.providers import base
@@ -13,50 +20,102 @@ from app.registry.music_provider_registry import MusicProviderRegistry
 from lidarr.classes import Album, Artist
 from . import tasks
 from jellyfin.objects import PlaylistMetadata
-from spotipy.exceptions import SpotifyException
 
 import re
 
 def prepPlaylistData(playlist: base.Playlist) -> Optional[CombinedPlaylistData]:
-    jellyfin_user = JellyfinUser.query.filter_by(jellyfin_user_id=session['jellyfin_user_id']).first()
-    if not jellyfin_user:
+    combined = prepPlaylistsData([playlist]) if playlist else []
+    return combined[0] if combined else None
+
+def prepPlaylistsData(playlists: List[base.Playlist]) -> List[CombinedPlaylistData]:
+    """
+    Combines provider playlists with their database state. The state of all playlists is read with one
+    aggregate query, so the number of queries doesn't depend on the number of playlists.
+    :param playlists: The playlists as returned by the provider.
+    :return: A CombinedPlaylistData for each playlist, in the same order.
+    """
+    jellyfin_user_id = db.session.scalar(db.select(JellyfinUser.id).filter_by(jellyfin_user_id=session['jellyfin_user_id']))
+    if not jellyfin_user_id:
         app.logger.error(f"jellyfin_user not set: session user id: {session['jellyfin_user_id']}. Logout and Login again")
-        return None
+        return []
+
+    playlist_stats = get_playlist_stats([playlist.id for playlist in playlists], jellyfin_user_id)
+    combined = []
+    for playlist in playlists:
+        db_playlist, tracks_linked, is_member = playlist_stats.get(playlist.id, (None, 0, False))
+
+        # Initialize default values
+        track_count = (db_playlist.track_count or 0) if db_playlist else 0
+        tracks_available = (db_playlist.tracks_available or 0) if db_playlist else 0
+        percent_available = (tracks_available / track_count * 100) if track_count > 0 else 0
+
+        # Determine playlist status
+        if tracks_available == track_count and track_count > 0:
+            status = 'green'  # Fully available
+        elif tracks_available > 0:
+            status = 'yellow'  # Partially available
+        else:
+            status = 'red'  # Not available
+
+        # Build and return the PlaylistResponse object
+        combined.append(CombinedPlaylistData(
+            name=playlist.name,
+            description=playlist.description,
+            image=playlist.images[0].url if playlist.images else '/static/images/placeholder.png',
+            url=playlist.external_urls[0].url if playlist.external_urls else '',
+            id=playlist.id,
+            jellyfin_id=db_playlist.jellyfin_id if db_playlist else '',
+            can_add=not is_member if db_playlist else True,
+            can_remove=is_member if db_playlist else False,
+            last_updated=db_playlist.last_updated if db_playlist else None,
+            last_changed=db_playlist.last_changed if db_playlist else None,
+            tracks_available=tracks_available,
+            track_count=track_count,
+            tracks_linked=tracks_linked,
+            percent_available=percent_available,
+            status=status
+        ))
+    return combined
+
+def get_playlist_stats(provider_playlist_ids: List[str], jellyfin_user_id: int) -> dict:
+    """
+    Reads the database playlists for the given provider playlist ids, together with the number of linked
+    tracks and the membership of the given user, in a single query.
+    :param provider_playlist_ids: The provider ids of the playlists.
+    :param jellyfin_user_id: The database id of the JellyfinUser.
+    :return: A dict provider_playlist_id -> (Playlist, tracks_linked, is_member) for the playlists found in the database.
+    """
+    if not provider_playlist_ids:
+        return {}
+    requested = db.select(Playlist.id).where(Playlist.provider_playlist_id.in_(set(provider_playlist_ids)))
+    # only the linked tracks of the requested playlists are counted, not those of all playlists
+    linked = (
+        db.select(playlist_tracks.c.playlist_id, func.count().label('tracks_linked'))
+        .join(Track, Track.id == playlist_tracks.c.track_id)
+        .where(Track.jellyfin_id.isnot(None))
+        .where(playlist_tracks.c.playlist_id.in_(requested))
+        .group_by(playlist_tracks.c.playlist_id)
+        .subquery()
+    )
+    membership = (
+        db.select(user_playlists.c.playlist_id)
+        .where(user_playlists.c.user_id == jellyfin_user_id)
+        .subquery()
+    )
+    stmt = (
+        db.select(Playlist, func.coalesce(linked.c.tracks_linked, 0), membership.c.playlist_id.isnot(None))
+        .outerjoin(linked, linked.c.playlist_id == Playlist.id)
+        .outerjoin(membership, membership.c.playlist_id == Playlist.id)
+        .where(Playlist.provider_playlist_id.in_(set(provider_playlist_ids)))
+    )
+    return {
+        db_playlist.provider_playlist_id: (db_playlist, tracks_linked, is_member)
+        for db_playlist, tracks_linked, is_member in db.session.execute(stmt)
+    }
 
-    # Fetch the playlist from the database if it exists
-    db_playlist : Playlist = Playlist.query.filter_by(provider_playlist_id=playlist.id).first() if playlist else None
-
-    # Initialize default values
-    track_count = db_playlist.track_count if db_playlist else 0
-    tracks_available = db_playlist.tracks_available if db_playlist else 0
-    tracks_linked = len([track for track in db_playlist.tracks if track.jellyfin_id]) if db_playlist else 0
-    percent_available = (tracks_available / track_count * 100) if track_count > 0 else 0
-
-    # Determine playlist status
-    if tracks_available == track_count and track_count > 0:
-        status = 'green'  # Fully available
-    elif tracks_available > 0:
-        status = 'yellow'  # Partially available
-    else:
-        status = 'red'  # Not available
-
-    # Build and return the PlaylistResponse object
-    return CombinedPlaylistData(
-        name=playlist.name,
-        description=playlist.description,
-        image=playlist.images[0].url if playlist.images else '/static/images/placeholder.png',
-        url=playlist.external_urls[0].url if playlist.external_urls else '',
-        id=playlist.id,
-        jellyfin_id=db_playlist.jellyfin_id if db_playlist else '',
-        can_add=(db_playlist not in jellyfin_user.playlists) if db_playlist else True,
-        can_remove=(db_playlist in jellyfin_user.playlists) if db_playlist else False,
-        last_updated=db_playlist.last_updated if db_playlist else None,
-        last_changed=db_playlist.last_changed if db_playlist else None,
-        tracks_available=tracks_available,
-        track_count=track_count,
-        tracks_linked=tracks_linked,
-        percent_available=percent_available,
-        status=status
+def get_unlinked_track_count() -> int:
+    return db.session.scalar(
+        db.select(func.count(Track.id)).where(Track.downloaded == True, Track.jellyfin_id.is_(None))
     )
 
 def lidarr_quality_profile_id(profile_id=None):
@@ -95,22 +154,54 @@ def apply_default_profile_and_root_folder(object : Artist ) -> Artist:
         object.metadataProfileId = 1
     return object
 
-@cache.memoize(timeout=3600*24*10) 
 def get_cached_provider_track(track_id : str,provider_id : str)-> base.Track:
     """
-    Fetches a Spotify track by its ID, utilizing caching to minimize API calls.
+    Fetches a track by its ID, utilizing the track cache to minimize API calls.
 
-    :param track_id: The Spotify playlist ID.
-    :return: Track data as a dictionary, or None if an error occurs.
+    :param track_id: The provider track ID.
+    :param provider_id: The provider of the track.
+    :return: The Track, or None if an error occurs.
     """
-    try:
-        # get the provider from the registry
-        provider = MusicProviderRegistry.get_provider(provider_id)
-        track_data = provider.get_track(track_id)
-        return track_data
-    except Exception as e:
-        app.logger.error(f"Error fetching track {track_id} from {provider_id}: {str(e)}")
-        return None
+    return get_cached_provider_tracks([track_id], provider_id).get(track_id)
+
+def get_cached_provider_tracks(track_ids : List[str], provider_id : str) -> dict:
+    """
+    Fetches many tracks of a provider. Cached tracks are looked up at once, the others are fetched
+    with a single batch request to the provider and cached.
+
+    :param track_ids: The provider track IDs, may contain duplicates.
+    :param provider_id: The provider of the tracks.
+    :return: A dict track id -> Track, tracks which could not be fetched are None.
+    """
+    result = {track_id: None for track_id in track_ids}
+    result.update(track_cache.get_many(provider_id, track_ids))
+    missing = [track_id for track_id, track in result.items() if track is None]
+    if missing:
+        try:
+            # get the provider from the registry
+            provider = MusicProviderRegistry.get_provider(provider_id)
+            fetched = provider.get_tracks(missing)
+            result.update(zip(missing, fetched))
+            track_cache.set_many(provider_id, fetched)
+        except Exception as e:
+            app.logger.error(f"Error fetching {len(missing)} tracks from {provider_id}: {str(e)}")
+    return result
+
+def get_cached_provider_tracks_of(tracks : List[Track]) -> dict:
+    """
+    Fetches the provider tracks of many db tracks, with one batch per provider.
+
+    :param tracks: The tracks from the db.
+    :return: A dict Track.id -> provider Track, or None if it could not be fetched.
+    """
+    by_provider = {}
+    for track in tracks:
+        by_provider.setdefault(track.provider_id, []).append(track)
+    result = {}
+    for provider_id, provider_tracks in by_provider.items():
+        fetched = get_cached_provider_tracks([track.provider_track_id for track in provider_tracks], provider_id)
+        result.update({track.id: fetched.get(track.provider_track_id) for track in provider_tracks})
+    return result
 
 @cache.memoize(timeout=3600)
 def get_cached_provider_playlist(playlist_id : str,provider_id : str)-> base.Playlist:
@@ -129,10 +220,475 @@ def get_cached_provider_playlist(playlist_id : str,provider_id : str)-> base.Pla
         app.logger.error(f"Error fetching playlist {playlist_id} from {provider_id}: {str(e)}")
         return None
 
+def _provider_track_match_keys(provider_track: base.Track) -> dict:
+    return matching.track_match_keys(provider_track.name, [artist.name for artist in provider_track.artists], provider_track.duration_ms,
+                                     provider_track.album.name if provider_track.album else None)
+
+def sync_playlist_tracks(playlist: Playlist, provider_tracks: List[PlaylistTrack]) -> dict:
+    """
+    Brings the playlist_tracks membership of a playlist in line with the track list from the provider,
+    using set based statements instead of one query per track. Everything happens in one transaction.
+
+    :param playlist: The playlist from the database.
+    :param provider_tracks: The ordered tracks of the playlist as returned by the provider.
+    :return: A dict with the number of inserted, removed and reordered tracks and the number of newly created Track rows.
+    """
+    # the first occurrence of a track defines its position, playlist_tracks can hold every track only once
+    desired = {}
+    for idx, track_info in enumerate(provider_tracks):
+        if track_info and track_info.track and track_info.track.id not in desired:
+            desired[track_info.track.id] = (idx, track_info.track)
+
+    try:
+        # load the current membership with one query
+        existing = {
+            row.provider_track_id: (row.id, row.track_order)
+            for row in db.session.execute(
+                db.select(Track.id, Track.provider_track_id, playlist_tracks.c.track_order)
+                .join(playlist_tracks, playlist_tracks.c.track_id == Track.id)
+                .where(playlist_tracks.c.playlist_id == playlist.id)
+            )
+        }
+
+        # resolve all tracks which are not yet part of the playlist with one IN lookup
+        missing_ids = [track_id for track_id in desired if track_id not in existing]
+        known_tracks = {}
+        if missing_ids:
+            known_tracks = dict(db.session.execute(
+                db.select(Track.provider_track_id, Track.id)
+                .where(Track.provider_id == playlist.provider_id)
+                .where(Track.provider_track_id.in_(missing_ids))
+            ).all())
+
+        # bulk insert the Track rows which do not exist at all
+        new_tracks = [
+            {
+                'name': desired[track_id][1].name[:200],
+                'provider_track_id': track_id,
+                'provider_uri': desired[track_id][1].uri,
+                'downloaded': False,
+                'provider_id': playlist.provider_id,
+                **_provider_track_match_keys(desired[track_id][1])
+            }
+            for track_id in missing_ids if track_id not in known_tracks
+        ]
+        if new_tracks:
+            created = db.session.execute(
+                insert(Track).returning(Track.provider_track_id, Track.id),
+                new_tracks
+            ).all()
+            known_tracks.update(dict(created))
+
+        to_insert = [
+            {'playlist_id': playlist.id, 'track_id': known_tracks[track_id], 'track_order': desired[track_id][0]}
+            for track_id in missing_ids
+        ]
+        to_reorder = [
+            {'b_track_id': track_id, 'b_track_order': desired[provider_track_id][0]}
+            for provider_track_id, (track_id, track_order) in existing.items()
+            if provider_track_id in desired and desired[provider_track_id][0] != track_order
+        ]
+        to_remove = [
+            track_id
+            for provider_track_id, (track_id, _) in existing.items()
+            if provider_track_id not in desired
+        ]
+
+        # tracks created before the match keys were introduced get them now, the provider data is at hand
+        without_keys = db.session.execute(
+            db.select(Track.id, Track.provider_track_id)
+            .where(Track.provider_id == playlist.provider_id)
+            .where(Track.provider_track_id.in_(list(desired)))
+            .where(Track.match_artist_names == None)
+        ).all()
+        if without_keys:
+            db.session.execute(update(Track), [
+                {'id': row.id, **_provider_track_match_keys(desired[row.provider_track_id][1])} for row in without_keys
+            ])
+
+        if to_insert:
+            db.session.execute(insert(playlist_tracks), to_insert)
+        if to_reorder:
+            db.session.execute(
+                update(playlist_tracks)
+                .where(playlist_tracks.c.playlist_id == playlist.id)
+                .where(playlist_tracks.c.track_id == bindparam('b_track_id'))
+                .values(track_order=bindparam('b_track_order')),
+                to_reorder
+            )
+        if to_remove:
+            db.session.execute(
+                delete(playlist_tracks)
+                .where(playlist_tracks.c.playlist_id == playlist.id)
+                .where(playlist_tracks.c.track_id.in_(to_remove))
+            )
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    # the relationship was changed behind the back of the ORM
+    db.session.expire(playlist, ['tracks'])
+    return {
+        'inserted': len(to_insert),
+        'removed': len(to_remove),
+        'reordered': len(to_reorder),
+        'created': len(new_tracks)
+    }
+
+# the version suffix changes whenever the keys of the index change, so the index is rebuilt completely
+JELLYFIN_INDEX_WATERMARK_KEY = 'jellyfin_library_index_watermark_v3'
+
+def refresh_playlist_counters(playlist_ids: Optional[List[int]] = None) -> int:
+    """
+    Recomputes track_count and tracks_available of the playlists with a single UPDATE ... FROM an aggregate
+    over playlist_tracks. Has to be called after changes to Track.downloaded or to the tracks of a playlist.
+    The caller is responsible for committing.
+    :param playlist_ids: Limit the refresh to these playlists, all playlists are refreshed if not given.
+    :return: The number of playlists whose counters changed.
+    """
+    playlist = Playlist.__table__
+    p = playlist.alias('p')
+    counts = (
+        db.select(
+            p.c.id.label('playlist_id'),
+            func.count(playlist_tracks.c.track_id).label('track_count'),
+            func.count(playlist_tracks.c.track_id).filter(Track.downloaded == True).label('tracks_available')
+        )
+        .select_from(p)
+        .outerjoin(playlist_tracks, playlist_tracks.c.playlist_id == p.c.id)
+        .outerjoin(Track, Track.id == playlist_tracks.c.track_id)
+        .group_by(p.c.id)
+    )
+    if playlist_ids is not None:
+        if not playlist_ids:
+            return 0
+        counts = counts.where(p.c.id.in_(playlist_ids))
+    counts = counts.subquery()
+    result = db.session.execute(
+        update(playlist)
+        .where(playlist.c.id == counts.c.playlist_id)
+        .where(
+            playlist.c.track_count.is_distinct_from(counts.c.track_count)
+            | playlist.c.tracks_available.is_distinct_from(counts.c.tracks_available)
+        )
+        .values(track_count=counts.c.track_count, tracks_available=counts.c.tracks_available)
+    )
+    return result.rowcount
+
+def upsert_jellyfin_items(items: List[dict], indexed_at: datetime) -> None:
+    """
+    Inserts or updates Audio items from the Jellyfin /Items endpoint in the local library index.
+
+    :param items: The items as returned by Jellyfin.
+    :param indexed_at: Timestamp of the indexing run, used to find items which were removed from the library.
+    """
+    if not items:
+        return
+    rows = []
+    for item in items:
+        keys = matching.jellyfin_item_match_keys(item)
+        rows.append({
+            'id': item['Id'],
+            'name': item.get('Name', ''),
+            'name_key': keys['title'],
+            'artists': item.get('Artists', []),
+            'album_artists': [artist['Name'] for artist in item.get('AlbumArtists', [])],
+            'album': item.get('Album'),
+            'artists_key': keys['artists'],
+            'album_artists_key': keys['album_artists'],
+            'run_time_ticks': item.get('RunTimeTicks'),
+            'path': item.get('Path'),
+            'container': item.get('Container'),
+            'has_lyrics': bool(item.get('HasLyrics')),
+            'indexed_at': indexed_at
+        })
+    stmt = pg_insert(JellyfinItem).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[JellyfinItem.id],
+        set_={column: stmt.excluded[column] for column in rows[0] if column != 'id'}
+    )
+    db.session.execute(stmt)
+    db.session.commit()
+
+def jellyfin_index_ready() -> bool:
+    """
+    The local library index can be used once it has been built completely at least once.
+    """
+    return bool(redis_client.get(JELLYFIN_INDEX_WATERMARK_KEY))
+
+def lookup_jellyfin_index(match_title: str) -> List[dict]:
+    """
+    Looks up all items of the local library index with the given folded title.
+
+    :param match_title: The title as folded by matching.fold_title, e.g. Track.match_title.
+    :return: Matching items in the shape of Jellyfin search results, with their precomputed match keys.
+    """
+    items = JellyfinItem.query.filter_by(name_key=match_title).all()
+    return [item.to_search_result() for item in items]
+
+def lookup_jellyfin_index_fuzzy(match_title: str) -> List[dict]:
+    """
+    Looks up candidates for the fuzzy matcher in the local library index, when no item has the exact folded title.
+    The items with the most similar titles by trigram similarity are returned, at most MATCH_MAX_CANDIDATES,
+    using the trigram index over the folded titles.
+
+    :param match_title: The title as folded by matching.fold_title, e.g. Track.match_title.
+    :return: Items in the shape of Jellyfin search results, with their precomputed match keys.
+    """
+    if not match_title:
+        return []
+    items = (JellyfinItem.query
+             .filter(JellyfinItem.name_key.bool_op('%')(match_title))
+             .order_by(func.similarity(JellyfinItem.name_key, match_title).desc(), JellyfinItem.id)
+             .limit(app.config['MATCH_MAX_CANDIDATES'])
+             .all())
+    return [item.to_search_result() for item in items]
+
+def match_thresholds() -> matching.MatchThresholds:
+    return matching.MatchThresholds(
+        min_score=app.config['MATCH_MIN_SCORE'],
+        min_title_similarity=app.config['MATCH_MIN_TITLE_SIMILARITY'],
+        min_artists_similarity=app.config['MATCH_MIN_ARTISTS_SIMILARITY'],
+        duration_tolerance_ms=app.config['MATCH_DURATION_TOLERANCE_MS'],
+        max_duration_diff_ms=app.config['MATCH_MAX_DURATION_DIFF_MS'],
+    )
+
+def score_jellyfin_candidates(track: Track, items: List[dict]):
+    """
+    Scores Jellyfin items as matches of a track by its stored match keys with the thresholds from the config,
+    see matching.score_candidates.
+    """
+    return matching.score_candidates(track.match_keys, items, match_thresholds())
+
+def ensure_match_keys(track: Track) -> bool:
+    """
+    Computes the match keys of a track created before they were introduced. The caller commits.
+
+    :return: True if the track has match keys.
+    """
+    if track.match_artist_names is not None:
+        return True
+    provider_track = get_cached_provider_track(track.provider_track_id, track.provider_id)
+    if not provider_track:
+        return False
+    for column, value in _provider_track_match_keys(provider_track).items():
+        setattr(track, column, value)
+    return True
+
+def get_stored_fingerprint(item: dict):
+    """
+    Looks up the stored fingerprint of a Jellyfin item, used as fingerprint_store of JellyfinClient.search_track_in_jellyfin.
+    :param item: The item as returned by Jellyfin, with Id and Path.
+    :return: The fingerprint as uint32 array, or None if there is none for the current version of the file.
+    """
+    from jellyfin.fingerprint import from_bytes
+    stored = db.session.get(JellyfinFingerprint, item['Id'])
+    if not stored:
+        return None
+    try:
+        if os.path.getmtime(item['Path']) != stored.file_mtime:
+            return None
+    except OSError:
+        return None
+    return from_bytes(stored.fingerprint)
+
+def upsert_fingerprints(fingerprints: List[dict]) -> None:
+    """
+    Inserts or updates fingerprints in the store and commits.
+    :param fingerprints: Dicts with item_id, file_mtime, fingerprint (bytes) and computed_at.
+    """
+    if not fingerprints:
+        return
+    stmt = pg_insert(JellyfinFingerprint).values(fingerprints)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[JellyfinFingerprint.item_id],
+        set_={
+            'file_mtime': stmt.excluded.file_mtime,
+            'fingerprint': stmt.excluded.fingerprint,
+            'computed_at': stmt.excluded.computed_at,
+        }
+    )
+    db.session.execute(stmt)
+    db.session.commit()
+
+def paths_exist(paths: List[str]) -> dict:
+    """
+    Checks the existence of many files at once. Every distinct path is stat'ed only once, in parallel,
+    since the files often live on network storage.
+    :param paths: The paths to check, may contain duplicates.
+    :return: A dict path -> bool.
+    """
+    distinct = list(set(paths))
+    if not distinct:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(app.config['FS_STAT_WORKERS'], len(distinct))) as executor:
+        return dict(zip(distinct, executor.map(os.path.exists, distinct)))
+
+def process_pool(workers: int):
+    """
+    Returns a process pool for CPU or subprocess heavy work. Falls back to threads where the current process
+    may not have children, e.g. in daemonic Celery workers.
+    :param workers: Number of workers.
+    :return: A ProcessPoolExecutor, or a ThreadPoolExecutor as fallback.
+    """
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        executor.submit(int).result()
+        return executor
+    except (AssertionError, OSError) as e:
+        app.logger.warning(f"Process pool not available ({str(e)}), using threads")
+        executor.shutdown(wait=False)
+        return ThreadPoolExecutor(max_workers=workers)
+
+def _file_signature(path: str) -> Optional[tuple]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime
+
+def get_audio_profiles(paths: List[str], probe: bool = True) -> dict:
+    """
+    Returns the audio profiles of many files. Results are cached in Redis per path together with the
+    size and mtime of the file, only files which are not cached or changed since are analyzed.
+    The headers of common formats are read in a thread pool, other formats are analyzed by ffprobe in a process pool.
+    :param paths: The paths of the audio files, may contain duplicates.
+    :param probe: If False, only cached results are returned and misses are left out of the result.
+    :return: A dict path -> AudioProfile, or None if the file does not exist or could not be analyzed.
+    """
+    paths = list(dict.fromkeys(path for path in paths if path))
+    if not paths:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(app.config['FS_STAT_WORKERS'], len(paths))) as executor:
+        signatures = dict(zip(paths, executor.map(_file_signature, paths)))
+
+    result = {path: None for path in paths}
+    existing = [path for path in paths if signatures[path]]
+    misses = []
+    for path, cached in zip(existing, redis_client.mget([f'audio_profile:{path}' for path in existing]) if existing else []):
+        entry = json.loads(cached) if cached else None
+        if entry and (entry['size'], entry['mtime']) == signatures[path]:
+            if not entry.get('error'):
+                result[path] = AudioProfile(path, entry['bitrate'], entry['sample_rate'], entry['channels'],
+                                            entry.get('codec'), entry.get('duration'))
+        else:
+            misses.append(path)
+    if not probe:
+        for path in misses:
+            del result[path]
+        return result
+    if not misses:
+        return result
+
+    # the headers of common formats are read in threads, only the remaining files need ffprobe
+    with ThreadPoolExecutor(max_workers=min(app.config['FS_STAT_WORKERS'], len(misses))) as executor:
+        analyzed = {path: profile for path, profile in zip(misses, executor.map(AudioProfile.read_header, misses)) if profile}
+    misses = [path for path in misses if path not in analyzed]
+    if misses:
+        app.logger.debug(f"Analyzing {len(misses)} files with ffprobe")
+    if len(misses) == 1:
+        # starting a pool for a single file costs more than it saves
+        try:
+            analyzed[misses[0]] = AudioProfile.probe_with_ffprobe(misses[0])
+        except Exception as e:
+            app.logger.error(f"Error analyzing audio quality with ffprobe: {str(e)}")
+            analyzed[misses[0]] = None
+    elif misses:
+        with process_pool(min(app.config['AUDIO_PROFILE_WORKERS'], len(misses))) as executor:
+            futures = {executor.submit(AudioProfile.probe_with_ffprobe, path): path for path in misses}
+            for future in as_completed(futures):
+                try:
+                    analyzed[futures[future]] = future.result()
+                except Exception as e:
+                    app.logger.error(f"Error analyzing audio quality with ffprobe: {str(e)}")
+                    analyzed[futures[future]] = None
+
+    pipe = redis_client.pipeline()
+    for path, profile in analyzed.items():
+        size, mtime = signatures[path]
+        # failures are cached as well, so a broken file is not probed again until it changes
+        entry = {'size': size, 'mtime': mtime, **(profile.to_dict() if profile else {'error': True})}
+        pipe.set(f'audio_profile:{path}', json.dumps(entry), ex=app.config['AUDIO_PROFILE_CACHE_TTL'])
+        result[path] = profile
+    pipe.execute()
+    return result
+
+def get_audio_profile(path: str) -> Optional[AudioProfile]:
+    """
+    Returns the cached audio profile of a single file, see get_audio_profiles.
+    """
+    return get_audio_profiles([path]).get(path)
+
+def audio_profile_columns(profile: Optional[AudioProfile]) -> dict:
+    """
+    Returns the Track columns storing an audio profile. A missing profile is stored as analyzed without values,
+    so the file is not analyzed again until the track is linked to another file.
+    """
+    return {
+        'audio_bitrate': profile.bitrate if profile else None,
+        'audio_sample_rate': profile.sample_rate if profile else None,
+        'audio_channels': profile.channels if profile else None,
+        'audio_codec': profile.codec if profile else None,
+        'audio_duration': profile.duration if profile else None,
+        'audio_profiled_at': datetime.now(timezone.utc).replace(tzinfo=None),
+    }
+
+def apply_audio_profile(track: Track, profile: Optional[AudioProfile]) -> None:
+    for column, value in audio_profile_columns(profile).items():
+        setattr(track, column, value)
+
+def request_track_audio_profile(track: Track) -> None:
+    """
+    Queues the computation of the audio profile of a track, at most once a minute per track.
+    """
+    if redis_client.set(f'audio_profile_requested_{track.id}', 1, ex=60, nx=True):
+        tasks.update_audio_profiles.delay([track.id])
+
+def request_audio_file_profiles(paths: List[str]) -> None:
+    """
+    Queues the analysis of files which are not linked to a track, the results end up in the audio profile cache.
+    """
+    paths = [path for path in dict.fromkeys(paths) if path and redis_client.set(f'audio_profile_requested:{path}', 1, ex=60, nx=True)]
+    if paths:
+        tasks.analyze_audio_files.delay(paths)
+
+def get_jellyfin_paths(jellyfin_ids: List[str]) -> dict:
+    """
+    Returns the file paths of Jellyfin items. The paths are taken from the local library index,
+    items which are not indexed are requested from the server in parallel.
+    :param jellyfin_ids: The ids of the Jellyfin items.
+    :return: A dict id -> path, items without path are left out.
+    """
+    jellyfin_ids = list(set(jellyfin_ids))
+    if not jellyfin_ids:
+        return {}
+    result = dict(db.session.execute(
+        db.select(JellyfinItem.id, JellyfinItem.path).where(JellyfinItem.id.in_(jellyfin_ids), JellyfinItem.path != None)
+    ).all())
+    missing = [jellyfin_id for jellyfin_id in jellyfin_ids if jellyfin_id not in result]
+    if missing:
+        def get_path(jellyfin_id):
+            try:
+                return jellyfin.get_item(jellyfin_admin.token, jellyfin_id).get('Path')
+            except Exception as e:
+                app.logger.debug(f"Jellyfin item {jellyfin_id} not found: {str(e)}")
+                return None
+        with ThreadPoolExecutor(max_workers=min(app.config['FS_STAT_WORKERS'], len(missing))) as executor:
+            result.update({jellyfin_id: path for jellyfin_id, path in zip(missing, executor.map(get_path, missing)) if path})
+    return result
+
 def get_tracks_for_playlist(data: List[PlaylistTrack], provider_id : str ) -> List[CombinedTrackData]:
     is_admin = session.get('is_admin', False)
     tracks = []
 
+    # Query the state of all tracks from the database at once
+    provider_track_ids = {item.track.id for item in data if item.track}
+    tracks_db = {
+        track.provider_track_id: track
+        for track in Track.query.filter(Track.provider_track_id.in_(provider_track_ids)).all()
+    } if provider_track_ids else {}
+
     for idx, item in enumerate(data):
         track_data = item.track
         if track_data:
@@ -140,8 +696,7 @@ def get_tracks_for_playlist(data: List[PlaylistTrack], provider_id : str ) -> Li
             minutes = duration_ms // 60000
             seconds = (duration_ms % 60000) // 1000
 
-            # Query track from the database
-            track_db = Track.query.filter_by(provider_track_id=track_data.id).first()
+            track_db = tracks_db.get(track_data.id)
 
             if track_db:
                 downloaded = track_db.downloaded
@@ -209,12 +764,12 @@ def _get_token_from_sessioncookie() -> str:
     return session['jellyfin_access_token']
 def _get_api_token() -> str:
     #return app.config['JELLYFIN_ACCESS_TOKEN']
-    return jellyfin_admin_token
+    return jellyfin_admin.token
 def _get_logged_in_user() -> JellyfinUser:
     return JellyfinUser.query.filter_by(jellyfin_user_id=session['jellyfin_user_id']).first()  
 def _get_admin_id():
     #return JellyfinUser.query.filter_by(is_admin=True).first().jellyfin_user_id
-    return jellyfin_admin_id
+    return jellyfin_admin.user_id
 
 
 def get_longest_substring(input_string):
@@ -227,7 +782,7 @@ def get_longest_substring(input_string):
 @cache.memoize(timeout=3600*2)
 def get_latest_dev_releases(branch_name :str, commit_sha : str):
     try:
-        response = requests.get('https://api.github.com/repos/kamilkosek/jellyplist/releases')
+        response = transport.get_session('https://api.github.com').get('https://api.github.com/repos/kamilkosek/jellyplist/releases')
         if response.status_code == 200:
             data = response.json()
             latest_release = None
@@ -237,7 +792,7 @@ def get_latest_dev_releases(branch_name :str, commit_sha : str):
                         latest_release = release
                         
             if latest_release:
-                response = requests.get(f'https://api.github.com/repos/kamilkosek/jellyplist/git/ref/tags/{latest_release["tag_name"]}')
+                response = transport.get_session('https://api.github.com').get(f'https://api.github.com/repos/kamilkosek/jellyplist/git/ref/tags/{latest_release["tag_name"]}')
                 if response.status_code == 200:
                     data = response.json()
                     if commit_sha != data['object']['sha'][:7]:
@@ -252,7 +807,7 @@ def get_latest_dev_releases(branch_name :str, commit_sha : str):
 @cache.memoize(timeout=3600*2)
 def get_latest_release(tag_name :str):
     try:
-        response = requests.get('https://api.github.com/repos/kamilkosek/jellyplist/releases/latest')
+        response = transport.get_session('https://api.github.com').get('https://api.github.com/repos/kamilkosek/jellyplist/releases/latest')
         if response.status_code == 200:
             data = response.json()
             if data['tag_name'] != tag_name:
@@ -0,0 +1,260 @@
+import hashlib
+import re
+import unicodedata
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Set, Tuple
+
+# width of the duration buckets, tracks match if their buckets differ by at most one
+DURATION_BUCKET_MS = 10000
+
+_APOSTROPHES = re.compile("[" + re.escape("'’‘‛`´") + "]")
+_FEATURING = re.compile(r'\s*[\(\[]\s*(?:feat\.?|ft\.?|featuring|with)\s[^\)\]]*[\)\]]|\s+(?:feat\.?|ft\.?|featuring)\s.*$', re.IGNORECASE)
+_REMASTER = re.compile(r'\s*[\(\[][^\)\]]*\bremaster(?:ed)?\b[^\)\]]*[\)\]]|\s+-\s+[^-]*\bremaster(?:ed)?\b.*$', re.IGNORECASE)
+_NON_WORD = re.compile(r'[\W_]+')
+
+
+def _fold(text: str) -> str:
+    # decompose accented characters and drop the accents, then compare case insensitive
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(char for char in text if not unicodedata.combining(char)).casefold()
+    return _NON_WORD.sub(' ', text).strip()
+
+
+def fold_title(title: str) -> str:
+    """
+    Normalizes a track title for matching: featured artists and remaster notes are removed,
+    apostrophes are dropped, accents, case and punctuation are ignored.
+    "Don’t Stop Me Now - Remastered 2011" and "Don't stop me now" both become "dont stop me now".
+    """
+    title = _APOSTROPHES.sub('', title or '')
+    title = _REMASTER.sub('', title)
+    title = _FEATURING.sub('', title)
+    return _fold(title)
+
+
+def artists_key(artists: List[str]) -> Optional[str]:
+    """
+    Hash over the normalized set of artist names, independent of their order.
+    """
+    names = sorted({_fold(_APOSTROPHES.sub('', name)) for name in artists if name})
+    if not names:
+        return None
+    return hashlib.sha1('\x1f'.join(names).encode('utf-8')).hexdigest()[:16]
+
+
+def duration_bucket(duration_ms: Optional[int]) -> Optional[int]:
+    if not duration_ms:
+        return None
+    return int(duration_ms) // DURATION_BUCKET_MS
+
+
+def track_match_keys(name: str, artists: List[str], duration_ms: Optional[int], album: Optional[str] = None) -> dict:
+    """
+    Match keys of a provider track, stored on the Track row. The keys are used for the exact lookups, the artist names,
+    duration and album for the fuzzy matcher, so matching never needs the provider.
+    """
+    return {
+        'match_title': fold_title(name),
+        'match_artists': artists_key(artists),
+        'match_duration': duration_bucket(duration_ms),
+        'match_artist_names': [artist for artist in artists if artist],
+        'match_duration_ms': duration_ms or None,
+        'match_album': album or None,
+    }
+
+
+def jellyfin_artists(item: dict) -> List[str]:
+    # a single artist entry may hold several artists separated by slashes
+    artists = item.get('Artists') or []
+    if len(artists) == 1:
+        return artists[0].split('/')
+    return artists
+
+
+def jellyfin_item_match_keys(item: dict) -> dict:
+    """
+    Match keys of an item from the Jellyfin /Items endpoint. Items from the local library index carry
+    their precomputed keys.
+    """
+    if 'MatchKeys' in item:
+        return item['MatchKeys']
+    ticks = item.get('RunTimeTicks')
+    return {
+        'title': fold_title(item.get('Name', '')),
+        'artists': artists_key(jellyfin_artists(item)),
+        'album_artists': artists_key([artist['Name'] for artist in item.get('AlbumArtists', [])]),
+        'duration': duration_bucket(ticks // 10000 if ticks else None),
+    }
+
+
+def keys_match(track_keys: dict, item_keys: dict) -> bool:
+    """
+    A Jellyfin item matches a track if the titles and either the artists or the album artists are equal,
+    and the durations are close, if both are known.
+    """
+    if not track_keys['match_title'] or track_keys['match_title'] != item_keys['title']:
+        return False
+    if not track_keys['match_artists'] or track_keys['match_artists'] not in (item_keys['artists'], item_keys['album_artists']):
+        return False
+    if track_keys['match_duration'] is not None and item_keys['duration'] is not None:
+        return abs(track_keys['match_duration'] - item_keys['duration']) <= 1
+    return True
+
+
+# weights of the fuzzy match score, they add up to 1. The album is only a hint, it replaces a share of ALBUM_WEIGHT
+# of the score when the album of both the track and the item is known
+TITLE_WEIGHT = 0.55
+ARTISTS_WEIGHT = 0.3
+DURATION_WEIGHT = 0.15
+ALBUM_WEIGHT = 0.05
+# duration similarity used when the duration of the track or the item is not known
+UNKNOWN_DURATION_SIMILARITY = 0.5
+# candidates whose match score is this close to the best one are ranked by their quality
+MATCH_SCORE_TIE = 0.01
+# words marking another recording of a song, a title may only contain them if the other one does too
+VERSION_TOKENS = frozenset({
+    'live', 'remix', 'remixed', 'mix', 'edit', 'acoustic', 'instrumental', 'demo', 'karaoke', 'unplugged',
+    'version', 'extended', 'radio', 'reprise', 'rework', 'cover', 'dub', 'session', 'sessions', 'orchestral', 'piano',
+})
+
+
+@dataclass
+class MatchThresholds:
+    """
+    Thresholds of the fuzzy matcher, see Config.MATCH_*.
+    """
+    min_score: float = 0.85
+    min_title_similarity: float = 0.75
+    min_artists_similarity: float = 0.8
+    duration_tolerance_ms: int = 3000  # differences up to this are considered equal
+    max_duration_diff_ms: int = 15000  # candidates with a larger difference are rejected
+
+
+def title_tokens(title: str) -> Set[str]:
+    return set(fold_title(title).split())
+
+
+def artist_tokens(artists: Sequence[str]) -> Set[str]:
+    # every artist is one token, artists sharing a word like "the" or "band" are still different artists
+    tokens = set()
+    for name in artists:
+        name = _fold(_APOSTROPHES.sub('', name or ''))
+        if name.startswith('the '):
+            name = name[4:]
+        if name:
+            tokens.add(name)
+    return tokens
+
+
+def _token_overlap(query: Set[str], candidates: Sequence[Set[str]]):
+    import numpy as np
+
+    vocabulary = {token: index for index, token in enumerate(query)}
+    hits = np.zeros((len(candidates), max(len(vocabulary), 1)), dtype=bool)
+    sizes = np.empty(len(candidates))
+    for row, tokens in enumerate(candidates):
+        sizes[row] = len(tokens)
+        hits[row, [vocabulary[token] for token in tokens if token in vocabulary]] = True
+    return hits.sum(axis=1), sizes
+
+
+def dice_similarity(query: Set[str], candidates: Sequence[Set[str]]):
+    """
+    Dice coefficient of a token set and many token sets at once, between 0 and 1. Every token only one side has
+    lowers it, so "song" and "song remix" score 0.67.
+    :param query: The tokens of the track.
+    :param candidates: The tokens of every candidate.
+    :return: numpy array with the similarity of every candidate.
+    """
+    import numpy as np
+
+    common, sizes = _token_overlap(query, candidates)
+    total = sizes + len(query)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(total > 0, 2 * common / total, 0.0)
+
+
+def token_set_similarity(query: Set[str], candidates: Sequence[Set[str]]):
+    """
+    Similarity of a token set to many token sets at once, between 0 and 1. It is the mean of the share of the
+    smaller set contained in the other one and the Dice coefficient, so equal sets score 1, and a subset like
+    "queen" of "queen, david bowie" still scores 0.83.
+    :param query: The tokens of the track.
+    :param candidates: The tokens of every candidate.
+    :return: numpy array with the similarity of every candidate.
+    """
+    import numpy as np
+
+    common, sizes = _token_overlap(query, candidates)
+    smaller = np.minimum(sizes, len(query))
+    total = sizes + len(query)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        containment = np.where(smaller > 0, common / smaller, 0.0)
+        dice = np.where(total > 0, 2 * common / total, 0.0)
+    return (containment + dice) / 2
+
+
+def score_candidates(track_keys: dict, items: List[dict], thresholds: Optional[MatchThresholds] = None):
+    """
+    Scores Jellyfin items as matches of a track, all items are compared at once.
+
+    The score combines the Dice similarity of the title words, the similarity of the artist sets (the better one of
+    artists and album artists of the item) and the closeness of the durations, it is between 0 and 1. A similar album
+    name raises the score slightly, so the album version ranks above a compilation. Titles where only one side is
+    another version, e.g. live or remix, are never accepted.
+    :param track_keys: The match keys of the track, see track_match_keys.
+    :param items: Items from the Jellyfin /Items endpoint or from the library index.
+    :param thresholds: Thresholds a candidate has to reach, the defaults are used if not given.
+    :return: Tuple (scores, accepted) of numpy arrays with one entry per item.
+    """
+    import numpy as np
+
+    if not items:
+        return np.zeros(0), np.zeros(0, dtype=bool)
+    thresholds = thresholds or MatchThresholds()
+    query_title = set((track_keys['match_title'] or '').split())
+    item_titles = [
+        set(item['MatchKeys']['title'].split()) if 'MatchKeys' in item else title_tokens(item.get('Name', ''))
+        for item in items
+    ]
+    title = dice_similarity(query_title, item_titles)
+    same_version = np.array([not (VERSION_TOKENS & (query_title ^ tokens)) for tokens in item_titles])
+
+    query_artists = artist_tokens(track_keys['match_artist_names'] or [])
+    artists_similarity = np.maximum(
+        token_set_similarity(query_artists, [artist_tokens(jellyfin_artists(item)) for item in items]),
+        token_set_similarity(query_artists, [artist_tokens([a['Name'] for a in item.get('AlbumArtists') or []]) for item in items])
+    )
+
+    duration_ms = track_keys['match_duration_ms']
+    ticks = np.array([item.get('RunTimeTicks') or 0 for item in items], dtype=np.int64)
+    known = (ticks > 0) & bool(duration_ms)
+    diff = np.abs(ticks // 10000 - (duration_ms or 0))
+    span = max(thresholds.max_duration_diff_ms - thresholds.duration_tolerance_ms, 1)
+    duration = np.where(known, np.clip(1 - (diff - thresholds.duration_tolerance_ms) / span, 0, 1), UNKNOWN_DURATION_SIMILARITY)
+
+    scores = TITLE_WEIGHT * title + ARTISTS_WEIGHT * artists_similarity + DURATION_WEIGHT * duration
+    album = track_keys['match_album']
+    if album:
+        # the album only counts if both sides know it
+        has_album = np.array([bool(item.get('Album')) for item in items])
+        album_similarity = token_set_similarity(title_tokens(album), [title_tokens(item.get('Album') or '') for item in items])
+        scores = np.where(has_album, (1 - ALBUM_WEIGHT) * scores + ALBUM_WEIGHT * album_similarity, scores)
+
+    accepted = ((scores >= thresholds.min_score)
+                & (title >= thresholds.min_title_similarity)
+                & same_version
+                & (artists_similarity >= thresholds.min_artists_similarity)
+                & ~(known & (diff > thresholds.max_duration_diff_ms)))
+    return scores, accepted
+
+
+def best_matches(candidates: List[Tuple[dict, float]]) -> List[Tuple[dict, float]]:
+    """
+    The candidates with the best match score, only among them the quality of the files decides.
+    :param candidates: Tuples (item, match score) of the accepted candidates.
+    """
+    if not candidates:
+        return []
+    best = max(match_score for _, match_score in candidates)
+    return [(item, match_score) for item, match_score in candidates if match_score >= best - MATCH_SCORE_TIE]
@@ -1,4 +1,7 @@
+from typing import Optional
 from app import db
+from app.classes import AudioProfile
+from app.matching import duration_bucket
 from sqlalchemy import select
 
 class JellyfinUser(db.Model):
@@ -29,7 +32,7 @@ class Playlist(db.Model):
     tracks = db.relationship('Track', secondary='playlist_tracks', back_populates='playlists')
     track_count = db.Column(db.Integer())
     tracks_available = db.Column(db.Integer())
-    jellyfin_id = db.Column(db.String(120), nullable=True)  
+    jellyfin_id = db.Column(db.String(120), nullable=True, index=True)  
     last_updated = db.Column(db.DateTime )
     last_changed = db.Column(db.DateTime )
     snapshot_id = db.Column(db.String(120), nullable=True)
@@ -44,7 +47,8 @@ class Playlist(db.Model):
 playlist_tracks = db.Table('playlist_tracks',
     db.Column('playlist_id', db.Integer, db.ForeignKey('playlist.id'), primary_key=True),
     db.Column('track_id', db.Integer, db.ForeignKey('track.id'), primary_key=True),
-    db.Column('track_order', db.Integer, nullable=False)  # New field for track order
+    db.Column('track_order', db.Integer, nullable=False),  # New field for track order
+    db.Index('ix_playlist_tracks_playlist_id_track_order', 'playlist_id', 'track_order'),
 
 )
 
@@ -65,5 +69,113 @@ class Track(db.Model):
     
     lidarr_processed = db.Column(db.Boolean(), default=False)
     quality_score = db.Column(db.Float(), default=0)
+
+    # audio profile of the file, computed in the background by the update_audio_profiles task
+    audio_bitrate = db.Column(db.Integer(), nullable=True)  # in kbps
+    audio_sample_rate = db.Column(db.Integer(), nullable=True)  # in Hz
+    audio_channels = db.Column(db.Integer(), nullable=True)
+    audio_codec = db.Column(db.String(20), nullable=True)
+    audio_duration = db.Column(db.Float(), nullable=True)  # in seconds
+    audio_profiled_at = db.Column(db.DateTime(), nullable=True)  # None until the profile is computed
+
+    # normalized keys of the provider track used by the matcher, see app.matching
+    match_title = db.Column(db.String(), nullable=True)
+    match_artists = db.Column(db.String(16), nullable=True)
+    match_duration = db.Column(db.Integer(), nullable=True)
+    match_artist_names = db.Column(db.JSON(), nullable=True)  # None for tracks created before the fuzzy matcher
+    match_duration_ms = db.Column(db.Integer(), nullable=True)
+    match_album = db.Column(db.String(), nullable=True)
+    match_checked_at = db.Column(db.DateTime(), nullable=True)  # last lookup in the library index, new items are matched in reverse
+
+    # partial indexes matching the filters of the scheduled tasks, see `flask check-indexes`
+    __table_args__ = (
+        db.Index('ix_track_not_downloaded', 'provider_id', 'id', postgresql_where=db.text('downloaded = false')),
+        db.Index('ix_track_unlinked', 'quality_score', postgresql_where=db.text('downloaded = true AND jellyfin_id IS NULL')),
+        db.Index('ix_track_quality_score', 'quality_score'),
+        db.Index('ix_track_lidarr_unprocessed', 'id', postgresql_where=db.text('lidarr_processed = false')),
+        db.Index('ix_track_audio_unprofiled', 'id', postgresql_where=db.text('downloaded = true AND audio_profiled_at IS NULL')),
+        db.Index('ix_track_match_keys', 'match_title', 'match_artists'),
+    )
+
+    @property
+    def audio_profile(self) -> Optional[AudioProfile]:
+        """
+        The stored audio profile, None if it is not computed yet or the file could not be analyzed.
+        """
+        if self.audio_profiled_at is None or self.audio_bitrate is None:
+            return None
+        return AudioProfile(self.filesystem_path, self.audio_bitrate, self.audio_sample_rate, self.audio_channels,
+                            self.audio_codec, self.audio_duration)
+
+    @property
+    def match_keys(self) -> dict:
+        """
+        The stored match keys in the shape of matching.track_match_keys.
+        """
+        return {
+            'match_title': self.match_title,
+            'match_artists': self.match_artists,
+            'match_duration': self.match_duration,
+            'match_artist_names': self.match_artist_names,
+            'match_duration_ms': self.match_duration_ms,
+            'match_album': self.match_album,
+        }
+
     def __repr__(self):
         return f'<Track {self.name}:{self.provider_track_id}>'
+
+# Local copy of the Audio items of the Jellyfin library, used for matching tracks without searching the server
+class JellyfinItem(db.Model):
+    id = db.Column(db.String(120), primary_key=True)  # Jellyfin item id
+    name = db.Column(db.String(), nullable=False)
+    name_key = db.Column(db.String(), nullable=False, index=True)  # folded title used for lookups, see app.matching
+    artists = db.Column(db.JSON(), nullable=True)
+    album_artists = db.Column(db.JSON(), nullable=True)
+    album = db.Column(db.String(), nullable=True)
+    artists_key = db.Column(db.String(16), nullable=True)
+    album_artists_key = db.Column(db.String(16), nullable=True)
+    run_time_ticks = db.Column(db.BigInteger(), nullable=True)
+    path = db.Column(db.String(), nullable=True)
+    container = db.Column(db.String(20), nullable=True)
+    has_lyrics = db.Column(db.Boolean(), default=False)
+    indexed_at = db.Column(db.DateTime(), nullable=False)
+
+    __table_args__ = (
+        # trigram index for the fuzzy lookup of similar titles, needs the pg_trgm extension
+        db.Index('ix_jellyfin_item_name_key_trgm', 'name_key', postgresql_using='gin', postgresql_ops={'name_key': 'gin_trgm_ops'}),
+    )
+
+    def to_search_result(self) -> dict:
+        """
+        Returns the item in the shape of an item from the Jellyfin /Items endpoint.
+        """
+        return {
+            'Id': self.id,
+            'Name': self.name,
+            'Artists': self.artists or [],
+            'AlbumArtists': [{'Name': name} for name in (self.album_artists or [])],
+            'Album': self.album,
+            'Path': self.path,
+            'Container': self.container or '',
+            'HasLyrics': self.has_lyrics,
+            'RunTimeTicks': self.run_time_ticks,
+            'MatchKeys': {
+                'title': self.name_key,
+                'artists': self.artists_key,
+                'album_artists': self.album_artists_key,
+                'duration': duration_bucket(self.run_time_ticks // 10000 if self.run_time_ticks else None),
+            }
+        }
+
+    def __repr__(self):
+        return f'<JellyfinItem {self.name}:{self.id}>'
+
+# Chromaprint fingerprints of the files of the Jellyfin library, computed once per file version
+class JellyfinFingerprint(db.Model):
+    item_id = db.Column(db.String(120), primary_key=True)  # Jellyfin item id
+    file_mtime = db.Column(db.Float(), nullable=False)  # mtime of the file the fingerprint was computed from
+    fingerprint = db.Column(db.LargeBinary(), nullable=False)  # decoded fingerprint, little endian uint32 items
+    computed_at = db.Column(db.DateTime(), nullable=False)
+
+    def __repr__(self):
+        return f'<JellyfinFingerprint {self.item_id}>'
@@ -1,4 +1,5 @@
 from dataclasses import dataclass, field
+import hashlib
 from typing import List, Optional
 from abc import ABC, abstractmethod
 
@@ -82,6 +83,7 @@ class Playlist(ItemBase):
     images: Optional[List[Image]]
     owner: Optional[Owner]
     tracks: List[PlaylistTrack] = field(default_factory=list)
+    snapshot_id: Optional[str] = None
 @dataclass
 class BrowseCard:
     title: str
@@ -96,6 +98,16 @@ class BrowseSection:
     items: List[BrowseCard]
     uri: str
 
+def playlist_fingerprint(playlist: Playlist) -> str:
+    """
+    Returns a fingerprint which changes whenever the content or order of a playlist changes.
+    Uses the snapshot id reported by the provider if available, otherwise a hash over the ordered track ids.
+    """
+    if playlist.snapshot_id:
+        return playlist.snapshot_id
+    track_ids = ','.join(item.track.id for item in playlist.tracks if item and item.track)
+    return hashlib.sha1(track_ids.encode('utf-8')).hexdigest()
+
 # Abstract base class for music providers
 class MusicProviderClient(ABC):
     """
@@ -126,6 +138,15 @@ class MusicProviderClient(ABC):
         :return: A Playlist object.
         """
         pass
+    def get_playlist_snapshot_id(self, playlist_id: str) -> Optional[str]:
+        """
+        Fetches a cheap revision identifier of a playlist, which changes whenever its tracks change.
+        Providers which can only determine it by fetching the whole playlist return None.
+        :param playlist_id: The ID of the playlist.
+        :return: The snapshot id or None.
+        """
+        return None
+
     @abstractmethod
     def extract_playlist_id(self, uri: str) -> str:
         """
@@ -156,6 +177,14 @@ class MusicProviderClient(ABC):
         """
         pass
     @abstractmethod
+    def get_tracks(self, track_ids: List[str]) -> List[Optional[Track]]:
+        """
+        Fetches details for many tracks at once.
+        :param track_ids: The IDs of the tracks to fetch.
+        :return: The Track objects in the order of track_ids, None for tracks which could not be fetched.
+        """
+        pass
+    @abstractmethod
     def browse(self, **kwargs) -> List[BrowseSection]:
         """
         Generic browse method for the music provider.
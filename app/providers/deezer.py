@@ -1,10 +1,13 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import threading
 import time
 from bs4 import BeautifulSoup
 import deezer
 import deezer.resources
 import deezer.exceptions
 import json 
-import requests
+import transport
 from typing import List, Optional, Dict
 import logging
 from deezer import Client
@@ -28,6 +31,33 @@ from app.providers.base import (
 
 l = logging.getLogger(__name__)
 
+# quota of the public Deezer API per client
+QUOTA_REQUESTS = 50
+QUOTA_SECONDS = 5
+# seconds a playlist fetched for its checksum is reused by get_playlist
+CHECKED_PLAYLIST_TTL = 60
+
+class _RateLimiter:
+    """
+    Blocks until a request fits into the quota, shared by all threads of a client.
+    """
+    def __init__(self, requests: int, seconds: float):
+        self.requests = requests
+        self.seconds = seconds
+        self._calls = deque()
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self._lock:
+            while True:
+                now = time.monotonic()
+                while self._calls and now - self._calls[0] >= self.seconds:
+                    self._calls.popleft()
+                if len(self._calls) < self.requests:
+                    self._calls.append(now)
+                    return
+                time.sleep(self.seconds - (now - self._calls[0]))
+
 class DeezerClient(MusicProviderClient):
     """
     Deezer implementation of the MusicProviderClient.
@@ -41,12 +71,18 @@ class DeezerClient(MusicProviderClient):
     
     
 
-    def __init__(self, access_token: Optional[str] = None):
+    def __init__(self, access_token: Optional[str] = None, max_workers: int = 4):
         """
         Initialize the Deezer client.
         :param access_token: Optional access token for authentication.
+        :param max_workers: Maximum number of concurrent requests when fetching many tracks.
         """
         self._client = deezer.Client(access_token=access_token)
+        self.max_workers = max(1, max_workers)
+        self._rate_limiter = _RateLimiter(QUOTA_REQUESTS, QUOTA_SECONDS)
+        # playlists fetched for their checksum, reused by the get_playlist call which follows when it changed
+        self._checked_playlists: Dict[str, tuple] = {}
+        self._checked_playlists_lock = threading.Lock()
         
     #region Helper methods for parsing Deezer API responses    
     def _parse_track(self, track: deezer.resources.Track) -> Track:
@@ -142,7 +178,8 @@ class DeezerClient(MusicProviderClient):
                 uri=f"deezer:user:{playlist.creator.id}",
                 external_urls=[ExternalUrl(url=playlist.creator.link)]
             ),
-            tracks=tracks
+            tracks=tracks,
+            snapshot_id=getattr(playlist, 'checksum', None)
         )
         
     #endregion
@@ -169,9 +206,33 @@ class DeezerClient(MusicProviderClient):
         :param playlist_id: The ID of the playlist to fetch.
         :return: A Playlist object.
         """
-        data = self._client.get_playlist(int(playlist_id))
+        with self._checked_playlists_lock:
+            checked = self._checked_playlists.pop(str(playlist_id), None)
+        if checked and time.monotonic() - checked[0] < CHECKED_PLAYLIST_TTL:
+            data = checked[1]
+        else:
+            data = self._client.get_playlist(int(playlist_id))
         return self._parse_playlist(data)
 
+    def get_playlist_snapshot_id(self, playlist_id: str) -> Optional[str]:
+        """
+        Fetch the checksum of a playlist without loading all of its tracks. Deezer only returns it together with
+        the playlist, so the playlist is kept for a following get_playlist call.
+        :param playlist_id: The ID of the playlist.
+        :return: The checksum, or None if it could not be determined.
+        """
+        try:
+            data = self._client.get_playlist(int(playlist_id))
+            now = time.monotonic()
+            with self._checked_playlists_lock:
+                for key in [key for key, (fetched_at, _) in self._checked_playlists.items() if now - fetched_at >= CHECKED_PLAYLIST_TTL]:
+                    del self._checked_playlists[key]
+                self._checked_playlists[str(playlist_id)] = (now, data)
+            return getattr(data, 'checksum', None)
+        except Exception as e:
+            l.warning(f"Could not fetch checksum for playlist {playlist_id}: {e}")
+            return None
+
     def search_playlist(self, query: str, limit: int = 50) -> List[Playlist]:
         """
         Search for playlists matching a query.
@@ -212,9 +273,39 @@ class DeezerClient(MusicProviderClient):
         :param track_id: The ID of the track to fetch.
         :return: A Track object.
         """
-        track = self._client.get_track(int(track_id))
+        retrycount = 0
+        while True:
+            self._rate_limiter.wait()
+            try:
+                track = self._client.get_track(int(track_id))
+                break
+            except deezer.exceptions.DeezerErrorResponse as e:
+                # the quota is shared with other processes, so it can be exceeded anyway
+                if e.json_data['error']['code'] == 4 and retrycount < 3:
+                    retrycount += 1
+                    l.warning(f"Quota limit exceeded. Waiting for {QUOTA_SECONDS} seconds before retrying...")
+                    time.sleep(QUOTA_SECONDS)
+                else:
+                    raise
         return self._parse_track(track)
 
+    def get_tracks(self, track_ids: List[str]) -> List[Optional[Track]]:
+        """
+        Fetch many tracks concurrently, within the request quota of the Deezer API.
+        :param track_ids: The IDs of the tracks to fetch.
+        :return: The Track objects in the order of track_ids, None for tracks which could not be fetched.
+        """
+        def get_track_or_none(track_id: str) -> Optional[Track]:
+            try:
+                return self.get_track(track_id)
+            except Exception as e:
+                l.error(f"Error fetching track {track_id}: {e}")
+                return None
+        if len(track_ids) <= 1:
+            return [get_track_or_none(track_id) for track_id in track_ids]
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(track_ids))) as executor:
+            return list(executor.map(get_track_or_none, track_ids))
+
     
     def browse(self, **kwargs) -> List[BrowseSection]:
         """
@@ -231,7 +322,7 @@ class DeezerClient(MusicProviderClient):
             'sec-ch-ua-mobile': '?0'
         }
 
-        response = requests.get(url, headers=headers)
+        response = transport.get_session(url).get(url, headers=headers)
         response.raise_for_status()
 
         soup = BeautifulSoup(response.text, 'html.parser')
@@ -283,7 +374,7 @@ class DeezerClient(MusicProviderClient):
             'sec-ch-ua-mobile': '?0'
         }
 
-        response = requests.get(url, headers=headers)
+        response = transport.get_session(url).get(url, headers=headers)
         response.raise_for_status()
 
         soup = BeautifulSoup(response.text, 'html.parser')
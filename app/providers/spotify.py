@@ -1,10 +1,12 @@
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 import os
+import threading
 from app.providers.base import AccountAttributes, Album, Artist, BrowseCard, BrowseSection, Image, MusicProviderClient, Owner, Playlist, PlaylistTrack, Profile, Track, ExternalUrl, Category
 import requests
+import transport
 
 import json
-import requests
 from bs4 import BeautifulSoup
 from urllib.parse import urlencode
 from typing import List, Dict, Optional
@@ -21,15 +23,26 @@ class SpotifyClient(MusicProviderClient):
     def _identifier(self) -> str:
         return "Spotify"
     
-    def __init__(self, cookie_file: Optional[str] = None):
+    def __init__(self, cookie_file: Optional[str] = None, max_workers: int = 8):
+        """
+        :param cookie_file: Optional path to a cookie file used for authentication.
+        :param max_workers: Maximum number of concurrent requests when fetching playlist pages or tracks.
+        """
         self.base_url = "https://api-partner.spotify.com"
         self.session_data = None
         self.config_data = None
         self.client_token = None
         self.cookies = None
+        self.max_workers = max(1, max_workers)
+        self._auth_lock = threading.Lock()
         if cookie_file:
             self._load_cookies(cookie_file)
             
+    @property
+    def session(self):
+        # pooled session, so concurrent page requests reuse their connections
+        return transport.get_session(self.base_url)
+
     def _load_cookies(self, cookie_file: str) -> None:
         """
         Load cookies from a file.
@@ -72,7 +85,7 @@ class SpotifyClient(MusicProviderClient):
             'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36',
         }
         cookies = self.cookies if fetch_with_cookies else None
-        response = requests.get(url, headers=headers, cookies=cookies)
+        response = transport.get_session(url).get(url, headers=headers, cookies=cookies)
         response.raise_for_status()
         soup = BeautifulSoup(response.text, 'html.parser')
         session_script = soup.find('script', {'id': 'session'})
@@ -110,7 +123,7 @@ class SpotifyClient(MusicProviderClient):
                 }
             }
         }
-        response = requests.post(url, headers=headers, json=payload, cookies=self.cookies)
+        response = transport.get_session(url).post(url, headers=headers, json=payload, cookies=self.cookies)
         response.raise_for_status()
         l.debug("fetched granted_token")
         return response.json().get("granted_token", "")
@@ -119,6 +132,11 @@ class SpotifyClient(MusicProviderClient):
         """
         Helper method to make authenticated requests to Spotify APIs.
         """
+        # authenticate on first use, the app doesn't authenticate at startup with LAZY_STARTUP
+        if self.session_data is None or self.client_token is None:
+            with self._auth_lock:
+                if self.session_data is None or self.client_token is None:
+                    self.authenticate()
         headers = {
             'accept': 'application/json',
             'app-platform': 'WebPlayer',
@@ -126,14 +144,17 @@ class SpotifyClient(MusicProviderClient):
             'client-token': self.client_token.get('token',''),
         }
         l.debug(f"starting request: {self.base_url}/{endpoint}")
-        response = requests.get(f"{self.base_url}/{endpoint}", headers=headers, params=params, cookies=self.cookies)
+        response = self.session.get(f"{self.base_url}/{endpoint}", headers=headers, params=params, cookies=self.cookies)
         # if the response is unauthorized, we need to reauthenticate
         if response.status_code == 401:
-            l.debug("reauthenticating")
-            self.authenticate()
+            with self._auth_lock:
+                # another thread might have reauthenticated in the meantime
+                if headers['authorization'] == f'Bearer {self.session_data.get("accessToken", "")}':
+                    l.debug("reauthenticating")
+                    self.authenticate()
             headers['authorization'] = f'Bearer {self.session_data.get("accessToken", "")}'
             headers['client-token'] = self.client_token.get('token','')
-            response = requests.get(f"{self.base_url}/{endpoint}", headers=headers, params=params, cookies=self.cookies)
+            response = self.session.get(f"{self.base_url}/{endpoint}", headers=headers, params=params, cookies=self.cookies)
         
         response.raise_for_status()
         return response.json()
@@ -316,6 +337,7 @@ class SpotifyClient(MusicProviderClient):
             followers=playlist_data.get("followers", 0),
             images=images,
             owner=owner,
+            snapshot_id=playlist_data.get("revisionId"),
             tracks=[
                 PlaylistTrack(
                     added_at=item.get("addedAt", {}).get("isoString", ""),
@@ -349,43 +371,68 @@ class SpotifyClient(MusicProviderClient):
     
     #endregion
 
+    def _fetch_playlist_page(self, playlist_id: str, offset: int, limit: int) -> Dict:
+        """
+        Fetch a single page of a playlist using the fetchPlaylist query.
+
+        :param playlist_id: The ID of the playlist.
+        :param offset: Index of the first item to fetch.
+        :param limit: Maximum number of items to fetch.
+        :return: The playlistV2 part of the response.
+        """
+        query_parameters = {
+            "operationName": "fetchPlaylist",
+            "variables": json.dumps({
+                "uri": f"spotify:playlist:{playlist_id}",
+                "offset": offset,
+                "limit": limit
+            }),
+            "extensions": json.dumps({
+                "persistedQuery": {
+                    "version": 1,
+                    "sha256Hash": "19ff1327c29e99c208c86d7a9d8f1929cfdf3d3202a0ff4253c821f1901aa94d"
+                }
+            })
+        }
+        encoded_query = urlencode(query_parameters)
+        data = self._make_request(f"pathfinder/v1/query?{encoded_query}")
+        return data.get('data', {}).get('playlistV2', {})
+
     def get_playlist(self, playlist_id: str) -> Playlist:
         """
         Fetch a playlist by ID with all tracks.
+        The first page tells the total count, the remaining pages are fetched concurrently.
         """
         limit = 50
-        offset = 0
-        all_items = []
-
-        while True:
-            query_parameters = {
-                "operationName": "fetchPlaylist",
-                "variables": json.dumps({
-                    "uri": f"spotify:playlist:{playlist_id}",
-                    "offset": offset,
-                    "limit": limit
-                }),
-                "extensions": json.dumps({
-                    "persistedQuery": {
-                        "version": 1,
-                        "sha256Hash": "19ff1327c29e99c208c86d7a9d8f1929cfdf3d3202a0ff4253c821f1901aa94d"
-                    }
-                })
-            }
-            encoded_query = urlencode(query_parameters)
-            data = self._make_request(f"pathfinder/v1/query?{encoded_query}")
-            playlist_data = data.get('data', {}).get('playlistV2', {})
-            content = playlist_data.get('content', {})
-            items = content.get('items', [])
-            all_items.extend(items)
-
-            if len(all_items) >= content.get('totalCount', 0):
-                break
-
-            offset += limit
+        playlist_data = self._fetch_playlist_page(playlist_id, 0, limit)
+        content = playlist_data.get('content', {})
+        all_items = list(content.get('items', []))
+
+        offsets = list(range(limit, content.get('totalCount', 0), limit))
+        if offsets:
+            l.debug(f"fetching {len(offsets)} more pages of playlist {playlist_id}")
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(offsets))) as executor:
+                # map keeps the order of the offsets, so the pages are reassembled in order
+                pages = executor.map(lambda offset: self._fetch_playlist_page(playlist_id, offset, limit), offsets)
+                for page in pages:
+                    all_items.extend(page.get('content', {}).get('items', []))
 
         playlist_data["content"]["items"] = all_items
         return self._parse_playlist(playlist_data)
+
+    def get_playlist_snapshot_id(self, playlist_id: str) -> Optional[str]:
+        """
+        Fetch the revision id of a playlist by requesting only its first item.
+
+        :param playlist_id: The ID of the playlist.
+        :return: The revision id, or None if it could not be determined.
+        """
+        try:
+            playlist_data = self._fetch_playlist_page(playlist_id, 0, 1)
+            return playlist_data.get('revisionId')
+        except Exception as e:
+            l.warning(f"Could not fetch revision id for playlist {playlist_id}: {e}")
+            return None
     
     def extract_playlist_id(self, uri: str) -> str:
         """
@@ -472,6 +519,17 @@ class SpotifyClient(MusicProviderClient):
             print(f"An error occurred while fetching the track: {e}")
             return None
 
+    def get_tracks(self, track_ids: List[str]) -> List[Optional[Track]]:
+        """
+        Fetches many tracks concurrently, pathfinder has no query for several tracks.
+        :param track_ids: The IDs of the tracks.
+        :return: The Track objects in the order of track_ids, None for tracks which could not be fetched.
+        """
+        if len(track_ids) <= 1:
+            return [self.get_track(track_id) for track_id in track_ids]
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(track_ids))) as executor:
+            return list(executor.map(self.get_track, track_ids))
+
     
     # non generic method implementations: 
     def get_profile(self) -> Optional[Profile]:
@@ -0,0 +1,159 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict
+from typing import Dict, Iterable, Optional
+
+from app.providers.base import Album, Artist, ExternalUrl, Image, Track
+
+l = logging.getLogger(__name__)
+
+
+def track_to_json(track: Track) -> str:
+    return json.dumps(asdict(track), separators=(',', ':'))
+
+
+def track_from_json(data: str) -> Track:
+    def urls(values):
+        return [ExternalUrl(**url) for url in values] if values is not None else None
+
+    def artist(value):
+        return Artist(value['id'], value['name'], value['uri'], urls(value['external_urls']))
+
+    value = json.loads(data)
+    album = value['album']
+    if album is not None:
+        album = Album(album['id'], album['name'], album['uri'], urls(album['external_urls']),
+                      [artist(a) for a in album['artists']], [Image(**image) for image in album['images']])
+    return Track(value['id'], value['name'], value['uri'], urls(value['external_urls']),
+                 value['duration_ms'], value['explicit'], album, [artist(a) for a in value['artists']])
+
+
+class TrackCache:
+    """
+    Cache for track metadata of all music providers.
+
+    Tracks are stored as JSON in redis, shared by all processes, with an LRU in front of it in every process.
+    Lookups of many tracks are done with a single MGET, writes with a pipeline. Hits and misses are counted
+    per process, and added to the redis hash `{prefix}_stats` of all processes every stats_interval seconds.
+    """
+    def __init__(self, redis_client, ttl: int = 3600 * 24 * 10, lru_size: int = 2048, lru_ttl: int = 3600,
+                 prefix: str = 'track_meta', stats_interval: int = 10):
+        self.redis = redis_client
+        self.ttl = ttl
+        self.lru_size = lru_size
+        self.lru_ttl = lru_ttl
+        self.prefix = prefix
+        self._lru: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'lru_hits': 0, 'redis_hits': 0, 'misses': 0, 'sets': 0}
+        self.stats_interval = stats_interval
+        self._unflushed = {}
+        self._flushed_at = time.monotonic()
+
+    def _key(self, provider_id: str, track_id: str) -> str:
+        return f'{self.prefix}:{provider_id}:{track_id}'
+
+    def get(self, provider_id: str, track_id: str) -> Optional[Track]:
+        return self.get_many(provider_id, [track_id]).get(track_id)
+
+    def set(self, provider_id: str, track: Track) -> None:
+        self.set_many(provider_id, [track])
+
+    def get_many(self, provider_id: str, track_ids: Iterable[str]) -> Dict[str, Track]:
+        """
+        Looks up many tracks at once.
+        :param provider_id: The provider of the tracks.
+        :param track_ids: The provider track ids, may contain duplicates.
+        :return: A dict track id -> Track, tracks which are not cached are left out.
+        """
+        track_ids = list(dict.fromkeys(track_ids))
+        result = {}
+        now = time.monotonic()
+        with self._lock:
+            for track_id in track_ids:
+                key = self._key(provider_id, track_id)
+                entry = self._lru.get(key)
+                if entry and entry[0] > now:
+                    self._lru.move_to_end(key)
+                    result[track_id] = entry[1]
+        lru_hits = len(result)
+
+        missing = [track_id for track_id in track_ids if track_id not in result]
+        if missing:
+            try:
+                values = self.redis.mget([self._key(provider_id, track_id) for track_id in missing])
+            except Exception as e:
+                l.warning(f"Track cache not available: {str(e)}")
+                values = [None] * len(missing)
+            found = {}
+            for track_id, value in zip(missing, values):
+                if value is None:
+                    continue
+                try:
+                    found[track_id] = track_from_json(value)
+                except (ValueError, KeyError, TypeError) as e:
+                    l.debug(f"Dropping unreadable cache entry of track {track_id}: {str(e)}")
+            result.update(found)
+            self._remember(provider_id, found.values())
+
+        self._count(lru_hits=lru_hits, redis_hits=len(result) - lru_hits, misses=len(track_ids) - len(result))
+        return result
+
+    def set_many(self, provider_id: str, tracks: Iterable[Track]) -> None:
+        """
+        Stores many tracks at once, None entries are skipped.
+        """
+        tracks = [track for track in tracks if track is not None]
+        if not tracks:
+            return
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for track in tracks:
+                pipe.set(self._key(provider_id, track.id), track_to_json(track), ex=self.ttl)
+            pipe.execute()
+        except Exception as e:
+            l.warning(f"Track cache not available: {str(e)}")
+        self._remember(provider_id, tracks)
+        self._count(sets=len(tracks))
+
+    def get_stats(self) -> dict:
+        """
+        Returns the counters of this process and of all processes together.
+        """
+        try:
+            total = {name: int(value) for name, value in self.redis.hgetall(f'{self.prefix}_stats').items()}
+        except Exception:
+            total = {}
+        with self._lock:
+            return {'process': dict(self.stats, lru_size=len(self._lru)), 'total': total}
+
+    def _remember(self, provider_id: str, tracks: Iterable[Track]) -> None:
+        expires_at = time.monotonic() + self.lru_ttl
+        with self._lock:
+            for track in tracks:
+                key = self._key(provider_id, track.id)
+                self._lru[key] = (expires_at, track)
+                self._lru.move_to_end(key)
+            while len(self._lru) > self.lru_size:
+                self._lru.popitem(last=False)
+
+    def _count(self, **counts: int) -> None:
+        now = time.monotonic()
+        with self._lock:
+            for name, value in counts.items():
+                if value:
+                    self.stats[name] += value
+                    self._unflushed[name] = self._unflushed.get(name, 0) + value
+            if not self._unflushed or now - self._flushed_at < self.stats_interval:
+                return
+            unflushed, self._unflushed, self._flushed_at = self._unflushed, {}, now
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for name, value in unflushed.items():
+                pipe.hincrby(f'{self.prefix}_stats', name, value)
+            pipe.execute()
+        except Exception:
+            pass
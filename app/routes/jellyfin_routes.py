@@ -1,11 +1,10 @@
 from collections import defaultdict
+import hmac
 import time
 from flask import Blueprint, Flask, jsonify, render_template, request, redirect, url_for, session, flash
-from sqlalchemy import insert
-from app import app, db,  jellyfin, functions, device_id,sp
+from app import app, db,  jellyfin, functions, device_id, redis_client
 from app.models import JellyfinUser, Playlist,Track,  playlist_tracks
-from spotipy.exceptions import SpotifyException
-from app.tasks import task_manager
+from app.tasks import task_manager, update_jellyfin_library_index
 
 from app.registry.music_provider_registry import MusicProviderRegistry
 from jellyfin.objects import PlaylistMetadata
@@ -18,10 +17,11 @@ def jellyfin_playlists():
         playlists_by_provider = defaultdict(list)
         provider_playlists_data = {}
 
+        jellyfin_ids = [pl['Id'] for pl in playlists]
+        from_db_by_jellyfin_id = {pl.jellyfin_id: pl for pl in Playlist.query.filter(Playlist.jellyfin_id.in_(jellyfin_ids)).all()} if jellyfin_ids else {}
         for pl in playlists:
-            from_db : Playlist | None = Playlist.query.filter_by(jellyfin_id=pl['Id']).first()
+            from_db : Playlist | None = from_db_by_jellyfin_id.get(pl['Id'])
             if from_db and from_db.provider_playlist_id:
-                pl_id = from_db.provider_playlist_id
                 playlists_by_provider[from_db.provider_id].append(from_db)
 
                 # 3. Fetch all Data from the provider using the get_playlist() method 
@@ -32,18 +32,11 @@ def jellyfin_playlists():
                 flash(f"Provider {provider_id} not found.", "error")
                 continue
 
-            combined_playlists = []
-            for pl in playlists:
-                # Use the cached provider_playlist_id to fetch the playlist from the provider
-                provider_playlist = functions.get_cached_provider_playlist(pl.provider_playlist_id,pl.provider_id)
-                #provider_playlist = provider_client.get_playlist(pl.provider_playlist_id)
-                
-                # 4. Convert the playlists to CombinedPlaylistData
-                combined_data = functions.prepPlaylistData(provider_playlist)
-                if combined_data:
-                    combined_playlists.append(combined_data)
-
-            provider_playlists_data[provider_id] = combined_playlists
+            # Use the cached provider_playlist_id to fetch the playlist from the provider
+            provider_playlists = [functions.get_cached_provider_playlist(pl.provider_playlist_id,pl.provider_id) for pl in playlists]
+            
+            # 4. Convert the playlists to CombinedPlaylistData
+            provider_playlists_data[provider_id] = functions.prepPlaylistsData([pl for pl in provider_playlists if pl])
 
                 # 5. Display the resulting Groups in a template called 'monitored_playlists.html', one Heading per Provider
         return render_template('monitored_playlists.html', provider_playlists_data=provider_playlists_data,title="Jellyfin Playlists" , subtitle="Playlists you have added to Jellyfin")
@@ -86,31 +79,9 @@ def add_playlist():
                 task_manager.start_task('download_missing_tracks')
         # Get the logged-in user
         user : JellyfinUser = functions._get_logged_in_user()
-        playlist.tracks_available = 0
-        
-        for idx, track_data in enumerate(playlist_data.tracks):
-            
-            track = Track.query.filter_by(provider_track_id=track_data.track.id, provider_id=provider_id).first()
-
-            if not track:
-                # Add new track if it doesn't exist
-                track = Track(name=track_data.track.name, provider_track_id=track_data.track.id, provider_uri=track_data.track.uri, downloaded=False,provider_id = provider_id)
-                db.session.add(track)
-                db.session.commit()
-            elif track.downloaded:
-                playlist.tracks_available += 1
-                db.session.commit()
-
-            # Add track to playlist with order if it's not already associated
-            if track not in playlist.tracks:
-                # Insert into playlist_tracks with track order
-                stmt = insert(playlist_tracks).values(
-                    playlist_id=playlist.id,
-                    track_id=track.id,
-                    track_order=idx  # Maintain the order of tracks
-                )
-                db.session.execute(stmt)
-                db.session.commit()
+        functions.sync_playlist_tracks(playlist, playlist_data.tracks)
+        functions.refresh_playlist_counters([playlist.id])
+        db.session.commit()
         
         functions.update_playlist_metadata(playlist,playlist_data)
         
@@ -178,9 +149,6 @@ def refresh_playlist(playlist_id):
     # if the playlist has a jellyfin_id, then fetch the playlist from Jellyfin
     if playlist.jellyfin_id:
         try:
-            app.logger.debug(f"removing all tracks from playlist {playlist.jellyfin_id}")
-            jellyfin_playlist = jellyfin.get_music_playlist(session_token=functions._get_api_token(), playlist_id=playlist.jellyfin_id)  
-            jellyfin.remove_songs_from_playlist(session_token=functions._get_token_from_sessioncookie(), playlist_id=playlist.jellyfin_id, song_ids=[track for track in jellyfin_playlist['ItemIds']])
             ordered_tracks = db.session.execute(
                             db.select(Track, playlist_tracks.c.track_order)
                             .join(playlist_tracks, playlist_tracks.c.track_id == Track.id)
@@ -189,8 +157,9 @@ def refresh_playlist(playlist_id):
                         ).all()
 
             tracks = [track.jellyfin_id for track, idx in ordered_tracks if track.jellyfin_id is not None]
-            #jellyfin.remove_songs_from_playlist(session_token=jellyfin_admin_token, playlist_id=playlist.jellyfin_id, song_ids=tracks)
-            jellyfin.add_songs_to_playlist(session_token=functions._get_api_token(), user_id=functions._get_admin_id(), playlist_id=playlist.jellyfin_id, song_ids=tracks)
+            app.logger.debug(f"syncing tracks of playlist {playlist.jellyfin_id}")
+            synced = jellyfin.sync_playlist_items(session_token=functions._get_api_token(), user_id=functions._get_admin_id(), playlist_id=playlist.jellyfin_id, item_ids=tracks)
+            app.logger.debug(f"playlist {playlist.jellyfin_id}: {synced['added']} added, {synced['removed']} removed, {synced['moved']} moved")
             # if the playlist is found, then update the playlist metadata
             provider_playlist = MusicProviderRegistry.get_provider(playlist.provider_id).get_playlist(playlist.provider_playlist_id)
             functions.update_playlist_metadata(playlist, provider_playlist)
@@ -245,6 +214,43 @@ def search_jellyfin():
     provider_track_id = request.args.get('provider_track_id')
     if search_query:
         results = jellyfin.search_music_tracks(functions._get_token_from_sessioncookie(), search_query)
+        profiles = {}
+        if app.config['DISPLAY_EXTENDED_AUDIO_DATA']:
+            # only cached profiles are shown right away, the others are analyzed in the background and loaded by the page
+            paths = [result.get('Path') for result in results if result.get('Path')]
+            profiles = functions.get_audio_profiles(paths, probe=False)
+            functions.request_audio_file_profiles([path for path in paths if path not in profiles])
         # Render only the search results section as response
-        return render_template('partials/_jf_search_results.html', results=results,provider_track_id=  provider_track_id,search_query = search_query)
-    return jsonify({'error': 'No search query provided'}), 400
\ No newline at end of file
+        return render_template('partials/_jf_search_results.html', results=results,provider_track_id=  provider_track_id,search_query = search_query, profiles=profiles)
+    return jsonify({'error': 'No search query provided'}), 400
+
+@app.route('/jellyfin_audio_profile/<string:jellyfin_id>', methods=['GET'])
+@functions.jellyfin_login_required
+def jellyfin_audio_profile(jellyfin_id):
+    path = functions.get_jellyfin_paths([jellyfin_id]).get(jellyfin_id)
+    profiles = functions.get_audio_profiles([path], probe=False) if path else {}
+    if path and path not in profiles:
+        functions.request_audio_file_profiles([path])
+    return render_template('partials/_audio_profile.html', profile=profiles.get(path), profile_available=bool(path),
+                           profile_pending=bool(path) and path not in profiles, profile_url=url_for('jellyfin_audio_profile', jellyfin_id=jellyfin_id))
+
+@app.route('/jellyfin/webhook', methods=['POST'])
+def jellyfin_webhook():
+    """
+    Receives notifications of the Jellyfin webhook plugin. Added audio items trigger an update of the library index,
+    which links the new items to the tracks waiting for them. The token is passed as X-Jellyplist-Token header or token parameter.
+    """
+    token = app.config['JELLYFIN_WEBHOOK_TOKEN']
+    if not token:
+        return jsonify({'error': 'Webhook not enabled'}), 404
+    if not hmac.compare_digest(request.headers.get('X-Jellyplist-Token') or request.args.get('token') or '', token):
+        return jsonify({'error': 'Invalid token'}), 403
+
+    event = request.get_json(silent=True) or {}
+    if event.get('NotificationType', 'ItemAdded') != 'ItemAdded' or event.get('ItemType', 'Audio') != 'Audio':
+        return jsonify({'status': 'ignored'})
+    # a library scan sends one notification per item, they are collected into one incremental update
+    if redis_client.set('jellyfin_webhook_update_pending', 1, ex=60, nx=True):
+        update_jellyfin_library_index.apply_async(countdown=30)
+        return jsonify({'status': 'scheduled'})
+    return jsonify({'status': 'already scheduled'})
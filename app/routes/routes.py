@@ -3,7 +3,7 @@ import json
 import os
 import re
 from flask import Flask, Response, jsonify, render_template, request, redirect, url_for, session, flash, Blueprint, g
-from app import app, db, functions, jellyfin, read_dev_build_file, tasks, save_yaml_settings
+from app import app, db, functions, jellyfin, read_dev_build_file, redis_client, tasks, save_yaml_settings, track_cache
 from app.classes import AudioProfile, CombinedPlaylistData
 from app.models import JellyfinUser,Playlist,Track
 from celery.result import AsyncResult
@@ -16,14 +16,13 @@ from app.registry.music_provider_registry import MusicProviderRegistry
 from lidarr.classes import Album, Artist
 from lidarr.client import LidarrClient
 from ..version import __version__
-from spotipy.exceptions import SpotifyException
 from collections import defaultdict
 from app.routes import pl_bp
 
 
 @app.context_processor
 def add_context():
-    unlinked_track_count = len(Track.query.filter_by(downloaded=True,jellyfin_id=None).all())
+    unlinked_track_count = functions.get_unlinked_track_count()
     version = f"v{__version__}{read_dev_build_file()}"
     return dict(unlinked_track_count = unlinked_track_count, version = version, config = app.config , registered_providers = MusicProviderRegistry.list_providers())
 
@@ -73,8 +72,19 @@ def task_manager():
         statuses[task_name] = tasks.task_manager.get_task_status(task_name)
         lock_keys.append(f"{task_name}_lock")
     lock_keys.append('full_update_jellyfin_ids_lock')
+    lock_keys.append('full_update_jellyfin_library_index_lock')
     return render_template('admin/tasks.html', tasks=statuses,lock_keys = lock_keys)
 
+@app.route('/admin/startup')
+@functions.jellyfin_admin_required
+def startup_report():
+    reports = []
+    for role in ['web', 'worker', 'beat', 'cli']:
+        report = redis_client.get(f'startup_report_{role}')
+        if report:
+            reports.append(json.loads(report))
+    return render_template('admin/startup.html', reports=reports, track_cache_stats=track_cache.get_stats())
+
 @app.route('/admin/link_issues')
 @functions.jellyfin_admin_required
 def link_issues():
@@ -85,8 +95,11 @@ def link_issues():
     else:
         unlinked_tracks = Track.query.filter_by(downloaded=True,jellyfin_id=None).all()
     tracks = []
+    provider_tracks = functions.get_cached_provider_tracks_of(unlinked_tracks)
     for ult in unlinked_tracks: 
-        provider_track = functions.get_cached_provider_track(ult.provider_track_id, ult.provider_id)
+        provider_track = provider_tracks[ult.id]
+        if not provider_track:
+            continue
         duration_ms = provider_track.duration_ms
         minutes = duration_ms // 60000
         seconds = (duration_ms % 60000) // 1000
@@ -105,7 +118,7 @@ def link_issues():
                 'provider_id' : ult.provider_id
             })
 
-    return render_template('admin/link_issues.html' , tracks = tracks )
+    return render_template('admin/link_issues.html' , tracks = tracks, offset = 0, next_page = None)
 
 @app.route('/admin/logs')
 @functions.jellyfin_admin_required
@@ -205,6 +218,7 @@ def task_status():
         lock_keys.append(f"{task_name}_lock")
         
     lock_keys.append('full_update_jellyfin_ids_lock')
+    lock_keys.append('full_update_jellyfin_library_index_lock')
 
     # Render the HTML partial template instead of returning JSON
     return render_template('partials/_task_status.html', tasks=statuses, lock_keys = lock_keys)
@@ -283,13 +297,8 @@ def browse():
 @functions.jellyfin_login_required
 def browse_page(page_id):
     provider: MusicProviderClient = g.music_provider  
-    combined_playlist_data : List[CombinedPlaylistData] = []
-    
     data = provider.browse_page(page_id)
-    for item in data:
-        cpd = functions.prepPlaylistData(item)
-        if cpd:
-            combined_playlist_data.append(cpd)
+    combined_playlist_data : List[CombinedPlaylistData] = functions.prepPlaylistsData(data)
     return render_template('browse_page.html', data=combined_playlist_data,provider_id=provider._identifier)
 
 @pl_bp.route('/playlists/monitored')
@@ -313,15 +322,9 @@ def monitored_playlists():
             flash(f"Provider {provider_id} not found.", "error")
             continue
 
-        combined_playlists = []
-        for pl in playlists:
-            provider_playlist = functions.get_cached_provider_playlist(pl.provider_playlist_id,pl.provider_id)
-            # 4. Convert the playlists to CombinedPlaylistData
-            combined_data = functions.prepPlaylistData(provider_playlist)
-            if combined_data:
-                combined_playlists.append(combined_data)
-
-        provider_playlists_data[provider_id] = combined_playlists
+        provider_playlists = [functions.get_cached_provider_playlist(pl.provider_playlist_id,pl.provider_id) for pl in playlists]
+        # 4. Convert the playlists to CombinedPlaylistData
+        provider_playlists_data[provider_id] = functions.prepPlaylistsData([pl for pl in provider_playlists if pl])
 
     # 5. Display the resulting Groups in a template called 'monitored_playlists.html', one Heading per Provider
     return render_template('monitored_playlists.html', provider_playlists_data=provider_playlists_data, title="Monitored Playlists", subtitle="Playlists which are already monitored by Jellyplist and are available immediately")
@@ -345,12 +348,7 @@ def searchResults():
                 flash(f"Error fetching search results from {provider_id}: {str(e)}", "error")
         # the grouped search results, must be prepared using the prepPlaylistData function
         for provider_id, playlists in search_results.items():
-            combined_playlists = []
-            for pl in playlists:
-                combined_data = functions.prepPlaylistData(pl)
-                if combined_data:
-                    combined_playlists.append(combined_data)
-            search_results[provider_id] = combined_playlists
+            search_results[provider_id] = functions.prepPlaylistsData(playlists)
             
         context['provider_playlists_data'] = search_results
         context['title'] = 'Search Results'
@@ -393,16 +391,55 @@ def track_details(track_id):
         'provider_id': track.provider_id,
         'jellyfin_filesystem_path': jellyfin_filesystem_path if track.jellyfin_id else None,
     }
+    return render_template('partials/track_details.html', track=track_details, **_track_audio_profile_context(track))
 
-    return render_template('partials/track_details.html', track=track_details)
+@pl_bp.route('/track_details/<track_id>/audio_profile')
+@functions.jellyfin_login_required
+def track_audio_profile(track_id):
+    provider_id = request.args.get('provider')
+    track = Track.query.filter_by(provider_track_id=track_id, provider_id=provider_id).first()
+    if not track:
+        return jsonify({'error': 'Track not found'}), 404
+    return render_template('partials/_audio_profile.html', **_track_audio_profile_context(track))
+
+def _track_audio_profile_context(track: Track) -> dict:
+    # the profile is computed by a background task, until it is stored the partial polls for it
+    pending = track.downloaded and track.audio_profiled_at is None
+    if pending:
+        functions.request_track_audio_profile(track)
+    return {
+        'profile': track.audio_profile,
+        'profile_available': bool(track.downloaded),
+        'profile_pending': pending,
+        'profile_url': url_for('playlist.track_audio_profile', track_id=track.provider_track_id, provider=track.provider_id),
+    }
 
 @pl_bp.route('/playlist/view/<playlist_id>')
 @functions.jellyfin_login_required
 def get_playlist_tracks(playlist_id):
     provider: MusicProviderClient = g.music_provider  
-    playlist: base.Playlist = provider.get_playlist(playlist_id)
-    tracks = functions.get_tracks_for_playlist(playlist.tracks, provider_id=provider._identifier)  
-    total_duration_ms = sum([track.duration_ms for track in tracks])
+    page = max(request.args.get('page', 1, type=int), 1)
+    page_size = app.config['TRACKS_PAGE_SIZE']
+    offset = (page - 1) * page_size
+    if page > 1:
+        # following pages are requested while scrolling, the playlist was just fetched for the first page
+        playlist: base.Playlist = functions.get_cached_provider_playlist(playlist_id, provider._identifier)
+    else:
+        playlist: base.Playlist = provider.get_playlist(playlist_id)
+    tracks = functions.get_tracks_for_playlist(playlist.tracks[offset:offset + page_size], provider_id=provider._identifier)  
+    next_page = page + 1 if offset + page_size < len(playlist.tracks) else None
+
+    if page > 1:
+        return render_template(
+            'partials/_track_rows.html',
+            tracks=tracks,
+            offset=offset,
+            next_page=next_page,
+            playlist_id=playlist_id,
+            provider_id=provider._identifier,
+        )
+
+    total_duration_ms = sum([item.track.duration_ms for item in playlist.tracks if item.track])
 
     # Convert the total duration to a readable format
     hours, remainder = divmod(total_duration_ms // 1000, 3600)
@@ -417,8 +454,11 @@ def get_playlist_tracks(playlist_id):
     return render_template(
         'tracks_table.html',
         tracks=tracks,
+        offset=offset,
+        next_page=next_page,
+        playlist_id=playlist_id,
         total_duration=total_duration,
-        track_count=len(tracks),
+        track_count=len(playlist.tracks),
         provider_id = provider._identifier,
         item=functions.prepPlaylistData(playlist),
         
@@ -441,11 +481,15 @@ def associate_track():
         return ''
 
     # Associate the Jellyfin ID with the track
-    track.jellyfin_id = jellyfin_id
+    if track.jellyfin_id != jellyfin_id:
+        # the stored path and audio profile belong to the previous file
+        track.jellyfin_id = jellyfin_id
+        track.filesystem_path = None
+        track.audio_profiled_at = None
     track.downloaded = True
-    
 
     try:
+        functions.refresh_playlist_counters([playlist.id for playlist in track.playlists])
         # Commit the changes to the database
         db.session.commit()
         flash("Track associated","success")
@@ -1,16 +1,18 @@
-from datetime import datetime,timezone
+from collections import defaultdict
+from datetime import datetime,timedelta,timezone
+import hashlib
 import logging
 import subprocess
-from typing import List
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Optional
+from sqlalchemy import update
 
-from sqlalchemy import insert
-from app import celery, app, db, functions, sp, jellyfin, jellyfin_admin_token, jellyfin_admin_id, redis_client
+from app import celery, app, db, functions, jellyfin, jellyfin_admin, matching, redis_client
 
-from app.classes import AudioProfile
-from app.models import JellyfinUser,Playlist,Track, user_playlists, playlist_tracks
+from app.models import JellyfinFingerprint, JellyfinItem, JellyfinUser,Playlist,Track, user_playlists, playlist_tracks
 import os
 import redis
-from celery import current_task,signals
+from celery import chord, current_task,signals
 from celery.result import AsyncResult
 
 from app.providers import base
@@ -40,57 +42,51 @@ def update_all_playlists_track_status(self):
                     return {'status': 'No playlists found'}  
 
                 app.logger.info(f"Found {total_playlists} playlists to update.")
-                processed_playlists = 0
 
-                for playlist in playlists:
-                    total_tracks = 0
-                    available_tracks = 0
-                    app.logger.info(f"Current Playlist: {playlist.name} [{playlist.id}:{playlist.provider_playlist_id}]" )
-                    for track in playlist.tracks:
-                        total_tracks += 1
-                        app.logger.debug(f"Processing track: {track.name}  [{track.provider_track_id}]")
-                        app.logger.debug(f"\tPath = {track.filesystem_path}")
-                        if track.filesystem_path:
-                            app.logger.debug(f"\tPath exists = {os.path.exists(track.filesystem_path)}")
-                        app.logger.debug(f"\tJellyfinID = {track.jellyfin_id}")
-                        if track.filesystem_path and os.path.exists(track.filesystem_path):
-                            app.logger.info(f"Track {track.name} is already downloaded at {track.filesystem_path}.")
-                            available_tracks += 1
-                            track.downloaded = True
-                            db.session.commit()
-                        #If not found in filesystem, but a jellyfin_id is set, query the jellyfin server for the track and populate the filesystem_path from the response with the path
-                        elif track.jellyfin_id:
-                            jellyfin_track = jellyfin.get_item(jellyfin_admin_token, track.jellyfin_id)
-                            app.logger.debug(f"\tJellyfin Path: {jellyfin_track['Path']}")
-                            app.logger.debug(f"\tJellyfin Path exists: {os.path.exists(jellyfin_track['Path'])}")
-                            if jellyfin_track and os.path.exists(jellyfin_track['Path']):
-                                app.logger.info(f"Track {track.name} found in Jellyfin at {jellyfin_track['Path']}.")
-                                track.filesystem_path = jellyfin_track['Path']
-                                track.downloaded = True
-                                db.session.commit()
-                                available_tracks += 1
-                            else:
-                                track.downloaded = False
-                                track.filesystem_path = None
-                                db.session.commit()
-                                
-                        
-                        
-                            
-                        else:
-                            track.downloaded = False
-                            track.filesystem_path = None
-                            db.session.commit()
+                # every track is checked once, no matter in how many playlists it appears
+                tracks : List[Track] = Track.query.filter(Track.id.in_(db.select(playlist_tracks.c.track_id))).all()
+                total_tracks = len(tracks)
+                app.logger.info(f"Checking {total_tracks} distinct tracks.")
+                exists = functions.paths_exist([track.filesystem_path for track in tracks if track.filesystem_path])
+                self.update_state(state=f'Checked {total_tracks} tracks', meta={'current': 1, 'total': 3, 'percent': 33})
 
-                    playlist.track_count = total_tracks
-                    playlist.tracks_available = available_tracks
-                    db.session.commit()
+                #If not found in filesystem, but a jellyfin_id is set, query the jellyfin server for the track and populate the filesystem_path from the response with the path
+                jellyfin_ids = {track.jellyfin_id for track in tracks if track.jellyfin_id and not (track.filesystem_path and exists[track.filesystem_path])}
+                jellyfin_paths = {}
+                if jellyfin_ids:
+                    def get_jellyfin_path(jellyfin_id):
+                        try:
+                            return jellyfin.get_item(jellyfin_admin.token, jellyfin_id).get('Path')
+                        except Exception as e:
+                            app.logger.debug(f"\tJellyfin item {jellyfin_id} not found: {str(e)}")
+                            return None
+                    with ThreadPoolExecutor(max_workers=min(app.config['FS_STAT_WORKERS'], len(jellyfin_ids))) as executor:
+                        jellyfin_paths = dict(zip(jellyfin_ids, executor.map(get_jellyfin_path, jellyfin_ids)))
+                    exists.update(functions.paths_exist([path for path in jellyfin_paths.values() if path]))
+                self.update_state(state=f'Checked {len(jellyfin_ids)} Jellyfin items', meta={'current': 2, 'total': 3, 'percent': 66})
 
-                    processed_playlists += 1
-                    progress = (processed_playlists / total_playlists) * 100
-                    self.update_state(state='PROGRESS', meta={'current': processed_playlists, 'total': total_playlists, 'percent': progress})
-                    if processed_playlists % 10 == 0 or processed_playlists == total_playlists:
-                        app.logger.info(f"Processed {processed_playlists}/{total_playlists} playlists.")
+                changed_tracks = []
+                for track in tracks:
+                    if track.filesystem_path and exists[track.filesystem_path]:
+                        downloaded, filesystem_path = True, track.filesystem_path
+                    elif track.jellyfin_id and jellyfin_paths.get(track.jellyfin_id) and exists[jellyfin_paths[track.jellyfin_id]]:
+                        app.logger.info(f"Track {track.name} found in Jellyfin at {jellyfin_paths[track.jellyfin_id]}.")
+                        downloaded, filesystem_path = True, jellyfin_paths[track.jellyfin_id]
+                    else:
+                        downloaded, filesystem_path = False, None
+                    if track.filesystem_path != filesystem_path:
+                        changed_tracks.append({'id': track.id, 'downloaded': downloaded, 'filesystem_path': filesystem_path, 'audio_profiled_at': None})
+                    elif track.downloaded != downloaded:
+                        changed_tracks.append({'id': track.id, 'downloaded': downloaded, 'filesystem_path': filesystem_path})
+
+                if changed_tracks:
+                    app.logger.info(f"Updating the status of {len(changed_tracks)} tracks.")
+                    db.session.execute(update(Track), changed_tracks)
+
+                functions.refresh_playlist_counters()
+                db.session.commit()
+                processed_playlists = total_playlists
+                self.update_state(state='PROGRESS', meta={'current': 3, 'total': 3, 'percent': 100})
 
                 app.logger.info("All playlists' track statuses updated.")
                 return {'status': 'All playlists updated', 'total': total_playlists, 'processed': processed_playlists}
@@ -104,201 +100,269 @@ def update_all_playlists_track_status(self):
         return {'status': 'Task skipped, another instance is running'}
 
 
+DOWNLOAD_LOCK_KEY = "download_missing_tracks_lock"
+# the lock lives this long after the last sign of a running batch
+DOWNLOAD_LOCK_EXPIRATION = 60*30
+
 @celery.task(bind=True)
 def download_missing_tracks(self):
-    lock_key = "download_missing_tracks_lock"
+    """
+    Orchestrates the download of all undownloaded tracks. The tracks are split into batches, every batch is
+    downloaded by a download_tracks_batch subtask with a single spotDL process. The lock is held until
+    download_missing_tracks_finished has collected the results of all batches, or download_missing_tracks_failed
+    was called because a batch failed. The batches keep extending the lock while they run, so if a worker is lost
+    and neither is called, the lock expires soon after the last batch.
+    """
+    lock_key = DOWNLOAD_LOCK_KEY
 
-    if task_manager.acquire_lock(lock_key, expiration=1800): 
+    if task_manager.acquire_lock(lock_key, expiration=DOWNLOAD_LOCK_EXPIRATION): 
+        dispatched = False
         try:
             app.logger.info("Starting track download job...")
 
             with app.app_context():
-                spotdl_config: dict = app.config['SPOTDL_CONFIG']
-                cookie_file = spotdl_config.get('cookie_file', None)
-                output_dir = spotdl_config['output']
-                client_id = app.config['SPOTIFY_CLIENT_ID']
-                client_secret = app.config['SPOTIFY_CLIENT_SECRET']
-                search_before_download = app.config['SEARCH_JELLYFIN_BEFORE_DOWNLOAD']
-
+                batch_size = max(1, app.config['SPOTDL_BATCH_SIZE'])
                 # Downloading using SpotDL only works for Spotify tracks
-                undownloaded_tracks : List[Track] = Track.query.filter_by(downloaded=False,provider_id = "Spotify").all()
-                total_tracks = len(undownloaded_tracks)
-                if not undownloaded_tracks:
+                track_ids = [row.id for row in db.session.execute(
+                    db.select(Track.id).where(Track.downloaded == False, Track.provider_id == "Spotify").order_by(Track.id)
+                )]
+                total_tracks = len(track_ids)
+                if not track_ids:
                     app.logger.info("No undownloaded tracks found.")
                     return {'status': 'No undownloaded tracks found'}
 
-                app.logger.info(f"Found {total_tracks} tracks to download.")
-                app.logger.debug(f"output_dir: {output_dir}")
-                processed_tracks = 0
-                failed_downloads = 0
-                for track in undownloaded_tracks:
-                    app.logger.info(f"Processing track: {track.name} [{track.provider_track_id}]")
-                    self.update_state(state=f'[{processed_tracks}/{total_tracks}] {track.name} [{track.provider_track_id}]', meta={
-                        'current': processed_tracks,
-                        'total': total_tracks,
-                        'percent':  (processed_tracks / total_tracks) * 100 if processed_tracks > 0 else 0,
-                        'failed': failed_downloads
-                    })
-                    # Check if the track already exists in the output directory
-                    if os.getenv('SPOTDL_OUTPUT_FORMAT') == '__jellyplist/{track-id}':
-                        file_path = f"{output_dir.replace('{track-id}', track.provider_track_id)}"
-                    else:
-                        # if the output format is other than the default, we need to fetch the track first! 
-                        spotify_track = functions.get_cached_provider_track(track.provider_track_id, provider_id="Spotify")
-                        # spotify_track has name, artists, album and id
-                        # name needs to be mapped to {title}
-                        # artist[0] needs to be mapped to {artist}
-                        # artists needs to be mapped to {artists}
-                        # album needs to be mapped to {album} , but needs to be checked if it is set or not, because it is Optional
-                        # id needs to be mapped to {track-id}
-                        # the output format is then used to create the file path
-                        if spotify_track:
-                            
-                            file_path = output_dir.replace("{title}",spotify_track.name)
-                            file_path = file_path.replace("{artist}",spotify_track.artists[0].name)
-                            file_path = file_path.replace("{artists}",",".join([artist.name for artist in spotify_track.artists]))
-                            file_path = file_path.replace("{album}",spotify_track.album.name if spotify_track.album else "")
-                            file_path = file_path.replace("{track-id}",spotify_track.id)
-                            app.logger.debug(f"File path: {file_path}")
-                    
-                    if not file_path:
-                        app.logger.error(f"Error creating file path for track {track.name}.")
-                        failed_downloads += 1
-                        track.download_status = "Error creating file path"
-                        db.session.commit()
+                batches = [track_ids[i:i + batch_size] for i in range(0, total_tracks, batch_size)]
+                app.logger.info(f"Found {total_tracks} tracks to download, dispatching {len(batches)} batches of up to {batch_size} tracks.")
+                task_manager.init_progress('download_missing_tracks', total_tracks)
+                chord(download_tracks_batch.s(batch) for batch in batches)(
+                    download_missing_tracks_finished.s().on_error(download_missing_tracks_failed.s())
+                )
+                dispatched = True
+                return {'status': 'download_missing_tracks dispatched', 'total': total_tracks, 'batches': len(batches)}
+        except Exception as e:
+            app.logger.error(f"Error downloading tracks: {str(e)}", exc_info=True)
+            return {'status': 'Error downloading tracks'}
+        finally:
+            if not dispatched:
+                task_manager.release_lock(lock_key)
+    else:
+        app.logger.info("Skipping task. Another instance is already running.")
+        return {'status': 'Task skipped, another instance is running'}
+
+@celery.task(bind=True, max_retries=None)
+def download_tracks_batch(self, track_ids: List[int]):
+    """
+    Downloads a batch of tracks with one spotDL process. At most SPOTDL_CONCURRENCY batches run at the same time,
+    a batch which doesn't get a slot is retried later.
+    """
+    owner = self.request.id or 'locked'
+    try:
+        task_manager.extend_lock(DOWNLOAD_LOCK_KEY, DOWNLOAD_LOCK_EXPIRATION)
+        # the slot is refreshed before spotDL starts, until then it covers searching the tracks
+        slot_key = task_manager.acquire_slot('spotdl', app.config['SPOTDL_CONCURRENCY'], expiration=app.config['SPOTDL_TIMEOUT'] * len(track_ids) + 60, owner=owner)
+    except redis.RedisError as e:
+        app.logger.warning(f"Could not acquire a spotDL slot for batch {track_ids}: {str(e)}")
+        raise self.retry(countdown=15)
+    if not slot_key:
+        raise self.retry(countdown=15)
+
+    processed_tracks = 0
+    failed_downloads = 0
+    retry_later = False
+    try:
+        with app.app_context():
+            spotdl_config: dict = app.config['SPOTDL_CONFIG']
+            cookie_file = spotdl_config.get('cookie_file', None)
+            output_dir = spotdl_config['output']
+            search_before_download = app.config['SEARCH_JELLYFIN_BEFORE_DOWNLOAD']
+
+            tracks : List[Track] = Track.query.filter(Track.id.in_(track_ids), Track.downloaded == False).all()
+            provider_tracks = {}
+            if os.getenv('SPOTDL_OUTPUT_FORMAT') != '__jellyplist/{track-id}':
+                # the output format needs the track details, they are fetched for the whole batch at once
+                provider_tracks = functions.get_cached_provider_tracks([track.provider_track_id for track in tracks], provider_id="Spotify")
+            to_download = []
+            for track in tracks:
+                app.logger.info(f"Processing track: {track.name} [{track.provider_track_id}]")
+                file_path = _spotdl_file_path(track, output_dir, provider_tracks.get(track.provider_track_id))
+                if not file_path:
+                    app.logger.error(f"Error creating file path for track {track.name}.")
+                    failed_downloads += 1
+                    track.download_status = "Error creating file path"
+                    continue
+
+                # region search before download
+                if search_before_download:
+                    app.logger.info(f"Searching for track in Jellyfin: {track.name}")
+                    # at first try to find the track without fingerprinting it
+                    # a miss here leads to a download, so it is worth asking the server if the index doesn't know the track yet
+                    best_match = find_best_match_from_jellyfin(track, allow_search_fallback=True)
+                    if best_match:
+                        track.downloaded = True
+                        if track.jellyfin_id != best_match['Id']:
+                            track.jellyfin_id = best_match['Id']
+                            track.audio_profiled_at = None
+                            app.logger.info(f"Updated Jellyfin ID for track: {track.name} ({track.provider_track_id})")
+                        if track.filesystem_path != best_match['Path']:
+                            track.filesystem_path = best_match['Path']
+                            track.audio_profiled_at = None
+                        if best_match.get('audio_profile'):
+                            functions.apply_audio_profile(track, best_match['audio_profile'])
+                        processed_tracks += 1
                         continue
+                #endregion
+
+                if os.path.exists(file_path):
+                    app.logger.info(f"Track {track.name} is already downloaded at {file_path}. Marking as downloaded.")
+                    track.downloaded = True
+                    track.filesystem_path = file_path
+                    processed_tracks += 1
+                    continue
+
+                to_download.append((track, file_path))
+            db.session.commit()
+
+            if to_download:
+                # Attempt to download all remaining tracks with one spotdl process
+                timeout = app.config['SPOTDL_TIMEOUT'] * len(to_download)
+                task_manager.extend_lock(DOWNLOAD_LOCK_KEY, timeout + DOWNLOAD_LOCK_EXPIRATION)
+                if not task_manager.refresh_lock(slot_key, owner, timeout + 60):
+                    # searching took longer than the slot lived, it may be taken by another batch by now
+                    slot_key = task_manager.acquire_slot('spotdl', app.config['SPOTDL_CONCURRENCY'], expiration=timeout + 60, owner=owner)
+                    if not slot_key:
+                        app.logger.info(f"spotDL slot of batch {track_ids} expired, downloading later")
+                        retry_later = True
+                        to_download = []
+            if to_download:
+                try:
+                    app.logger.info(f"Trying to download {len(to_download)} tracks, spotdl timeout = {timeout}")
+                    command = [
+                        "spotdl", "download",
+                        *[f"https://open.spotify.com/track/{track.provider_track_id}" for track, _ in to_download],
+                        "--output", output_dir,
+                        "--client-id", app.config['SPOTIFY_CLIENT_ID'],
+                        "--client-secret", app.config['SPOTIFY_CLIENT_SECRET'],
+                        "--threads", str(spotdl_config.get('threads', 1))
+                    ]
+                    if cookie_file and os.path.exists(cookie_file):
+                        app.logger.debug(f"Found {cookie_file}, using it for spotDL")
+                        command.append("--cookie-file")
+                        command.append(cookie_file)
+                    if app.config['SPOTDL_PROXY']:
+                        app.logger.debug(f"Using proxy: {app.config['SPOTDL_PROXY']}")
+                        command.append("--proxy")
+                        command.append(app.config['SPOTDL_PROXY'])
                     
-                                           
-                                            
-                    # region search before download
-                    if search_before_download:
-                        app.logger.info(f"Searching for track in Jellyfin: {track.name}")
-                        # at first try to find the track without fingerprinting it
-                        best_match = find_best_match_from_jellyfin(track)
-                        if best_match:
-                            track.downloaded = True
-                            if track.jellyfin_id != best_match['Id']:
-                                track.jellyfin_id = best_match['Id']
-                                app.logger.info(f"Updated Jellyfin ID for track: {track.name} ({track.provider_track_id})")
-                            if track.filesystem_path != best_match['Path']:
-                                track.filesystem_path = best_match['Path']
-                            db.session.commit()
-                            processed_tracks+=1
-                            continue                
-                        
-                        # region search with fingerprinting   
-                        # as long as there is no endpoint found providing a preview url, we can't use this feature
-                        # if spotify_track:                     
-                        #     preview_url = spotify_track.get('preview_url')
-                        #     if not preview_url:
-                        #         app.logger.error(f"Preview URL not found for track {track.name}.")
-                        #         # Decide whether to skip or proceed to download
-                        #         # For now, we'll proceed to download
-                        #     else:
-                        #         # Get the list of Spotify artist names
-                        #         spotify_artists = [artist['name'] for artist in spotify_track['artists']]
-
-                        #         # Perform the search in Jellyfin
-                        #         match_found, jellyfin_file_path = jellyfin.search_track_in_jellyfin(
-                        #             session_token=jellyfin_admin_token,
-                        #             preview_url=preview_url,
-                        #             song_name=track.name,
-                        #             artist_names=spotify_artists
-                        #         )
-                        #         if match_found:
-                        #             app.logger.info(f"Match found in Jellyfin for track {track.name}. Skipping download.")
-                        #             track.downloaded = True
-                        #             track.filesystem_path = jellyfin_file_path
-                        #             db.session.commit()
-                        #             continue
-                        #         else:
-                        #             app.logger.info(f"No match found in Jellyfin for track {track.name}. Proceeding to download.")
-                        # else:
-                        #     app.logger.warning(f"spotify_track not set, see previous log messages")
-                        #endregion
-                                
-                    #endregion 
-                    if file_path:
+                    app.logger.info(f"Executing the spotDL command: {' '.join(command)}")
+                    result = subprocess.run(command, capture_output=True, text=True, timeout=timeout)
+                    if result.returncode != 0:
+                        app.logger.error(f"spotDL exited with {result.returncode}.")
+                        if result.stderr:
+                            app.logger.error(f"\t stderr: {result.stderr} ")
+                    # spotDL reports the whole batch, so the outcome of every track is determined by its file
+                    for track, file_path in to_download:
                         if os.path.exists(file_path):
-                            app.logger.info(f"Track {track.name} is already downloaded at {file_path}. Marking as downloaded.")
                             track.downloaded = True
                             track.filesystem_path = file_path
-                            db.session.commit()
-                            continue
-
-                    
-
-                    # Attempt to download the track using spotdl
-                    try:
-                        app.logger.info(f"Trying to download track: {track.name} ({track.provider_track_id}), spotdl timeout = 90")
-                        s_url = f"https://open.spotify.com/track/{track.provider_track_id}"
-                        
-                        command = [
-                            "spotdl", "download", s_url,
-                            "--output", output_dir,
-                            "--client-id", client_id,
-                            "--client-secret", client_secret
-                        ]
-                        if cookie_file and os.path.exists(cookie_file):
-                            app.logger.debug(f"Found {cookie_file}, using it for spotDL")
-                            command.append("--cookie-file")
-                            command.append(cookie_file)
-                        if app.config['SPOTDL_PROXY']:
-                            app.logger.debug(f"Using proxy: {app.config['SPOTDL_PROXY']}")
-                            command.append("--proxy")
-                            command.append(app.config['SPOTDL_PROXY'])
-                        
-                        app.logger.info(f"Executing the spotDL command: {' '.join(command)}")
-                        result = subprocess.run(command, capture_output=True, text=True, timeout=90)
-                        if result.returncode == 0:
-                            track.downloaded = True
-                            if file_path:
-                                track.filesystem_path = file_path
-                                app.logger.info(f"Track {track.name} downloaded successfully to {file_path}.")
+                            app.logger.info(f"Track {track.name} downloaded successfully to {file_path}.")
                         else:
                             app.logger.error(f"Download failed for track {track.name}.")
-                            if result.stdout:
-                                app.logger.error(f"\t stdout: {result.stdout}")
-                            if result.stderr:
-                                app.logger.error(f"\t stderr: {result.stderr} ")
                             failed_downloads += 1
-                            track.download_status = result.stdout[:2048]
-                    except Exception as e:
-                        app.logger.error(f"Error downloading track {track.name}: {str(e)}")
-                        failed_downloads += 1
-                        track.download_status = str(e)[:2048]
+                            track.download_status = _spotdl_output_for_track(result.stdout, track)[:2048]
+                except Exception as e:
+                    app.logger.error(f"Error downloading tracks {[track.name for track, _ in to_download]}: {str(e)}")
+                    for track, _ in to_download:
+                        if not track.downloaded:
+                            failed_downloads += 1
+                            track.download_status = str(e)[:2048]
+                processed_tracks += len(to_download)
+            # only the playlists containing tracks of this batch, batches running at the same time don't contend on all playlists
+            functions.refresh_playlist_counters(db.session.scalars(
+                db.select(playlist_tracks.c.playlist_id).where(playlist_tracks.c.track_id.in_(track_ids)).distinct()
+            ).all())
+            db.session.commit()
 
-                    processed_tracks += 1
-                    progress = (processed_tracks / total_tracks) * 100
-                    db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Error downloading batch {track_ids}: {str(e)}", exc_info=True)
+    finally:
+        try:
+            if slot_key:
+                task_manager.release_lock(slot_key, owner=owner)
+            if not retry_later:
+                task_manager.update_progress('download_missing_tracks', processed=len(track_ids), failed=failed_downloads)
+        except redis.RedisError as e:
+            app.logger.warning(f"Could not release the spotDL slot of batch {track_ids}: {str(e)}")
 
-                    self.update_state(state=f'[{processed_tracks}/{total_tracks}] {track.name} [{track.provider_track_id}]', meta={
-                        'current': processed_tracks,
-                        'total': total_tracks,
-                        'percent': progress,
-                        'failed': failed_downloads
-                    })
-
-                app.logger.info("Track download job finished.")
-                return {
-                    'status': 'download_missing_tracks finished',
-                    'total': total_tracks,
-                    'processed': processed_tracks,
-                    'failed': failed_downloads
-                }
-        except Exception as e:
-            app.logger.error(f"Error downloading tracks: {str(e)}", exc_info=True)
-            return {'status': 'Error downloading tracks'}
-        finally:
-            task_manager.release_lock(lock_key)
-            if app.config['REFRESH_LIBRARIES_AFTER_DOWNLOAD_TASK']:
-                libraries = jellyfin.get_libraries(jellyfin_admin_token)
-                for lib in libraries:
-                    if lib['CollectionType'] == 'music':
-                        jellyfin.refresh_library(jellyfin_admin_token, lib['ItemId'])
-    else:
-        app.logger.info("Skipping task. Another instance is already running.")
-        return {'status': 'Task skipped, another instance is running'}
+    if retry_later:
+        raise self.retry(countdown=15)
+    return {'total': len(track_ids), 'processed': processed_tracks, 'failed': failed_downloads}
+
+@celery.task
+def download_missing_tracks_failed(request, exc, traceback):
+    """
+    Error callback of the download chord, called instead of download_missing_tracks_finished if a batch failed.
+    """
+    app.logger.error(f"Track download job failed in task {request.id}: {exc}")
+    task_manager.release_lock(DOWNLOAD_LOCK_KEY)
+
+@celery.task(bind=True)
+def download_missing_tracks_finished(self, results):
+    try:
+        total_tracks = sum(result['total'] for result in results)
+        processed_tracks = sum(result['processed'] for result in results)
+        failed_downloads = sum(result['failed'] for result in results)
+        app.logger.info(f"Track download job finished. {processed_tracks}/{total_tracks} processed, {failed_downloads} failed.")
+        if app.config['REFRESH_LIBRARIES_AFTER_DOWNLOAD_TASK']:
+            libraries = jellyfin.get_libraries(jellyfin_admin.token)
+            for lib in libraries:
+                if lib['CollectionType'] == 'music':
+                    jellyfin.refresh_library(jellyfin_admin.token, lib['ItemId'])
+        return {
+            'status': 'download_missing_tracks finished',
+            'total': total_tracks,
+            'processed': processed_tracks,
+            'failed': failed_downloads
+        }
+    except Exception as e:
+        app.logger.error(f"Error finishing track download job: {str(e)}", exc_info=True)
+        return {'status': 'Error downloading tracks'}
+    finally:
+        task_manager.release_lock(DOWNLOAD_LOCK_KEY)
+
+def _spotdl_file_path(track: Track, output_dir: str, spotify_track: Optional[base.Track] = None) -> Optional[str]:
+    """
+    Computes the path spotDL will download a track to, based on SPOTDL_OUTPUT_FORMAT.
+    :param spotify_track: The track from the provider, fetched if not given and the output format needs it.
+    """
+    if os.getenv('SPOTDL_OUTPUT_FORMAT') == '__jellyplist/{track-id}':
+        return f"{output_dir.replace('{track-id}', track.provider_track_id)}"
+    # if the output format is other than the default, we need to fetch the track first! 
+    if spotify_track is None:
+        spotify_track = functions.get_cached_provider_track(track.provider_track_id, provider_id="Spotify")
+    # spotify_track has name, artists, album and id
+    # name needs to be mapped to {title}
+    # artist[0] needs to be mapped to {artist}
+    # artists needs to be mapped to {artists}
+    # album needs to be mapped to {album} , but needs to be checked if it is set or not, because it is Optional
+    # id needs to be mapped to {track-id}
+    # the output format is then used to create the file path
+    if not spotify_track:
+        return None
+    file_path = output_dir.replace("{title}",spotify_track.name)
+    file_path = file_path.replace("{artist}",spotify_track.artists[0].name)
+    file_path = file_path.replace("{artists}",",".join([artist.name for artist in spotify_track.artists]))
+    file_path = file_path.replace("{album}",spotify_track.album.name if spotify_track.album else "")
+    file_path = file_path.replace("{track-id}",spotify_track.id)
+    app.logger.debug(f"File path: {file_path}")
+    return file_path
+
+def _spotdl_output_for_track(stdout: str, track: Track) -> str:
+    """
+    Picks the lines of a batch spotDL run which belong to the given track, falls back to the whole output.
+    """
+    lines = [line for line in (stdout or '').splitlines() if track.provider_track_id in line or track.name in line]
+    return '\n'.join(lines) if lines else (stdout or '')
     
 @celery.task(bind=True)
 def check_for_playlist_updates(self):
@@ -316,75 +380,41 @@ def check_for_playlist_updates(self):
 
                 app.logger.info(f"Found {total_playlists} playlists to check for updates.")
                 processed_playlists = 0
+                totals = {'inserted': 0, 'removed': 0, 'reordered': 0}
+                unchanged_playlists = 0
 
                 for playlist in playlists:
                     playlist.last_updated = datetime.now( timezone.utc)
-                    # get the correct MusicProvider from the registry 
-                    provider = MusicProviderRegistry.get_provider(playlist.provider_id)
-                    provider_playlist = provider.get_playlist(playlist.provider_playlist_id)
-                    provider_tracks = provider_playlist.tracks
-                    full_update = True
                     app.logger.info(f'Checking updates for playlist: {playlist.name}')
                     db.session.commit()
                     
                     try:
+                        # get the correct MusicProvider from the registry 
+                        provider = MusicProviderRegistry.get_provider(playlist.provider_id)
+                        # ask the provider for a cheap revision id first, only fetch the whole playlist if it changed
+                        provider_playlist = None
+                        snapshot_id = provider.get_playlist_snapshot_id(playlist.provider_playlist_id)
+                        if not snapshot_id or snapshot_id != playlist.snapshot_id:
+                            provider_playlist = provider.get_playlist(playlist.provider_playlist_id)
+                            snapshot_id = base.playlist_fingerprint(provider_playlist)
+
                         #region Check for updates
-                        if full_update:
-                            existing_tracks = {track.provider_track_id: track for track in playlist.tracks}
-
-                            # Determine tracks to add and remove
-                            tracks_to_add = []
-                            for idx, track_info in enumerate(provider_tracks):
-                                if track_info:
-                                    track_id = track_info.track.id
-                                    if track_id not in existing_tracks:
-                                        track = Track.query.filter_by(provider_track_id=track_id,provider_id = playlist.provider_id).first()
-                                        if not track:
-                                            track = Track(name=track_info.track.name, provider_track_id=track_id, provider_uri=track_info.track.uri, downloaded=False,provider_id = playlist.provider_id)
-                                            db.session.add(track)
-                                            db.session.commit()
-                                            app.logger.info(f'Added new track: {track.name}')
-                                        tracks_to_add.append((track, idx))
-                                    # else check if the track is already in the playlist and change the track_order in the playlist_tracks table
-                                    else:
-                                        app.logger.debug(f"track {track_info.track.name} moved to position {idx}")
-                                        track = existing_tracks[track_id]
-                                        stmt = playlist_tracks.update().where(playlist_tracks.c.playlist_id == playlist.id).where(playlist_tracks.c.track_id == track.id).values(track_order=idx)
-                                        db.session.execute(stmt)
-                                        db.session.commit()
-
-                            tracks_to_remove = [
-                                existing_tracks[track_id] 
-                                for track_id in existing_tracks 
-                                if track_id not in {track.track.id for track in provider_tracks if track}
-                            ]
-
-                            if tracks_to_add or tracks_to_remove:
+                        if snapshot_id == playlist.snapshot_id:
+                            app.logger.info(f"Playlist {playlist.name} unchanged (snapshot {snapshot_id}), skipping diff")
+                            unchanged_playlists += 1
+                        else:
+                            changes = functions.sync_playlist_tracks(playlist, provider_playlist.tracks)
+                            for key in totals:
+                                totals[key] += changes[key]
+                            if changes['inserted'] or changes['removed']:
                                 playlist.last_changed = datetime.now( timezone.utc)
-
-                            # Add and remove tracks while maintaining order
-                            
-                            if tracks_to_add:
-                                
-                                for track, track_order in tracks_to_add:
-                                    stmt = insert(playlist_tracks).values(
-                                        playlist_id=playlist.id,
-                                        track_id=track.id,
-                                        track_order=track_order
-                                    )
-                                    db.session.execute(stmt)
-                                db.session.commit()
-                                app.logger.info(f'Added {len(tracks_to_add)} tracks to playlist: {playlist.name}')
-
-                            if tracks_to_remove:
-                                for track in tracks_to_remove:
-                                    playlist.tracks.remove(track)
-                                db.session.commit()
-                                app.logger.info(f'Removed {len(tracks_to_remove)} tracks from playlist: {playlist.name}')
-                            #endregion
+                                functions.refresh_playlist_counters([playlist.id])
+                            playlist.snapshot_id = snapshot_id
+                            db.session.commit()
+                            app.logger.info(f"Playlist {playlist.name}: {changes['inserted']} added ({changes['created']} new tracks), {changes['removed']} removed, {changes['reordered']} reordered")
+                        #endregion
                         
                         #region Update Playlist Items and Metadata
-                        functions.update_playlist_metadata(playlist, provider_playlist)
                         ordered_tracks = db.session.execute(
                             db.select(Track, playlist_tracks.c.track_order)
                             .join(playlist_tracks, playlist_tracks.c.track_id == Track.id)
@@ -393,10 +423,23 @@ def check_for_playlist_updates(self):
                         ).all()
 
                         tracks = [track.jellyfin_id for track, idx in ordered_tracks if track.jellyfin_id is not None]
-                        #jellyfin.remove_songs_from_playlist(session_token=jellyfin_admin_token, playlist_id=playlist.jellyfin_id, song_ids=tracks)
-                        jellyfin.add_songs_to_playlist(session_token=jellyfin_admin_token, user_id=jellyfin_admin_id, playlist_id=playlist.jellyfin_id, song_ids=tracks)
+                        # tracks may have been linked or become available without the provider playlist changing,
+                        # so the Jellyfin side is only skipped if nothing we would push has changed since the last run
+                        push_key = f"jellyfin_playlist_push_{playlist.id}"
+                        push_fingerprint = hashlib.sha1(f"{','.join(tracks)}|{playlist.tracks_available}|{playlist.track_count}".encode('utf-8')).hexdigest()
+                        if redis_client.get(push_key) == push_fingerprint:
+                            app.logger.debug(f"Nothing to push to Jellyfin for playlist {playlist.name}")
+                        else:
+                            if not provider_playlist:
+                                provider_playlist = functions.get_cached_provider_playlist(playlist.provider_playlist_id, playlist.provider_id)
+                            functions.update_playlist_metadata(playlist, provider_playlist)
+                            # only the difference to the current Jellyfin playlist is applied
+                            synced = jellyfin.sync_playlist_items(session_token=jellyfin_admin.token, user_id=jellyfin_admin.user_id, playlist_id=playlist.jellyfin_id, item_ids=tracks)
+                            app.logger.info(f"Jellyfin playlist {playlist.name}: {synced['added']} added, {synced['removed']} removed, {synced['moved']} moved")
+                            redis_client.set(push_key, push_fingerprint, ex=60*60*24*7)
                         #endregion
                     except Exception as e:
+                        db.session.rollback()
                         app.logger.error(f"Error updating playlist {playlist.name}: {str(e)}")
 
                     processed_playlists += 1
@@ -408,7 +451,7 @@ def check_for_playlist_updates(self):
                     if processed_playlists % 10 == 0 or processed_playlists == total_playlists:
                         app.logger.info(f"Processed {processed_playlists}/{total_playlists} playlists.")
 
-                return {'status': 'Playlist update check completed', 'total': total_playlists, 'processed': processed_playlists}
+                return {'status': 'Playlist update check completed', 'total': total_playlists, 'processed': processed_playlists, 'unchanged': unchanged_playlists, **totals}
         except Exception as e:
             app.logger.error(f"Error downloading tracks: {str(e)}", exc_info=True)
             return {'status': 'Error downloading tracks'}
@@ -432,7 +475,11 @@ def update_jellyfin_id_for_downloaded_tracks(self):
                     Track.downloaded == True,
                     Track.jellyfin_id == None,
                     (Track.quality_score < app.config['QUALITY_SCORE_THRESHOLD']) | (Track.quality_score == None)
-                ).all()
+                )
+                if functions.jellyfin_index_ready():
+                    # tracks which were looked up once are linked by update_jellyfin_library_index as soon as a matching item appears
+                    downloaded_tracks = downloaded_tracks.filter(Track.match_checked_at == None)
+                downloaded_tracks = downloaded_tracks.all()
                 if task_manager.acquire_lock(full_update_key, expiration=60*60*24):
                     app.logger.info(f"performing full update on jellyfin track ids. (Update tracks and playlists if better quality will be found)")
                     app.logger.info(f"\tQUALITY_SCORE_THRESHOLD = {app.config['QUALITY_SCORE_THRESHOLD']}")
@@ -452,21 +499,28 @@ def update_jellyfin_id_for_downloaded_tracks(self):
                 for track in downloaded_tracks:
                     try:
                         best_match = find_best_match_from_jellyfin(track)
+                        if track.match_title is not None:
+                            track.match_checked_at = datetime.now(timezone.utc).replace(tzinfo=None)
                         
                         if best_match:
                             track.downloaded = True
                             if track.jellyfin_id != best_match['Id']:
                                 track.jellyfin_id = best_match['Id']
+                                track.audio_profiled_at = None
                                 app.logger.info(f"Updated Jellyfin ID for track: {track.name} ({track.provider_track_id})")
                             if track.filesystem_path != best_match['Path']:
                                 track.filesystem_path = best_match['Path']
+                                track.audio_profiled_at = None
                                 app.logger.info(f"Updated filesystem_path for track: {track.name} ({track.provider_track_id})")
                                 
                             track.quality_score = best_match['quality_score']    
+                            # the profile was computed for the quality score anyway, the background task doesn't have to analyze the file again
+                            if best_match.get('audio_profile'):
+                                functions.apply_audio_profile(track, best_match['audio_profile'])
                             
                             db.session.commit()
                         else:
-                            
+                            db.session.commit()
                             app.logger.warning(f"No matching track found in Jellyfin for {track.name}.")
                         
                         spotify_track = None
@@ -479,6 +533,8 @@ def update_jellyfin_id_for_downloaded_tracks(self):
                     
                     self.update_state(state=f'{processed_tracks}/{total_tracks}: {track.name}', meta={'current': processed_tracks, 'total': total_tracks, 'percent': progress})
 
+                functions.refresh_playlist_counters()
+                db.session.commit()
                 app.logger.info("Finished updating Jellyfin IDs for all tracks.")
                 return {'status': 'All tracks updated', 'total': total_tracks, 'processed': processed_tracks}
         except Exception as e:
@@ -490,6 +546,188 @@ def update_jellyfin_id_for_downloaded_tracks(self):
         app.logger.info("Skipping task. Another instance is already running.")
         return {'status': 'Task skipped, another instance is running'}
 
+@celery.task(bind=True)
+def update_audio_profiles(self, track_ids: Optional[List[int]] = None):
+    """
+    Computes the audio profiles of downloaded tracks which have none yet and stores them on the tracks,
+    so that pages never have to analyze files while rendering. The file of the linked Jellyfin item is
+    analyzed, or the downloaded file if the track is not linked yet.
+    :param track_ids: Only analyze these tracks, used to compute profiles on demand. No lock is taken then.
+    """
+    lock_key = "update_audio_profiles_lock"
+    if track_ids is not None or task_manager.acquire_lock(lock_key, expiration=1800):
+        try:
+            with app.app_context():
+                query = Track.query.filter(Track.downloaded == True, Track.audio_profiled_at == None)
+                if track_ids is not None:
+                    query = query.filter(Track.id.in_(track_ids))
+                tracks : List[Track] = query.order_by(Track.id).limit(app.config['AUDIO_PROFILE_MAX_PER_RUN']).all()
+                total_tracks = len(tracks)
+                if not tracks:
+                    app.logger.debug("No tracks without audio profile found.")
+                    return {'status': 'No tracks to analyze'}
+
+                app.logger.info(f"Computing audio profiles of {total_tracks} tracks")
+                jellyfin_paths = functions.get_jellyfin_paths([track.jellyfin_id for track in tracks if track.jellyfin_id])
+                track_paths = {track.id: jellyfin_paths.get(track.jellyfin_id) or track.filesystem_path for track in tracks}
+                self.update_state(state=f'Analyzing {total_tracks} files', meta={'current': 1, 'total': 2, 'percent': 50})
+
+                profiles = functions.get_audio_profiles(list(track_paths.values()))
+                db.session.execute(update(Track), [
+                    {'id': track_id, **functions.audio_profile_columns(profiles.get(path))} for track_id, path in track_paths.items()
+                ])
+                db.session.commit()
+                failed_tracks = sum(1 for path in track_paths.values() if not profiles.get(path))
+                self.update_state(state='PROGRESS', meta={'current': 2, 'total': 2, 'percent': 100})
+
+                app.logger.info(f"Audio profiles computed: {total_tracks - failed_tracks} analyzed, {failed_tracks} failed")
+                return {'status': 'Audio profiles updated', 'total': total_tracks, 'failed': failed_tracks}
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f"Error updating audio profiles: {str(e)}", exc_info=True)
+            return {'status': 'Error updating audio profiles'}
+        finally:
+            if track_ids is None:
+                task_manager.release_lock(lock_key)
+    else:
+        app.logger.info("Skipping task. Another instance is already running.")
+        return {'status': 'Task skipped, another instance is running'}
+
+@celery.task
+def analyze_audio_files(paths: List[str]):
+    """
+    Analyzes files which are not linked to a track, e.g. Jellyfin search results, into the audio profile cache.
+    """
+    with app.app_context():
+        functions.get_audio_profiles(paths)
+
+@celery.task(bind=True)
+def update_jellyfin_library_index(self):
+    lock_key = "update_jellyfin_library_index_lock"
+    full_update_key = "full_update_jellyfin_library_index_lock"
+    page_size = 500
+    if task_manager.acquire_lock(lock_key, expiration=1800):
+        try:
+            with app.app_context():
+                started = datetime.now(timezone.utc)
+                watermark = redis_client.get(functions.JELLYFIN_INDEX_WATERMARK_KEY)
+                # once a day the whole library is indexed again, so that removed items are dropped from the index
+                full_update = task_manager.acquire_lock(full_update_key, expiration=60*60*24) or not watermark
+                if full_update:
+                    app.logger.info("Performing full update of the Jellyfin library index")
+                    watermark = None
+                else:
+                    app.logger.info(f"Updating Jellyfin library index with items saved since {watermark}")
+
+                start_index = 0
+                total_items = 0
+                linked_tracks = 0
+                while True:
+                    data = jellyfin.get_audio_items(jellyfin_admin.token, start_index=start_index, limit=page_size, min_date_last_saved=watermark)
+                    items = data.get('Items', [])
+                    total_items = data.get('TotalRecordCount', 0)
+                    functions.upsert_jellyfin_items(items, indexed_at=started.replace(tzinfo=None))
+                    # new items are matched against the tracks waiting for them, instead of searching for every waiting track
+                    linked_tracks += link_jellyfin_items_to_tracks(items)
+                    start_index += len(items)
+                    self.update_state(state=f'{start_index}/{total_items}', meta={'current': start_index, 'total': total_items, 'percent': (start_index / total_items) * 100 if total_items else 100})
+                    if not items or start_index >= total_items:
+                        break
+
+                removed_items = 0
+                if full_update:
+                    removed_items = JellyfinItem.query.filter(JellyfinItem.indexed_at < started.replace(tzinfo=None)).delete()
+                    db.session.commit()
+                # items saved while this run was paging are picked up by the next run
+                redis_client.set(functions.JELLYFIN_INDEX_WATERMARK_KEY, (started - timedelta(minutes=1)).strftime('%Y-%m-%dT%H:%M:%SZ'))
+
+                if linked_tracks:
+                    functions.refresh_playlist_counters()
+                    db.session.commit()
+                app.logger.info(f"Jellyfin library index updated: {start_index} items indexed, {removed_items} removed, {linked_tracks} tracks linked")
+                return {'status': 'Jellyfin library index updated', 'total': total_items, 'processed': start_index, 'removed': removed_items, 'linked': linked_tracks}
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f"Error updating Jellyfin library index: {str(e)}", exc_info=True)
+            return {'status': 'Error updating Jellyfin library index'}
+        finally:
+            task_manager.release_lock(lock_key)
+    else:
+        app.logger.info("Skipping task. Another instance is already running.")
+        return {'status': 'Task skipped, another instance is running'}
+
+@celery.task(bind=True)
+def update_fingerprint_store(self):
+    """
+    Computes the chromaprint fingerprints of library files which have none yet, or whose file changed since.
+    The fingerprints are computed in a process pool, at most FINGERPRINT_MAX_PER_RUN per run.
+    """
+    lock_key = "update_fingerprint_store_lock"
+    if task_manager.acquire_lock(lock_key, expiration=60*60*2):
+        try:
+            with app.app_context():
+                items = db.session.execute(db.select(JellyfinItem.id, JellyfinItem.path).where(JellyfinItem.path.isnot(None))).all()
+                stored = dict(db.session.execute(db.select(JellyfinFingerprint.item_id, JellyfinFingerprint.file_mtime)).all())
+
+                # drop the fingerprints of items which left the library
+                removed = set(stored) - {item.id for item in items}
+                if removed:
+                    JellyfinFingerprint.query.filter(JellyfinFingerprint.item_id.in_(removed)).delete()
+                    db.session.commit()
+
+                def get_mtime(path):
+                    try:
+                        return os.path.getmtime(path)
+                    except OSError:
+                        return None
+                with ThreadPoolExecutor(max_workers=app.config['FS_STAT_WORKERS']) as executor:
+                    mtimes = list(executor.map(get_mtime, [item.path for item in items]))
+                pending = [
+                    (item.id, item.path, mtime) for item, mtime in zip(items, mtimes)
+                    if mtime is not None and stored.get(item.id) != mtime
+                ][:app.config['FINGERPRINT_MAX_PER_RUN']]
+                total_items = len(pending)
+                if not pending:
+                    app.logger.info("All fingerprints are up to date.")
+                    return {'status': 'All fingerprints up to date', 'removed': len(removed)}
+
+                app.logger.info(f"Computing fingerprints of {total_items} files, {len(removed)} removed")
+                from jellyfin.fingerprint import fingerprint_file, to_bytes
+                processed_items = 0
+                failed_items = 0
+                batch = []
+                with functions.process_pool(app.config['FINGERPRINT_WORKERS']) as executor:
+                    futures = {executor.submit(fingerprint_file, path): (item_id, mtime) for item_id, path, mtime in pending}
+                    for future in as_completed(futures):
+                        item_id, mtime = futures[future]
+                        processed_items += 1
+                        try:
+                            fingerprint = future.result()
+                        except Exception as e:
+                            app.logger.debug(f"Fingerprinting item {item_id} failed: {str(e)}")
+                            fingerprint = None
+                        if fingerprint is None:
+                            failed_items += 1
+                        else:
+                            batch.append({'item_id': item_id, 'file_mtime': mtime, 'fingerprint': to_bytes(fingerprint), 'computed_at': datetime.now(timezone.utc).replace(tzinfo=None)})
+                        if len(batch) >= 50 or processed_items == total_items:
+                            functions.upsert_fingerprints(batch)
+                            batch = []
+                            self.update_state(state=f'{processed_items}/{total_items}', meta={'current': processed_items, 'total': total_items, 'percent': (processed_items / total_items) * 100})
+
+                app.logger.info(f"Fingerprint store updated: {processed_items - failed_items} fingerprints computed, {failed_items} failed")
+                return {'status': 'Fingerprint store updated', 'total': total_items, 'processed': processed_items, 'failed': failed_items, 'removed': len(removed)}
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f"Error updating fingerprint store: {str(e)}", exc_info=True)
+            return {'status': 'Error updating fingerprint store'}
+        finally:
+            task_manager.release_lock(lock_key)
+    else:
+        app.logger.info("Skipping task. Another instance is already running.")
+        return {'status': 'Task skipped, another instance is running'}
+
+
 @celery.task(bind=True)
 def request_lidarr(self):
     lock_key = "request_lidarr_lock"
@@ -504,8 +742,9 @@ def request_lidarr(self):
                     tracks = Track.query.filter_by(lidarr_processed=False).all()
                     total_items = len(tracks)
                     processed_items = 0
+                    provider_tracks = functions.get_cached_provider_tracks_of(tracks)
                     for track in tracks:
-                        tfp = functions.get_cached_provider_track(track.provider_track_id, provider_id=track.provider_id)
+                        tfp = provider_tracks[track.id]
                         if tfp:                            
                             if app.config['LIDARR_MONITOR_ARTISTS']:
                                 app.logger.debug("Monitoring artists instead of albums")
@@ -581,67 +820,113 @@ def request_lidarr(self):
         app.logger.info("Skipping task. Another instance is already running.")
         return {'status': 'Task skipped, another instance is running'}
 
-def find_best_match_from_jellyfin(track: Track):
+def find_best_match_from_jellyfin(track: Track, allow_search_fallback: bool = False):
     app.logger.debug(f"Trying to find best match from Jellyfin server for track: {track.name}")
-    search_results = jellyfin.search_music_tracks(jellyfin_admin_token, functions.get_longest_substring(track.name))
-    provider_track = None
+    # the match keys are stored when the track is created, older tracks get them on first use
+    if not functions.ensure_match_keys(track):
+        app.logger.error(f"\tError fetching track details from {track.provider_id} for {track.name}")
+        return None
+
+    # use the local library index if it was built, searching the server is only done as fallback when explicitly requested 
+    if functions.jellyfin_index_ready():
+        search_results = functions.lookup_jellyfin_index(track.match_title)
+        if not search_results:
+            # no exact title, e.g. a typo or "&" instead of "and", the fuzzy matcher scores the most similar titles
+            search_results = functions.lookup_jellyfin_index_fuzzy(track.match_title)
+        if not search_results and allow_search_fallback:
+            app.logger.debug(f"Track {track.name} not found in library index, searching Jellyfin")
+            search_results = jellyfin.search_music_tracks(jellyfin_admin.token, functions.get_longest_substring(track.name))
+    else:
+        search_results = jellyfin.search_music_tracks(jellyfin_admin.token, functions.get_longest_substring(track.name))
     try:
+        search_results = search_results or []
+        match_scores, accepted = functions.score_jellyfin_candidates(track, search_results)
+        candidates = []
+        for result, match_score, is_match in zip(search_results, match_scores, accepted):
+            app.logger.debug(f"Processing search result: {result['Id']}, Path = {result.get('Path')}, match score = {match_score:.2f}")
+            if is_match:
+                candidates.append((result, match_score))
+        # the file quality only decides between equally good matches, a better file of another version never wins
+        candidates = matching.best_matches(candidates)
+        if not candidates:
+            return None
+
+        profiles = None
+        if app.config['FIND_BEST_MATCH_USE_FFPROBE']:
+            # analyze all matching candidates at once, cached files are not probed again
+            profiles = functions.get_audio_profiles([result.get('Path') for result, _ in candidates])
         best_match = None
         best_quality_score = -1  # Initialize with the lowest possible score
-        for result in search_results:
-            app.logger.debug(f"Processing search result: {result['Id']}, Path = {result['Path']}")
-            quality_score = compute_quality_score(result, app.config['FIND_BEST_MATCH_USE_FFPROBE'])
-            try:
-                provider_track = functions.get_cached_provider_track(track.provider_track_id, provider_id=track.provider_id)
-                provider_track_name = provider_track.name.lower()
-                provider_artists = [artist.name.lower() for artist in provider_track.artists]
-            except Exception as e:
-                app.logger.error(f"\tError fetching track details from Spotify for {track.name}: {str(e)}")
-                continue
-            jellyfin_track_name = result.get('Name', '').lower()
-            if len(result.get('Artists', [])) == 1:
-                jellyfin_artists = [a.lower() for a in result.get('Artists', [])[0].split('/')]
-            else:
-                jellyfin_artists = [artist.lower() for artist in result.get('Artists', [])]
-            jellyfin_album_artists = [artist['Name'].lower() for artist in result.get('AlbumArtists', [])]
-            
-            if provider_track and jellyfin_track_name and jellyfin_artists and provider_artists:
-                app.logger.debug("\tTrack details to compare: ")
-                app.logger.debug(f"\t\tJellyfin-Trackname : {jellyfin_track_name}")
-                app.logger.debug(f"\t\t Spotify-Trackname : {provider_track_name}")
-                app.logger.debug(f"\t\t  Jellyfin-Artists : {jellyfin_artists}")
-                app.logger.debug(f"\t\t   Spotify-Artists : {provider_artists}")
-                app.logger.debug(f"\t\t  Jellyfin-Alb.Art.: {jellyfin_album_artists}")
-                if len(search_results) == 1:
-                    app.logger.debug(f"\tOnly 1 search_result: {result['Id']} ({app.config['JELLYFIN_SERVER_URL']}/web/#/details?id={result['Id']})")
-                    
-                    if (provider_track_name.lower() == jellyfin_track_name and
-                        (set(artist.lower() for artist in provider_artists) == set(jellyfin_artists) or set(jellyfin_album_artists) == set(artist.lower() for artist in provider_artists))):
-                        
-                        app.logger.debug(f"\tQuality score for track {result['Name']}: {quality_score} [{result['Path']}]")
-                        best_match = result
-                        best_quality_score = quality_score
-                        break
-                
-                
-                if (provider_track_name.lower() == jellyfin_track_name and
-                    (set(artist.lower() for artist in provider_artists) == set(jellyfin_artists) or set(jellyfin_album_artists) == set(artist.lower() for artist in provider_artists))):
-                    app.logger.debug(f"\tQuality score for track {result['Name']}: {quality_score} [{result['Path']}]")
-                    
-                    if quality_score > best_quality_score:
-                        best_match = result
-                        best_quality_score = quality_score
+        for result, _ in candidates:
+            quality_score = compute_quality_score(result, app.config['FIND_BEST_MATCH_USE_FFPROBE'], profiles)
+            app.logger.debug(f"\tQuality score for track {result['Name']}: {quality_score} [{result.get('Path')}]")
+            if quality_score > best_quality_score:
+                best_match = result
+                best_quality_score = quality_score
         # attach the quality_score to the best_match
-        if best_match:
-            best_match['quality_score'] = best_quality_score
+        best_match['quality_score'] = best_quality_score
+        if profiles is not None:
+            best_match['audio_profile'] = profiles.get(best_match.get('Path'))
         return best_match
     except Exception as e:
         app.logger.error(f"Error searching Jellyfin for track {track.name}: {str(e)}")
         return None
 
-def compute_quality_score(result, use_ffprobe=False) -> float:
+def link_jellyfin_items_to_tracks(items: List[dict]) -> int:
+    """
+    Reverse matching: links the tracks which are not linked yet to matching items among the given Jellyfin items,
+    e.g. the items added to the library since the last run. The tracks are looked up by their folded title with
+    one indexed query, so the work depends on the number of items and not on the number of waiting tracks.
+    Artists, duration and album are then compared by the fuzzy matcher. The caller refreshes the playlist counters.
+    :param items: Items from the Jellyfin /Items endpoint.
+    :return: The number of linked tracks.
+    """
+    items_by_title = defaultdict(list)
+    for item in items:
+        title = matching.jellyfin_item_match_keys(item)['title']
+        if title:
+            items_by_title[title].append(item)
+    if not items_by_title:
+        return 0
+    tracks : List[Track] = Track.query.filter(Track.jellyfin_id == None, Track.match_title.in_(list(items_by_title))).all()
+    matches = {}
+    for track in tracks:
+        title_items = items_by_title[track.match_title]
+        if track.match_artist_names is not None:
+            match_scores, accepted = functions.score_jellyfin_candidates(track, title_items)
+            candidates = [(item, match_score) for item, match_score, is_match in zip(title_items, match_scores, accepted) if is_match]
+        else:
+            # tracks from before the fuzzy matcher get its keys on their next playlist update, until then the exact keys are compared
+            candidates = [(item, 0) for item in title_items if matching.keys_match(track.match_keys, matching.jellyfin_item_match_keys(item))]
+        candidates = matching.best_matches(candidates)
+        if candidates:
+            matches[track] = candidates
+    if not matches:
+        return 0
+
+    profiles = None
+    if app.config['FIND_BEST_MATCH_USE_FFPROBE']:
+        profiles = functions.get_audio_profiles([item.get('Path') for candidates in matches.values() for item, _ in candidates])
+    for track, candidates in matches.items():
+        quality_score, best_match = max(
+            ((compute_quality_score(item, app.config['FIND_BEST_MATCH_USE_FFPROBE'], profiles), item) for item, _ in candidates),
+            key=lambda scored: scored[0]
+        )
+        app.logger.info(f"Linking track {track.name} ({track.provider_track_id}) to new Jellyfin item {best_match['Id']}")
+        track.jellyfin_id = best_match['Id']
+        track.downloaded = True
+        track.filesystem_path = best_match.get('Path')
+        track.quality_score = quality_score
+        track.audio_profiled_at = None
+        if profiles is not None and profiles.get(best_match.get('Path')):
+            functions.apply_audio_profile(track, profiles[best_match.get('Path')])
+    db.session.commit()
+    return len(matches)
+
+def compute_quality_score(result, use_ffprobe=False, profiles=None) -> float:
     """
     Compute a quality score for a track based on its metadata or detailed analysis using ffprobe.
+    :param profiles: Audio profiles by path as returned by functions.get_audio_profiles, looked up when not given.
     """
     score = 0
     container = result.get('Container', '').lower()
@@ -663,9 +948,10 @@ def compute_quality_score(result, use_ffprobe=False) -> float:
     if use_ffprobe:
         path = result.get('Path')
         if path:
-            profile = AudioProfile.analyze_audio_quality_with_ffprobe(path)
-            ffprobe_score = profile.compute_quality_score()
-            score += ffprobe_score
+            profile = profiles.get(path) if profiles is not None else functions.get_audio_profile(path)
+            if profile:
+                ffprobe_score = profile.compute_quality_score()
+                score += ffprobe_score
         else:
             app.logger.warning(f"No valid file path for track {result.get('Name')} - Skipping ffprobe analysis.")
     
@@ -679,10 +965,14 @@ class TaskManager:
             'update_all_playlists_track_status': None,
             'download_missing_tracks': None,
             'check_for_playlist_updates': None,
-            'update_jellyfin_id_for_downloaded_tracks': None
+            'update_jellyfin_id_for_downloaded_tracks': None,
+            'update_jellyfin_library_index': None,
+            'update_audio_profiles': None
         }
         if app.config['LIDARR_API_KEY']:
             self.tasks['request_lidarr'] = None
+        if app.config['ENABLE_FINGERPRINT_STORE']:
+            self.tasks['update_fingerprint_store'] = None
 
     def start_task(self, task_name, *args, **kwargs):
         if task_name not in self.tasks:
@@ -695,21 +985,85 @@ class TaskManager:
         if task_name not in self.tasks:
             raise ValueError(f"Task {task_name} is not defined.")
         task_id = self.tasks[task_name]
+        lock_status = True if self.get_lock(f"{task_name}_lock") else False
+        # tasks which fan out into subtasks aggregate their progress in redis
+        progress = self.get_progress(task_name)
+        if progress and lock_status:
+            return {'state': f"[{progress['current']}/{progress['total']}] {progress['failed']} failed", 'info': progress, 'lock_status': lock_status}
         if not task_id:
-            return {'state': 'NOT STARTED', 'info': {}, 'lock_status': False}
+            return {'state': 'NOT STARTED', 'info': {}, 'lock_status': lock_status}
         result = AsyncResult(task_id)
-        lock_status = True if self.get_lock(f"{task_name}_lock") else False
         return {'state': result.state, 'info': result.info if result.info else {}, 'lock_status': lock_status}
 
-    def acquire_lock(self, lock_name, expiration=60):
-        return redis_client.set(lock_name, "locked", ex=expiration, nx=True)
+    # lua scripts, so that checking the owner and changing the lock happen atomically
+    _RELEASE_IF_OWNER = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+    _REFRESH_IF_OWNER = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('expire', KEYS[1], ARGV[2]) end return 0"
+    _EXTEND = "local ttl = redis.call('ttl', KEYS[1]) if ttl == -2 then return 0 end if ttl >= 0 and ttl < tonumber(ARGV[1]) then redis.call('expire', KEYS[1], ARGV[1]) end return 1"
+
+    def acquire_lock(self, lock_name, expiration=60, owner="locked"):
+        return redis_client.set(lock_name, owner, ex=expiration, nx=True)
+
+    def release_lock(self, lock_name, owner=None):
+        """
+        Releases a lock. If owner is given, the lock is only released if it is still held by owner, it may have
+        expired and been acquired by someone else in the meantime.
+        """
+        if owner is None:
+            redis_client.delete(lock_name)
+        else:
+            redis_client.eval(self._RELEASE_IF_OWNER, 1, lock_name, owner)
+
+    def refresh_lock(self, lock_name, owner, expiration):
+        """
+        Sets the expiration of a lock held by owner. Returns False if the lock is not held by owner anymore.
+        """
+        return bool(redis_client.eval(self._REFRESH_IF_OWNER, 1, lock_name, owner, expiration))
 
-    def release_lock(self, lock_name):
-        redis_client.delete(lock_name)
+    def extend_lock(self, lock_name, expiration):
+        """
+        Makes sure a lock lives at least another `expiration` seconds, a longer expiration is kept.
+        Returns False if the lock does not exist.
+        """
+        return bool(redis_client.eval(self._EXTEND, 1, lock_name, expiration))
 
     def get_lock(self, lock_name):
         return redis_client.get(lock_name)
 
+    def acquire_slot(self, name, slots, expiration=60, owner="locked"):
+        """
+        Acquires one of `slots` locks named after `name`, used to limit how many subtasks run concurrently.
+        Returns the key of the acquired slot, or None if all slots are taken.
+        """
+        for i in range(max(1, slots)):
+            slot_key = f"{name}_slot_{i}_lock"
+            if self.acquire_lock(slot_key, expiration=expiration, owner=owner):
+                return slot_key
+        return None
+
+    def init_progress(self, task_name, total):
+        key = f"{task_name}_progress"
+        redis_client.delete(key)
+        redis_client.hset(key, mapping={'total': total, 'current': 0, 'failed': 0})
+        redis_client.expire(key, 60*60*24)
+
+    def update_progress(self, task_name, processed=0, failed=0):
+        key = f"{task_name}_progress"
+        redis_client.hincrby(key, 'current', processed)
+        redis_client.hincrby(key, 'failed', failed)
+
+    def get_progress(self, task_name):
+        data = redis_client.hgetall(f"{task_name}_progress")
+        if not data:
+            return None
+        total = int(data.get('total', 0))
+        current = int(data.get('current', 0))
+        return {
+            'current': current,
+            'total': total,
+            'failed': int(data.get('failed', 0)),
+            'percent': (current / total) * 100 if total else 0
+        }
+
     def prepare_logger(self):
         FORMAT = "[%(asctime)s][%(filename)18s:%(lineno)4s - %(funcName)20s() ]  %(message)s"
         logging.basicConfig(format=FORMAT)
@@ -10,9 +10,15 @@ class Config:
     JELLYFIN_ADMIN_USER = os.getenv('JELLYFIN_ADMIN_USER')
     JELLYFIN_ADMIN_PASSWORD = os.getenv('JELLYFIN_ADMIN_PASSWORD')
     JELLYFIN_REQUEST_TIMEOUT = int(os.getenv('JELLYFIN_REQUEST_TIMEOUT','10'))
+    JELLYFIN_WEBHOOK_TOKEN = os.getenv('JELLYFIN_WEBHOOK_TOKEN') # enables /jellyfin/webhook, which updates the library index when items are added
+    HTTP_POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE','20')) # keep-alive connections per host
+    HTTP_MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES','3')) # retries for idempotent requests on connection errors, 429 and 5xx
+    HTTP_BACKOFF_FACTOR = float(os.getenv('HTTP_BACKOFF_FACTOR','0.5'))
+    HTTP_REQUEST_TIMEOUT = float(os.getenv('HTTP_REQUEST_TIMEOUT','30')) # default timeout for requests which don't set their own
     SPOTIFY_CLIENT_ID = os.getenv('SPOTIFY_CLIENT_ID')
     SPOTIFY_CLIENT_SECRET = os.getenv('SPOTIFY_CLIENT_SECRET')
     SPOTIFY_COOKIE_FILE = os.getenv('SPOTIFY_COOKIE_FILE')
+    SPOTIFY_PLAYLIST_FETCH_WORKERS = int(os.getenv('SPOTIFY_PLAYLIST_FETCH_WORKERS','8'))
     JELLYPLIST_DB_HOST = os.getenv('JELLYPLIST_DB_HOST')
     JELLYPLIST_DB_PORT = int(os.getenv('JELLYPLIST_DB_PORT','5432'))
     JELLYPLIST_DB_USER = os.getenv('JELLYPLIST_DB_USER')
@@ -28,6 +34,12 @@ class Config:
     REDIS_URL = os.getenv('REDIS_URL','redis://redis:6379/0')
     SEARCH_JELLYFIN_BEFORE_DOWNLOAD = os.getenv('SEARCH_JELLYFIN_BEFORE_DOWNLOAD',"true").lower() == 'true'
     FIND_BEST_MATCH_USE_FFPROBE = os.getenv('FIND_BEST_MATCH_USE_FFPROBE','false').lower() == 'true'
+    MATCH_MIN_SCORE = float(os.getenv('MATCH_MIN_SCORE','0.85')) # minimum fuzzy match score of a Jellyfin item, between 0 and 1
+    MATCH_MIN_TITLE_SIMILARITY = float(os.getenv('MATCH_MIN_TITLE_SIMILARITY','0.75'))
+    MATCH_MIN_ARTISTS_SIMILARITY = float(os.getenv('MATCH_MIN_ARTISTS_SIMILARITY','0.8'))
+    MATCH_DURATION_TOLERANCE_MS = int(os.getenv('MATCH_DURATION_TOLERANCE_MS','3000')) # duration differences considered equal
+    MATCH_MAX_DURATION_DIFF_MS = int(os.getenv('MATCH_MAX_DURATION_DIFF_MS','15000')) # items with a larger difference never match
+    MATCH_MAX_CANDIDATES = int(os.getenv('MATCH_MAX_CANDIDATES','200')) # most similar titles of the library index scored per fuzzy lookup
     SPOTIFY_COUNTRY_CODE = os.getenv('SPOTIFY_COUNTRY_CODE','DE')
     LIDARR_API_KEY = os.getenv('LIDARR_API_KEY','') 
     LIDARR_URL = os.getenv('LIDARR_URL','')
@@ -36,7 +48,21 @@ class Config:
     CHECK_FOR_UPDATES = os.getenv('CHECK_FOR_UPDATES','true').lower() == 'true'
     SPOTDL_PROXY = os.getenv('SPOTDL_PROXY',None)
     SPOTDL_OUTPUT_FORMAT = os.getenv('SPOTDL_OUTPUT_FORMAT','__jellyplist/{artist}-{title}.mp3')
+    SPOTDL_BATCH_SIZE = int(os.getenv('SPOTDL_BATCH_SIZE','10')) # tracks downloaded by one spotDL process
+    SPOTDL_CONCURRENCY = int(os.getenv('SPOTDL_CONCURRENCY','2')) # spotDL processes running at the same time
+    SPOTDL_TIMEOUT = int(os.getenv('SPOTDL_TIMEOUT','90')) # timeout per track in seconds
     QUALITY_SCORE_THRESHOLD = float(os.getenv('QUALITY_SCORE_THRESHOLD',1000.0))
+    TRACKS_PAGE_SIZE = int(os.getenv('TRACKS_PAGE_SIZE','100')) # tracks rendered per page in the playlist view
+    LAZY_STARTUP = os.getenv('LAZY_STARTUP','true').lower() == 'true' # create clients and connections on first use
+    ENABLE_FINGERPRINT_STORE = os.getenv('ENABLE_FINGERPRINT_STORE','false').lower() == 'true'
+    FINGERPRINT_WORKERS = int(os.getenv('FINGERPRINT_WORKERS', max(1, (os.cpu_count() or 2) // 2))) # processes computing fingerprints
+    FINGERPRINT_MAX_PER_RUN = int(os.getenv('FINGERPRINT_MAX_PER_RUN','500')) # files fingerprinted per run of the task
+    FS_STAT_WORKERS = int(os.getenv('FS_STAT_WORKERS','16')) # parallel file checks when updating the track status
+    AUDIO_PROFILE_WORKERS = int(os.getenv('AUDIO_PROFILE_WORKERS', max(1, (os.cpu_count() or 2) // 2))) # ffprobe processes running at the same time
+    AUDIO_PROFILE_CACHE_TTL = int(os.getenv('AUDIO_PROFILE_CACHE_TTL', 30 * 24 * 3600)) # seconds a cached ffprobe result is kept
+    AUDIO_PROFILE_MAX_PER_RUN = int(os.getenv('AUDIO_PROFILE_MAX_PER_RUN','1000')) # tracks analyzed per run of the task
+    TRACK_CACHE_TTL = int(os.getenv('TRACK_CACHE_TTL', 3600 * 24 * 10)) # seconds track metadata of the providers is cached in redis
+    TRACK_CACHE_LRU_SIZE = int(os.getenv('TRACK_CACHE_LRU_SIZE','2048')) # tracks kept in memory by every process
     
     ENABLE_DEEZER = os.getenv('ENABLE_DEEZER','false').lower() == 'true'
     # SpotDL specific configuration
@@ -0,0 +1,102 @@
+import logging
+import threading
+import time
+from typing import Optional
+
+from jellyfin.client import JellyfinClient
+
+l = logging.getLogger(__name__)
+
+
+class AdminSession:
+    """
+    The admin login shared by the web app, the celery worker and beat.
+
+    The access token is stored in redis, so all processes reuse a single Jellyfin session instead of logging in
+    on every start. The token is validated with /Users/Me on first use in a process. When the server rejects it
+    with 401, it is dropped and a new one is obtained, and the rejected request is sent again with it.
+    """
+    def __init__(self, client: JellyfinClient, redis_client, username: str, password: str,
+                 device_id: str = 'JellyPlist', key: str = 'jellyfin_admin_session'):
+        self.client = client
+        self.redis = redis_client
+        self.username = username
+        self.password = password
+        self.device_id = device_id
+        self.key = key
+        self._session: Optional[dict] = None
+        self._lock = threading.RLock()
+        client.on_unauthorized = self.invalidate
+
+    @property
+    def token(self) -> str:
+        return self._get()['token']
+
+    @property
+    def user_id(self) -> str:
+        return self._get()['user_id']
+
+    @property
+    def name(self) -> str:
+        return self._get()['name']
+
+    @property
+    def is_admin(self) -> bool:
+        return self._get()['is_admin'] == 'True'
+
+    def invalidate(self, token: str) -> Optional[str]:
+        """
+        Drops the given token, if it is the current one. Called when the server answered with 401.
+        :param token: The rejected token.
+        :return: The new admin token the rejected request is retried with, None if the token was not the admin token.
+        """
+        with self._lock:
+            was_current = bool(self._session and self._session['token'] == token)
+            if was_current:
+                l.info("Jellyfin admin token was rejected, logging in again")
+                self._session = None
+            if self.redis.hget(self.key, 'token') == token:
+                self.redis.delete(self.key)
+            if not was_current:
+                return None
+            return self._get()['token']
+
+    def _get(self) -> dict:
+        session = self._session
+        if session:
+            return session
+        with self._lock:
+            if not self._session:
+                self._session = self._load() or self._login()
+            return self._session
+
+    def _load(self) -> Optional[dict]:
+        session = self.redis.hgetall(self.key)
+        if not session:
+            return None
+        if self.client.get_me(session['token']) is None:
+            l.info("Stored Jellyfin admin token is not valid anymore")
+            self.redis.delete(self.key)
+            return None
+        l.debug("Reusing stored Jellyfin admin token")
+        return session
+
+    def _login(self) -> dict:
+        lock_key = f"{self.key}_login_lock"
+        # only one process logs in, the others wait for its token
+        acquired = self.redis.set(lock_key, "locked", ex=30, nx=True)
+        if not acquired:
+            for _ in range(20):
+                time.sleep(0.5)
+                session = self.redis.hgetall(self.key)
+                if session:
+                    return session
+        try:
+            l.info(f"Logging in to Jellyfin as {self.username}")
+            token, user_id, name, is_admin = self.client.login_with_password(self.username, self.password, device_id=self.device_id)
+            session = {'token': token, 'user_id': user_id, 'name': name, 'is_admin': str(is_admin)}
+            self.redis.hset(self.key, mapping=session)
+            return session
+        finally:
+            if acquired:
+                self.redis.delete(lock_key)
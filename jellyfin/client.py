@@ -1,14 +1,11 @@
+import bisect
 import os
 import re
-import subprocess
-import tempfile
-from typing import Optional
-import numpy as np
-import requests
+from collections import defaultdict, deque
+from typing import Callable, List, Optional, Tuple
 import base64
-import acoustid
-import chromaprint
 import logging
+import transport
 from jellyfin.objects import PlaylistMetadata
 
 def _clean_query(query):
@@ -22,6 +19,74 @@ def _clean_query(query):
     cleaned_query = " ".join(cleaned_words)
     return cleaned_query
 
+def playlist_entry_changes(current: List[Tuple[str, str]], desired: List[str]) -> Tuple[List[str], List[str]]:
+    """
+    Compares the entries of a playlist with the desired items, ignoring their order.
+    :param current: Tuples (entry id, item id) of the current playlist entries.
+    :param desired: Item ids in the desired order, an item may occur more than once.
+    :return: Tuple (entry ids to remove, item ids to add), the items to add are in the desired order.
+    """
+    wanted = defaultdict(int)
+    for item_id in desired:
+        wanted[item_id] += 1
+    remove = []
+    for entry_id, item_id in current:
+        if wanted[item_id] > 0:
+            wanted[item_id] -= 1
+        else:
+            remove.append(entry_id)
+    add = []
+    for item_id in desired:
+        if wanted[item_id] > 0:
+            wanted[item_id] -= 1
+            add.append(item_id)
+    return remove, add
+
+
+def playlist_moves(current: List[Tuple[str, str]], desired: List[str]) -> List[Tuple[str, int]]:
+    """
+    Computes the fewest moves which put the entries of a playlist into the desired order. The entries in the longest
+    subsequence which already has the desired order stay where they are, every other entry is moved right behind its
+    desired predecessor.
+    :param current: Tuples (entry id, item id) of the current playlist entries, containing exactly the desired items.
+    :param desired: Item ids in the desired order.
+    :return: List of (entry id, new index) to apply in order, the index is the position after the move.
+    """
+    positions = defaultdict(deque)
+    for index, item_id in enumerate(desired):
+        positions[item_id].append(index)
+    targets = [positions[item_id].popleft() for _, item_id in current]
+
+    # longest increasing subsequence of the desired positions, O(n log n)
+    tails, tail_indexes, previous = [], [], [-1] * len(targets)
+    for index, target in enumerate(targets):
+        length = bisect.bisect_left(tails, target)
+        if length == len(tails):
+            tails.append(target)
+            tail_indexes.append(index)
+        else:
+            tails[length] = target
+            tail_indexes[length] = index
+        previous[index] = tail_indexes[length - 1] if length else -1
+    keep = set()
+    index = tail_indexes[-1] if tail_indexes else -1
+    while index != -1:
+        keep.add(index)
+        index = previous[index]
+
+    entry_at = {target: current[index][0] for index, target in enumerate(targets)}
+    order = [entry_id for entry_id, _ in current]
+    moves = []
+    # in desired order, the predecessor of every moved entry is already at its final place
+    for target in sorted(target for index, target in enumerate(targets) if index not in keep):
+        entry_id = entry_at[target]
+        order.remove(entry_id)
+        new_index = order.index(entry_at[target - 1]) + 1 if target else 0
+        order.insert(new_index, entry_id)
+        moves.append((entry_id, new_index))
+    return moves
+
+
 class JellyfinClient:
     def __init__(self, base_url, timeout = 10):
         """
@@ -30,12 +95,38 @@ class JellyfinClient:
         """
         self.base_url = base_url
         self.timeout = timeout
+        # called with the rejected token whenever the server answers with 401, may return a new token to retry the request with
+        self.on_unauthorized: Optional[Callable[[str], Optional[str]]] = None
+        transport.add_response_hook(base_url, self._check_unauthorized)
         self.logger = logging.getLogger(self.__class__.__name__)
         self.logger.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
         FORMAT = "[%(asctime)s][%(filename)18s:%(lineno)4s - %(funcName)23s() ] %(levelname)7s - %(message)s"  
         logging.basicConfig(format=FORMAT)
         self.logger.debug(f"Initialized Jellyfin API Client. Base = '{self.base_url}', timeout = {timeout}")
 
+    @property
+    def session(self):
+        # shared keep-alive session, all calls to the server reuse its pooled connections
+        return transport.get_session(self.base_url)
+
+    def _check_unauthorized(self, response, *args, **kwargs):
+        if response.status_code == 401 and self.on_unauthorized:
+            token = response.request.headers.get('X-Emby-Token')
+            if not token:
+                return None
+            new_token = self.on_unauthorized(token)
+            if not new_token or new_token == token:
+                return None
+            # send the request once more with the new token, like the auth handlers of requests do
+            response.content
+            response.close()
+            request = response.request.copy()
+            request.headers['X-Emby-Token'] = new_token
+            retried = response.connection.send(request, **kwargs)
+            retried.history.append(response)
+            retried.request = request
+            return retried
+
     def _get_headers(self, session_token: str):
         """
         Get the authentication headers for requests.
@@ -62,7 +153,7 @@ class JellyfinClient:
             'Pw': password
         }
         self.logger.debug(f"Url={url}")
-        response = requests.post(url, json=data, headers=headers)
+        response = self.session.post(url, json=data, headers=headers)
         self.logger.debug(f"Response = {response.status_code}")
         
         if response.status_code == 200:
@@ -71,6 +162,21 @@ class JellyfinClient:
         else:
             raise Exception(f"Login failed: {response.content}")
 
+    def get_me(self, session_token: str):
+        """
+        Get the user the token belongs to, used to validate a token.
+        :param session_token: The access token to validate.
+        :return: The user, or None if the token is not valid (anymore).
+        """
+        url = f'{self.base_url}/Users/Me'
+        response = self.session.get(url, headers=self._get_headers(session_token=session_token), timeout = self.timeout)
+        if response.status_code == 200:
+            return response.json()
+        elif response.status_code == 401:
+            return None
+        else:
+            raise Exception(f"Failed to get current user: {response.content}")
+
     def create_music_playlist(self, session_token: str, name: str, song_ids, user_id : str):
         """
         Create a new music playlist.
@@ -90,7 +196,7 @@ class JellyfinClient:
         }
         self.logger.debug(f"Url={url}")
 
-        response = requests.post(url, json=data, headers=self._get_headers(session_token=session_token), timeout = self.timeout)
+        response = self.session.post(url, json=data, headers=self._get_headers(session_token=session_token), timeout = self.timeout)
         self.logger.debug(f"Response = {response.status_code}")
 
         if response.status_code == 200:
@@ -111,7 +217,7 @@ class JellyfinClient:
         }
         self.logger.debug(f"Url={url}")
 
-        response = requests.post(url, json=data, headers=self._get_headers(session_token=session_token), timeout = self.timeout)
+        response = self.session.post(url, json=data, headers=self._get_headers(session_token=session_token), timeout = self.timeout)
         self.logger.debug(f"Response = {response.status_code}")
 
         if response.status_code == 204:  # 204 No Content indicates success for updating
@@ -128,7 +234,7 @@ class JellyfinClient:
         url = f'{self.base_url}/Playlists/{playlist_id}'
         self.logger.debug(f"Url={url}")
 
-        response = requests.get(url, headers=self._get_headers(session_token=session_token), timeout = self.timeout)
+        response = self.session.get(url, headers=self._get_headers(session_token=session_token), timeout = self.timeout)
         self.logger.debug(f"Response = {response.status_code}")
 
         if response.status_code == 200:
@@ -143,7 +249,7 @@ class JellyfinClient:
         }
         self.logger.debug(f"Url={url}")
         
-        response = requests.get(url, headers=self._get_headers(session_token=session_token), timeout = self.timeout, params = params)
+        response = self.session.get(url, headers=self._get_headers(session_token=session_token), timeout = self.timeout, params = params)
         self.logger.debug(f"Response = {response.status_code}")
         
         if response.status_code != 200:
@@ -178,7 +284,7 @@ class JellyfinClient:
         url = f'{self.base_url}/Items/{playlist_id}'
         self.logger.debug(f"Url={url}")
         
-        response = requests.post(url, json=metadata_obj.to_dict(), headers=self._get_headers(session_token= session_token), timeout = self.timeout, params = params)
+        response = self.session.post(url, json=metadata_obj.to_dict(), headers=self._get_headers(session_token= session_token), timeout = self.timeout, params = params)
         self.logger.debug(f"Response = {response.status_code}")
         
         if response.status_code == 204:
@@ -201,7 +307,7 @@ class JellyfinClient:
 
         self.logger.debug(f"Url={url}")
         
-        response = requests.get(url, headers=self._get_headers(session_token=session_token), params=params , timeout = self.timeout)
+        response = self.session.get(url, headers=self._get_headers(session_token=session_token), params=params , timeout = self.timeout)
         self.logger.debug(f"Response = {response.status_code}")
         
         if response.status_code == 200:
@@ -216,7 +322,7 @@ class JellyfinClient:
         }
         self.logger.debug(f"Url={url}")
         
-        response = requests.get(url, headers=self._get_headers(session_token=session_token), params=params , timeout = self.timeout)
+        response = self.session.get(url, headers=self._get_headers(session_token=session_token), params=params , timeout = self.timeout)
         self.logger.debug(f"Response = {response.status_code}")
         if response.status_code == 200:
             return response.json()
@@ -236,7 +342,7 @@ class JellyfinClient:
         }
         self.logger.debug(f"Url={url}")
         
-        response = requests.post(url, headers=self._get_headers(session_token=session_token), params=params , timeout = self.timeout)
+        response = self.session.post(url, headers=self._get_headers(session_token=session_token), params=params , timeout = self.timeout)
         self.logger.debug(f"Response = {response.status_code}")
         if response.status_code == 204:
             return True
@@ -263,7 +369,7 @@ class JellyfinClient:
         self.logger.debug(f"Url={url}")
         
 
-        response = requests.get(url, headers=self._get_headers(session_token=session_token), params=params, timeout = self.timeout)
+        response = self.session.get(url, headers=self._get_headers(session_token=session_token), params=params, timeout = self.timeout)
         self.logger.debug(f"Response = {response.status_code}")
         
         if response.status_code == 200:
@@ -271,6 +377,38 @@ class JellyfinClient:
         else:
             raise Exception(f"Failed to search music tracks: {response.content}")
 
+    def get_audio_items(self, session_token: str, start_index: int = 0, limit: int = 500, min_date_last_saved: Optional[str] = None):
+        """
+        Page through all audio items of the library.
+        :param start_index: Index of the first item to return.
+        :param limit: Maximum number of items to return.
+        :param min_date_last_saved: Optional ISO timestamp, only items saved after it are returned.
+        :return: The response containing 'Items' and 'TotalRecordCount'.
+        """
+        url = f'{self.base_url}/Items'
+        params = {
+            'IncludeItemTypes': 'Audio',
+            'Recursive': 'true',
+            'Fields': 'Path,Artists,AlbumArtists,Container',
+            'SortBy': 'SortName',
+            'SortOrder': 'Ascending',
+            'EnableImages': 'false',
+            'EnableUserData': 'false',
+            'StartIndex': start_index,
+            'Limit': limit
+        }
+        if min_date_last_saved:
+            params['MinDateLastSaved'] = min_date_last_saved
+        self.logger.debug(f"Url={url} StartIndex={start_index}")
+
+        response = self.session.get(url, headers=self._get_headers(session_token=session_token), params=params, timeout = self.timeout)
+        self.logger.debug(f"Response = {response.status_code}")
+
+        if response.status_code == 200:
+            return response.json()
+        else:
+            raise Exception(f"Failed to get audio items: {response.content}")
+
     def add_songs_to_playlist(self, session_token: str, user_id: str, playlist_id: str, song_ids: list[str]):
         """
         Add songs to an existing playlist in batches to prevent URL length issues.
@@ -292,7 +430,7 @@ class JellyfinClient:
             }
             self.logger.debug(f"Url={url} - Adding batch: {batch}")
 
-            response = requests.post(
+            response = self.session.post(
                 url,
                 headers=self._get_headers(session_token=session_token),
                 params=params,
@@ -305,11 +443,80 @@ class JellyfinClient:
 
         return {"status": "success", "message": "Songs added to playlist successfully"}
 
+    def get_playlist_items(self, session_token: str, user_id: str, playlist_id: str) -> List[Tuple[str, str]]:
+        """
+        Get the entries of a playlist in their order.
+        :param playlist_id: The ID of the playlist.
+        :return: A list of tuples (entry id, item id), the entry id identifies the position of an item in the playlist.
+        """
+        url = f'{self.base_url}/Playlists/{playlist_id}/Items'
+        page_size = 1000
+        entries = []
+        while True:
+            params = {
+                'userId': user_id,
+                'StartIndex': len(entries),
+                'Limit': page_size,
+                'EnableImages': 'false',
+                'EnableUserData': 'false'
+            }
+            self.logger.debug(f"Url={url} StartIndex={len(entries)}")
+            response = self.session.get(url, headers=self._get_headers(session_token=session_token), params=params, timeout=self.timeout)
+            self.logger.debug(f"Response = {response.status_code}")
+            if response.status_code != 200:
+                raise Exception(f"Failed to get playlist items: {response.content}")
+            data = response.json()
+            items = data.get('Items', [])
+            entries.extend((item['PlaylistItemId'], item['Id']) for item in items)
+            if not items or len(entries) >= data.get('TotalRecordCount', 0):
+                return entries
+
+    def move_playlist_item(self, session_token: str, playlist_id: str, entry_id: str, new_index: int):
+        """
+        Move an entry of a playlist to another position.
+        :param entry_id: The entry id of the item as returned by get_playlist_items.
+        :param new_index: The position of the entry after the move.
+        """
+        url = f'{self.base_url}/Playlists/{playlist_id}/Items/{entry_id}/Move/{new_index}'
+        self.logger.debug(f"Url={url}")
+
+        response = self.session.post(url, headers=self._get_headers(session_token=session_token), timeout=self.timeout)
+        self.logger.debug(f"Response = {response.status_code}")
+
+        if response.status_code != 204:
+            raise Exception(f"Failed to move playlist item: {response.status_code} - {response.content}")
+
+    def sync_playlist_items(self, session_token: str, user_id: str, playlist_id: str, item_ids: List[str]) -> dict:
+        """
+        Bring a playlist in line with the desired items and their order with as few requests as possible.
+        The current entries are fetched once, then only missing items are added, surplus entries removed and
+        entries which are out of order moved. An unchanged playlist costs a single request.
+        :param playlist_id: The ID of the playlist to update.
+        :param item_ids: The item ids in the desired order.
+        :return: A dict with the number of added, removed and moved entries.
+        """
+        current = self.get_playlist_items(session_token, user_id, playlist_id)
+        remove, add = playlist_entry_changes(current, item_ids)
+        if remove:
+            self.remove_songs_from_playlist(session_token, playlist_id, remove)
+        if add:
+            self.add_songs_to_playlist(session_token, user_id, playlist_id, add)
+            # the entry ids of the added items are only known after adding them
+            current = self.get_playlist_items(session_token, user_id, playlist_id)
+        else:
+            removed = set(remove)
+            current = [entry for entry in current if entry[0] not in removed]
+        moves = playlist_moves(current, item_ids)
+        for entry_id, new_index in moves:
+            self.move_playlist_item(session_token, playlist_id, entry_id, new_index)
+        self.logger.debug(f"Synced playlist {playlist_id}: {len(add)} added, {len(remove)} removed, {len(moves)} moved")
+        return {'added': len(add), 'removed': len(remove), 'moved': len(moves)}
+
     def remove_songs_from_playlist(self, session_token: str, playlist_id: str, song_ids):
         """
         Remove songs from an existing playlist.
         :param playlist_id: The ID of the playlist to update.
-        :param song_ids: A list of song IDs to remove.
+        :param song_ids: A list of entry IDs to remove, see get_playlist_items.
         :return: A success message.
         """
         batch_size = 50
@@ -324,7 +531,7 @@ class JellyfinClient:
             }
             self.logger.debug(f"Url={url} - Removing batch: {batch}")
 
-            response = requests.delete(url, headers=self._get_headers(session_token=session_token), params=params, timeout=self.timeout)
+            response = self.session.delete(url, headers=self._get_headers(session_token=session_token), params=params, timeout=self.timeout)
             self.logger.debug(f"Response = {response.status_code}")
 
             if response.status_code != 204:  # 204 No Content indicates success for updating
@@ -341,7 +548,7 @@ class JellyfinClient:
         url = f'{self.base_url}/Items/{playlist_id}'
         self.logger.debug(f"Url={url}")
         
-        response = requests.delete(url, headers=self._get_headers(session_token=session_token), timeout = self.timeout)
+        response = self.session.delete(url, headers=self._get_headers(session_token=session_token), timeout = self.timeout)
         self.logger.debug(f"Response = {response.status_code}")
         logging.getLogger('requests').setLevel(logging.WARNING)
 
@@ -353,7 +560,7 @@ class JellyfinClient:
     def get_item(self, session_token: str, item_id: str):
         url = f'{self.base_url}/Items/{item_id}'
         logging.getLogger('requests').setLevel(logging.WARNING)
-        response = requests.get(url, headers=self._get_headers(session_token=session_token), timeout = self.timeout)
+        response = self.session.get(url, headers=self._get_headers(session_token=session_token), timeout = self.timeout)
         if response.status_code == 200:
             return response.json()
         else:
@@ -373,7 +580,7 @@ class JellyfinClient:
         self.logger.debug(f"Url={url}")
         
         # Send the DELETE request to remove the user from the playlist
-        response = requests.delete(url, headers=self._get_headers(session_token= session_token), timeout = self.timeout)
+        response = self.session.delete(url, headers=self._get_headers(session_token= session_token), timeout = self.timeout)
         self.logger.debug(f"Response = {response.status_code}")
         
         if response.status_code == 204:
@@ -402,7 +609,7 @@ class JellyfinClient:
         headers = self._get_headers(session_token=session_token)
         
         # Send the request to Jellyfin API
-        response = requests.post(url, headers=headers, json=data,timeout = self.timeout)
+        response = self.session.post(url, headers=headers, json=data,timeout = self.timeout)
 
         # Check for success
         if response.status_code == 204:
@@ -422,7 +629,7 @@ class JellyfinClient:
         :return: Success message or raises an exception on failure.
         """
         # Step 1: Download the image from the Spotify URL
-        response = requests.get(provider_image_url, timeout = self.timeout)
+        response = transport.get_session(provider_image_url).get(provider_image_url, timeout = self.timeout)
         
         if response.status_code != 200:
             raise Exception(f"Failed to download image from Spotify: {response.content}")
@@ -447,7 +654,7 @@ class JellyfinClient:
         self.logger.debug(f"Url={url}")
         
         # Send the Base64-encoded image data
-        upload_response = requests.post(url, headers=headers, data=image_base64, timeout = self.timeout)
+        upload_response = self.session.post(url, headers=headers, data=image_base64, timeout = self.timeout)
         self.logger.debug(f"Response = {response.status_code}")
         
         if upload_response.status_code == 204:  # 204 No Content indicates success
@@ -484,7 +691,7 @@ class JellyfinClient:
         headers = self._get_headers(session_token=session_token)
         
         # Send the request to Jellyfin API
-        response = requests.post(url, headers=headers, json=data,timeout = self.timeout)
+        response = self.session.post(url, headers=headers, json=data,timeout = self.timeout)
 
         # Check for success
         if response.status_code == 204:
@@ -493,22 +700,10 @@ class JellyfinClient:
         else:
             raise Exception(f"Failed to add users to playlist: {response.status_code} - {response.content}")
         
-    def get_me(self, session_token: str):
-        """
-        
-        """
-        me_url = f'{self.base_url}/Users/Me'
-        response = requests.get(me_url, headers=self._get_headers(session_token=session_token), timeout = self.timeout)
-        
-        if response.status_code == 200:
-            return response.json()
-        else:
-            raise Exception(f"Failed to get playlists: {response.content}")
-        
     def get_playlist_users(self, session_token: str, playlist_id: str):
         url = f'{self.base_url}/Playlists/{playlist_id}/Users'
         
-        response = requests.get(url, headers=self._get_headers(session_token=session_token), timeout = self.timeout)
+        response = self.session.get(url, headers=self._get_headers(session_token=session_token), timeout = self.timeout)
         
         if response.status_code != 200:
             raise Exception(f"Failed to fetch playlist metadata: {response.content}")
@@ -520,47 +715,40 @@ class JellyfinClient:
         if user_id:
             url = f'{url}/{user_id}'
         
-        response = requests.get(url, headers=self._get_headers(session_token=session_token), timeout = self.timeout)
+        response = self.session.get(url, headers=self._get_headers(session_token=session_token), timeout = self.timeout)
         
         if response.status_code != 200:
             raise Exception(f"Failed to fetch users: {response.content}")
     
         return response.json()
         
-    def search_track_in_jellyfin(self, session_token: str, preview_url: str, song_name: str, artist_names: list):
+    def search_track_in_jellyfin(self, session_token: str, preview_url: str, song_name: str, artist_names: list, fingerprint_store: Optional[Callable] = None):
         """
         Search for a track in Jellyfin by comparing the preview audio to tracks in the library.
         :param session_token: The session token for Jellyfin API access.
         :param preview_url: The URL to the Spotify preview audio.
         :param song_name: The name of the song to search for.
         :param artist_names: A list of artist names.
+        :param fingerprint_store: Optional callable taking a search result and returning its stored fingerprint or None.
         :return: Tuple (match_found: bool, jellyfin_file_path: Optional[str])
         """
         try:
-            # Download the Spotify preview audio
-            
+            # imported here, the fingerprinting libraries are slow to import and only needed for this search
+            from jellyfin.fingerprint import fingerprint_data, fingerprint_file
 
-            self.logger.debug(f"Downloading preview  {preview_url} to tmp file")
-            tmp = self.download_preview_to_tempfile(preview_url=preview_url)
-            if tmp is None:
-                self.logger.error(f"Downloading preview  {preview_url} to tmp file failed, not continuing")
+            # Download the Spotify preview audio
+            self.logger.debug(f"Downloading preview  {preview_url}")
+            preview = self.download_preview(preview_url=preview_url)
+            if preview is None:
+                self.logger.error(f"Downloading preview  {preview_url} failed, not continuing")
                 return False, None
 
-            # Convert the preview file to a normalized WAV file
-            self.logger.debug(f"Converting preview to WAV file")
-            
-            tmp_wav = self.convert_to_wav(tmp)
-            if tmp_wav is None:
-                self.logger.error(f"Converting preview to WAV failed, not continuing")
-                os.remove(tmp)
+            # Fingerprint the preview, ffmpeg decodes it from memory
+            self.logger.debug(f"Performing fingerprinting on preview")
+            tmp_fp_dec = fingerprint_data(preview)
+            if tmp_fp_dec is None:
+                self.logger.error(f"Fingerprinting the preview failed, not continuing")
                 return False, None
-
-            # Fingerprint the normalized preview WAV file
-            self.logger.debug(f"Performing fingerprinting on preview {tmp_wav}")
-
-            _, tmp_fp = acoustid.fingerprint_file(tmp_wav)
-            tmp_fp_dec, version = chromaprint.decode_fingerprint(tmp_fp)
-            tmp_fp_dec = np.array(tmp_fp_dec, dtype=np.uint32)
             self.logger.debug(f"decoded fingerprint for preview: {tmp_fp_dec[:5]}")
 
             # Search for matching tracks in Jellyfin using only the song name
@@ -584,22 +772,16 @@ class JellyfinClient:
                 if not jellyfin_file_path:
                     continue
 
-                # Convert the full Jellyfin track to a normalized WAV file
-                jellyfin_wav = self.convert_to_wav(jellyfin_file_path)
-                if jellyfin_wav is None:
+                # Use the stored fingerprint of the Jellyfin track, fingerprint the file only if there is none
+                full_fp_dec = fingerprint_store(result) if fingerprint_store else None
+                if full_fp_dec is None:
+                    full_fp_dec = fingerprint_file(jellyfin_file_path)
+                if full_fp_dec is None:
                     continue
 
-                # Fingerprint the normalized Jellyfin WAV file
-                _, full_fp = acoustid.fingerprint_file(jellyfin_wav)
-                full_fp_dec, version2 = chromaprint.decode_fingerprint(full_fp)
-                full_fp_dec = np.array(full_fp_dec, dtype=np.uint32)
-
                 # Compare fingerprints using the sliding similarity function
                 sim, best_offset = self.sliding_fingerprint_similarity(full_fp_dec, tmp_fp_dec)
 
-                # Clean up temporary files
-                os.remove(jellyfin_wav)
-
                 # Store the match data
                 matches.append({
                     'jellyfin_file_path': jellyfin_file_path,
@@ -609,10 +791,6 @@ class JellyfinClient:
                     'artists': jellyfin_artists,
                 })
 
-            # Clean up the preview files
-            os.remove(tmp_wav)
-            os.remove(tmp)
-
             # After processing all tracks, select the best match
             if matches:
                 best_match = max(matches, key=lambda x: x['similarity'])
@@ -629,70 +807,23 @@ class JellyfinClient:
             return False, None
 
     # Helper methods used in search_track_in_jellyfin
-    def download_preview_to_tempfile(self, preview_url):
+    def download_preview(self, preview_url) -> Optional[bytes]:
         try:
-            response = requests.get(preview_url, timeout = self.timeout)
+            response = transport.get_session(preview_url).get(preview_url, timeout = self.timeout)
             if response.status_code != 200:
                 return None
-
-            # Save to a temporary file
-            tmp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".mp3")
-            tmp_file.write(response.content)
-            tmp_file.close()
-            return tmp_file.name
-        except Exception as e:
-            print(f"Error downloading preview: {str(e)}")
-            return None
-
-    def convert_to_wav(self, input_file_path):
-        try:
-            output_file = tempfile.NamedTemporaryFile(delete=False, suffix=".wav")
-            output_file.close()
-
-            # Use ffmpeg to convert to WAV and normalize audio
-            command = [
-                "ffmpeg", "-y", "-i", input_file_path,
-                "-acodec", "pcm_s16le", "-ar", "44100",
-                "-ac", "2", output_file.name
-            ]
-            result = subprocess.run(command, capture_output=True, text=True)
-            if result.returncode != 0:
-                self.logger.error(f"Error converting to WAV, subprocess exitcode: {result.returncode} , input_file_path = {input_file_path}")
-                self.logger.error(f"\tprocess stdout: {result.stdout}")
-                self.logger.error(f"\tprocess stderr: {result.stderr}")
-                
-                os.remove(output_file.name)
-                return None
-
-            return output_file.name
+            return response.content
         except Exception as e:
-            self.logger.error(f"Error converting to WAV: {str(e)}")
+            self.logger.error(f"Error downloading preview: {str(e)}")
             return None
 
     def sliding_fingerprint_similarity(self, full_fp, preview_fp):
-        len_full = len(full_fp)
-        len_preview = len(preview_fp)
-
-        best_score = float('inf')
-        best_offset = 0
-
-        max_offset = len_full - len_preview
-
-        if max_offset < 0:
-            return 0, 0
-
-        total_bits = len_preview * 32  # Total bits in the preview fingerprint
-
-        for offset in range(max_offset + 1):
-            segment = full_fp[offset:offset + len_preview]
-            xored = np.bitwise_xor(segment, preview_fp)
-            diff_bits = np.unpackbits(xored.view(np.uint8)).sum()
-            score = diff_bits / total_bits  # Lower score is better
-
-            if score < best_score:
-                best_score = score
-                best_offset = offset
-
-        similarity = (1 - best_score) * 100  # Convert to percentage
-
-        return similarity, best_offset
+        """
+        Compare a preview fingerprint against the fingerprint of a full track at every position.
+        :param full_fp: Decoded fingerprint of the full track.
+        :param preview_fp: Decoded fingerprint of the preview.
+        :return: Tuple (similarity in percent, best offset)
+        """
+        # imported here, numpy is slow to import and only needed for fingerprinting
+        from jellyfin.fingerprint import sliding_similarity
+        return sliding_similarity(full_fp, preview_fp)
@@ -0,0 +1,191 @@
+import subprocess
+import threading
+from typing import Optional
+
+import acoustid
+import chromaprint
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# number of set bits for every 16 bit value, a uint32 is counted with two lookups
+_POPCOUNT_16 = np.array([bin(i).count('1') for i in range(1 << 16)], dtype=np.uint8)
+
+
+def popcount(values: np.ndarray) -> np.ndarray:
+    """
+    Counts the set bits of every element of a uint32 array.
+    :param values: Array of uint32 values.
+    :return: Array of the same shape with the number of set bits per element.
+    """
+    return _POPCOUNT_16[values & 0xFFFF] + _POPCOUNT_16[values >> 16]
+
+
+# decoded PCM format fed to chromaprint, signed 16 bit little endian
+SAMPLE_RATE = 44100
+CHANNELS = 2
+# chromaprint only looks at the beginning of a track, like acoustid.fingerprint_file
+MAX_SECONDS = 120
+_BLOCK_SIZE = 64 * 1024
+
+
+def fingerprint_file(path: str, max_seconds: int = MAX_SECONDS) -> Optional[np.ndarray]:
+    """
+    Computes the decoded chromaprint fingerprint of an audio file. ffmpeg decodes only the first max_seconds
+    and streams raw PCM through a pipe into the fingerprinter, no temporary files are written.
+    Runs in worker processes of the fingerprint store, so it must not depend on the app.
+    :param path: Path of the audio file.
+    :param max_seconds: Number of seconds from the beginning of the file to fingerprint.
+    :return: The fingerprint as uint32 array, or None if the file could not be decoded.
+    """
+    return _fingerprint_ffmpeg(path, None, max_seconds)
+
+
+def fingerprint_data(data: bytes, max_seconds: int = MAX_SECONDS) -> Optional[np.ndarray]:
+    """
+    Computes the decoded chromaprint fingerprint of encoded audio in memory, e.g. a downloaded preview.
+    The audio is written to ffmpeg through a pipe.
+    :param data: The encoded audio, in any format ffmpeg can read.
+    :param max_seconds: Number of seconds from the beginning of the audio to fingerprint.
+    :return: The fingerprint as uint32 array, or None if the audio could not be decoded.
+    """
+    return _fingerprint_ffmpeg('pipe:0', data, max_seconds)
+
+
+def _fingerprint_ffmpeg(source: str, data: Optional[bytes], max_seconds: int) -> Optional[np.ndarray]:
+    command = [
+        "ffmpeg", "-loglevel", "error",
+        *(["-nostdin"] if data is None else []),
+        "-i", source, "-t", str(max_seconds),
+        "-f", "s16le", "-acodec", "pcm_s16le", "-ar", str(SAMPLE_RATE),
+        "-ac", str(CHANNELS), "pipe:1"
+    ]
+    process = subprocess.Popen(
+        command,
+        stdin=subprocess.PIPE if data is not None else subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL
+    )
+    writer = None
+    if data is not None:
+        # ffmpeg starts writing output before it read all input, so the input is written from another thread
+        def write_input():
+            try:
+                process.stdin.write(data)
+            except BrokenPipeError:
+                pass
+            finally:
+                process.stdin.close()
+        writer = threading.Thread(target=write_input, daemon=True)
+        writer.start()
+    try:
+        fp = acoustid.fingerprint(SAMPLE_RATE, CHANNELS, iter(lambda: process.stdout.read(_BLOCK_SIZE), b''), max_seconds)
+    except acoustid.FingerprintGenerationError:
+        fp = None
+    finally:
+        process.stdout.close()
+        process.wait()
+        if writer:
+            writer.join()
+    # the fingerprinter may stop reading before ffmpeg exits, so the exit code is not checked
+    if not fp:
+        return None
+    decoded, _ = chromaprint.decode_fingerprint(fp)
+    return np.array(decoded, dtype=np.uint32)
+
+
+def to_bytes(fingerprint: np.ndarray) -> bytes:
+    return np.asarray(fingerprint, dtype='<u4').tobytes()
+
+
+def from_bytes(data: bytes) -> np.ndarray:
+    return np.frombuffer(data, dtype='<u4').astype(np.uint32)
+
+
+def _bit_errors(windows: np.ndarray, preview_fp: np.ndarray) -> np.ndarray:
+    return popcount(np.bitwise_xor(windows, preview_fp)).sum(axis=1, dtype=np.int64)
+
+
+def sliding_similarity(full_fp: np.ndarray, preview_fp: np.ndarray, coarse_step: int = 4, candidates: int = 8,
+                       stop_error_rate: float = 0.05, chunk_size: int = 512):
+    """
+    Finds the offset of the preview fingerprint within the full fingerprint with the lowest bit error rate.
+
+    A coarse pass compares every coarse_step-th item of the preview at every coarse_step-th offset. The best
+    candidates of the coarse pass are then compared exactly, including the offsets around them. Chromaprint
+    items overlap in time, so neighbouring offsets have similar scores and the coarse pass finds the area of
+    the best match. Offsets are processed in chunks, and the search stops as soon as a chunk contains an exact
+    match with an error rate below stop_error_rate.
+
+    :param full_fp: Decoded fingerprint of the full track as uint32 array.
+    :param preview_fp: Decoded fingerprint of the preview as uint32 array.
+    :param coarse_step: Stride of the coarse pass over offsets and preview items, 1 compares everything exactly.
+    :param candidates: Number of coarse results which are compared exactly.
+    :param stop_error_rate: Bit error rate at which a match is considered perfect and the search stops.
+    :param chunk_size: Number of offsets processed at once, bounds the memory used.
+    :return: Tuple (similarity in percent, best offset)
+    """
+    full_fp = np.asarray(full_fp, dtype=np.uint32)
+    preview_fp = np.asarray(preview_fp, dtype=np.uint32)
+    len_preview = len(preview_fp)
+    max_offset = len(full_fp) - len_preview
+    if max_offset < 0 or len_preview == 0:
+        return 0, 0
+
+    total_bits = len_preview * 32
+    windows = sliding_window_view(full_fp, len_preview)
+    coarse_step = max(1, min(coarse_step, len_preview))
+    best_errors = None
+    best_offset = 0
+
+    for chunk_start in range(0, max_offset + 1, chunk_size):
+        chunk_end = min(chunk_start + chunk_size, max_offset + 1)
+        coarse_offsets = np.arange(chunk_start, chunk_end, coarse_step)
+        coarse_errors = _bit_errors(windows[coarse_offsets, ::coarse_step], preview_fp[::coarse_step])
+
+        # compare the best coarse candidates exactly, together with the offsets skipped around them
+        top = coarse_offsets[np.argsort(coarse_errors, kind='stable')[:candidates]]
+        fine_offsets = np.unique(np.clip(
+            (top[:, None] + np.arange(-coarse_step + 1, coarse_step)[None, :]).ravel(), 0, max_offset
+        ))
+        fine_errors = _bit_errors(windows[fine_offsets], preview_fp)
+        index = int(np.argmin(fine_errors))
+        if best_errors is None or fine_errors[index] < best_errors:
+            best_errors = int(fine_errors[index])
+            best_offset = int(fine_offsets[index])
+        if best_errors / total_bits <= stop_error_rate:
+            break
+
+    similarity = (1 - best_errors / total_bits) * 100  # Convert to percentage
+    return similarity, best_offset
+
+
+def sliding_similarity_loop(full_fp: np.ndarray, preview_fp: np.ndarray):
+    """
+    Reference implementation comparing the preview at every offset, used by the benchmark.
+    """
+    len_full = len(full_fp)
+    len_preview = len(preview_fp)
+
+    best_score = float('inf')
+    best_offset = 0
+
+    max_offset = len_full - len_preview
+
+    if max_offset < 0:
+        return 0, 0
+
+    total_bits = len_preview * 32  # Total bits in the preview fingerprint
+
+    for offset in range(max_offset + 1):
+        segment = full_fp[offset:offset + len_preview]
+        xored = np.bitwise_xor(segment, preview_fp)
+        diff_bits = np.unpackbits(xored.view(np.uint8)).sum()
+        score = diff_bits / total_bits  # Lower score is better
+
+        if score < best_score:
+            best_score = score
+            best_offset = offset
+
+    similarity = (1 - best_score) * 100  # Convert to percentage
+
+    return similarity, best_offset
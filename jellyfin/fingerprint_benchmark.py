@@ -0,0 +1,62 @@
+"""
+Compares the vectorized sliding fingerprint similarity with the loop implementation.
+
+Usage: python -m jellyfin.fingerprint_benchmark [--tracks 20] [--track-seconds 180] [--preview-seconds 30]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from jellyfin.fingerprint import sliding_similarity, sliding_similarity_loop
+
+# chromaprint produces about 8 fingerprint items per second of audio
+ITEMS_PER_SECOND = 8
+
+
+def random_bit_flips(rng: np.random.Generator, count: int, probability: float) -> np.ndarray:
+    flips = rng.random((count, 32)) < probability
+    return (flips * (1 << np.arange(32, dtype=np.uint64))).sum(axis=1).astype(np.uint32)
+
+
+def make_fingerprints(rng: np.random.Generator, track_seconds: int, preview_seconds: int, noise: float, drift: float):
+    """
+    Builds a fingerprint of a full track and a preview cut from it. Like in real chromaprint fingerprints,
+    neighbouring items only differ in a few bits (drift). The preview gets a share of flipped bits (noise),
+    simulating the differences between the encodings of preview and library file.
+    """
+    full_fp = np.bitwise_xor.accumulate(random_bit_flips(rng, track_seconds * ITEMS_PER_SECOND, drift))
+    len_preview = preview_seconds * ITEMS_PER_SECOND
+    offset = int(rng.integers(0, len(full_fp) - len_preview + 1))
+    preview_fp = full_fp[offset:offset + len_preview] ^ random_bit_flips(rng, len_preview, noise)
+    return full_fp, preview_fp, offset
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tracks', type=int, default=20)
+    parser.add_argument('--track-seconds', type=int, default=180)
+    parser.add_argument('--preview-seconds', type=int, default=30)
+    parser.add_argument('--noise', type=float, default=0.1, help='share of flipped bits in the preview')
+    parser.add_argument('--drift', type=float, default=0.1, help='share of bits changing between neighbouring items')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    cases = [make_fingerprints(rng, args.track_seconds, args.preview_seconds, args.noise, args.drift) for _ in range(args.tracks)]
+
+    results = {}
+    for name, func in (('loop', sliding_similarity_loop), ('vectorized', sliding_similarity)):
+        started = time.perf_counter()
+        results[name] = [func(full_fp, preview_fp) for full_fp, preview_fp, _ in cases]
+        elapsed = time.perf_counter() - started
+        print(f"{name:>10}: {elapsed:8.3f}s total, {elapsed / len(cases) * 1000:8.2f}ms per track")
+
+    same_offset = sum(1 for (_, a), (_, b) in zip(results['loop'], results['vectorized']) if a == b)
+    correct = sum(1 for (_, found), (_, _, offset) in zip(results['vectorized'], cases) if found == offset)
+    print(f"vectorized found the same offset as the loop for {same_offset}/{len(cases)} tracks, "
+          f"the true offset for {correct}/{len(cases)} tracks")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,10 @@
 import json
 import re
 from flask import jsonify
-import requests
 from typing import List, Optional
 from .classes import Album, Artist, QualityProfile, RootFolder
 import logging
+import transport
 l = logging.getLogger(__name__)
 
 class LidarrClient:
@@ -15,17 +15,22 @@ class LidarrClient:
             'X-Api-Key': self.api_token
         }
 
+    @property
+    def session(self):
+        # looked up on every call, so sessions recreated after configure() or a fork are used
+        return transport.get_session(self.base_url)
+
     def _get(self, endpoint: str, params: Optional[dict] = None):
-        response = requests.get(f"{self.base_url}{endpoint}", headers=self.headers, params=params)
+        response = self.session.get(f"{self.base_url}{endpoint}", headers=self.headers, params=params)
         response.raise_for_status()
         return response.json()
     def _post(self, endpoint: str, json: dict):
-        response = requests.post(f"{self.base_url}{endpoint}", headers=self.headers, json=json)
+        response = self.session.post(f"{self.base_url}{endpoint}", headers=self.headers, json=json)
         response.raise_for_status()
         return response.json()
 
     def _put(self, endpoint: str, json: dict):
-        response = requests.put(f"{self.base_url}{endpoint}", headers=self.headers, json=json)
+        response = self.session.put(f"{self.base_url}{endpoint}", headers=self.headers, json=json)
         response.raise_for_status()
         return response.json()
 
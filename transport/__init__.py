@@ -0,0 +1,2 @@
+from .session import add_response_hook, configure, get_session
+__all__ = ["add_response_hook", "configure", "get_session"]
@@ -0,0 +1,139 @@
+import logging
+import os
+import threading
+from http.cookiejar import DefaultCookiePolicy
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+l = logging.getLogger(__name__)
+
+_settings = {
+    'pool_connections': 10,
+    'pool_maxsize': 20,
+    'max_retries': 3,
+    'backoff_factor': 0.5,
+    'timeout': 30,
+}
+_sessions: Dict[str, requests.Session] = {}
+_hooks: Dict[str, List[Callable]] = {}
+_lock = threading.Lock()
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter which applies a default timeout to every request that does not set one.
+    """
+    def __init__(self, *args, timeout: Optional[float] = None, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def configure(pool_connections: Optional[int] = None, pool_maxsize: Optional[int] = None, max_retries: Optional[int] = None,
+              backoff_factor: Optional[float] = None, timeout: Optional[float] = None) -> None:
+    """
+    Set the pool, retry and timeout policy for all sessions. Sessions which already exist are recreated on next use.
+    :param pool_connections: Number of connection pools to cache per session.
+    :param pool_maxsize: Maximum number of connections kept alive per host.
+    :param max_retries: Number of retries for failed idempotent requests.
+    :param backoff_factor: Backoff factor between retries, see urllib3 Retry.
+    :param timeout: Default timeout in seconds for requests which do not pass one.
+    """
+    updates = {
+        'pool_connections': pool_connections,
+        'pool_maxsize': pool_maxsize,
+        'max_retries': max_retries,
+        'backoff_factor': backoff_factor,
+        'timeout': timeout,
+    }
+    with _lock:
+        _settings.update({key: value for key, value in updates.items() if value is not None})
+        _close_sessions()
+    l.debug(f"HTTP transport configured: {_settings}")
+
+
+def get_session(url: str) -> requests.Session:
+    """
+    Returns the shared session for the host of the given url, creating it on first use.
+    :param url: Any url on the host, e.g. the base url of an API.
+    :return: A requests.Session with keep-alive connection pooling, retries and a default timeout.
+    """
+    key = _session_key(url)
+    session = _sessions.get(key)
+    if session is None:
+        with _lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = _create_session(key)
+                _sessions[key] = session
+                l.debug(f"Created HTTP session for {key}")
+    return session
+
+
+def add_response_hook(url: str, hook: Callable) -> None:
+    """
+    Registers a requests response hook for all requests to the host of the given url.
+    The hook is kept when sessions are recreated after configure() or a fork.
+    :param url: Any url on the host.
+    :param hook: A callable taking the response, see the requests documentation on event hooks.
+    """
+    key = _session_key(url)
+    with _lock:
+        _hooks.setdefault(key, []).append(hook)
+        if key in _sessions:
+            _sessions[key].hooks['response'].append(hook)
+
+
+def _session_key(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def _create_session(key: str) -> requests.Session:
+    retry = Retry(
+        total=_settings['max_retries'],
+        backoff_factor=_settings['backoff_factor'],
+        status_forcelist=(429, 500, 502, 503, 504),
+        # POST is not idempotent here (e.g. adding items to a playlist), so it is never retried
+        allowed_methods=frozenset(['HEAD', 'GET', 'PUT', 'DELETE', 'OPTIONS']),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = TimeoutHTTPAdapter(
+        pool_connections=_settings['pool_connections'],
+        pool_maxsize=_settings['pool_maxsize'],
+        max_retries=retry,
+        timeout=_settings['timeout'],
+    )
+    session = requests.Session()
+    # the sessions are shared between all clients, so they must not pick up cookies from responses
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.hooks['response'].extend(_hooks.get(key, []))
+    return session
+
+
+def _close_sessions() -> None:
+    for session in _sessions.values():
+        session.close()
+    _sessions.clear()
+
+
+def _reset_after_fork() -> None:
+    # pooled sockets must not be shared with forked celery workers
+    global _lock
+    _lock = threading.Lock()
+    _sessions.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)